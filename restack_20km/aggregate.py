@@ -0,0 +1,366 @@
+"""Aggregate the daily files to monthly, seasonal and annual. Each daily file (a variable-year) is read one month
+at a time, and the sum, count, minimum and maximum of the valid days of each month are written to a monthly file.
+The seasonal (DJF, MAM, JJA, SON) and annual files are then made by combining these monthly statistics, without
+reading any daily or hourly data. The DJF season of a year includes the December of the previous year, taken from
+the previous year's monthly file if there is one.
+
+Usage:
+    python aggregate.py -r $SCRATCH_DIR/restacked -y 2006-2100 -v t2 t2max t2min pcpt -fs GFDL-CM3_rcp85 -n 24
+"""
+
+import argparse
+import time
+import warnings
+from multiprocessing import Pool
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import xarray as xr
+# project
+import luts
+from restack import get_profile_encoding, parse_year_str
+
+
+# statistics that are carried up from monthly to seasonal and annual
+stat_names = ["sum", "count", "min", "max"]
+
+
+def get_stats(arr):
+    """Get the statistics of the valid values of an array of days
+
+    Args:
+        arr (numpy.ndarray): daily data, time dimension first
+
+    Returns:
+        dict of the sum, count, min and max of arr along the time dimension.
+            Pixels with no valid days have a min and max of NaN.
+    """
+    with warnings.catch_warnings():
+        # all-missing slices give missing values
+        warnings.simplefilter("ignore", RuntimeWarning)
+        stats = {
+            "sum": np.nansum(arr, axis=0, dtype=np.float64),
+            "count": np.sum(~np.isnan(arr), axis=0),
+            "min": np.nanmin(arr, axis=0),
+            "max": np.nanmax(arr, axis=0),
+        }
+
+    return stats
+
+
+def combine_stats(stats_list):
+    """Combine the statistics of consecutive periods, e.g. the months of a season
+
+    Args:
+        stats_list (list): statistics of each period, see get_stats
+
+    Returns:
+        dict of the sum, count, min and max over all of the periods
+    """
+    stats = {
+        "sum": np.sum([stats["sum"] for stats in stats_list], axis=0),
+        "count": np.sum([stats["count"] for stats in stats_list], axis=0),
+        # fmin and fmax ignore NaNs from periods with no valid days
+        "min": np.fmin.reduce([stats["min"] for stats in stats_list]),
+        "max": np.fmax.reduce([stats["max"] for stats in stats_list]),
+    }
+
+    return stats
+
+
+def read_daily_stats(daily_fp, varname):
+    """Get the monthly statistics of a daily file, reading it one month at a time
+
+    Args:
+        daily_fp (pathlib.Path): path to the daily file
+        varname (str): name of the daily variable
+
+    Returns:
+        tuple of (month_dates, stats_list, template_ds), where month_dates is a
+            pandas.DatetimeIndex of the first day of each month, stats_list has the
+            statistics of each month, see get_stats, and template_ds is the daily
+            dataset without the time dimension, for the metadata
+    """
+    with xr.open_dataset(daily_fp) as ds:
+        dates = ds.indexes["time"]
+        month_dates = pd.DatetimeIndex(
+            np.unique(dates.values.astype("datetime64[M]")).astype("datetime64[ns]")
+        )
+        # days are sorted, so each month is a contiguous slice
+        starts = np.searchsorted(dates.values, month_dates.values)
+        stops = np.append(starts[1:], len(dates))
+        stats_list = [
+            get_stats(ds[varname][start:stop].values)
+            for start, stop in zip(starts, stops)
+        ]
+        template_ds = ds.drop_dims("time").load()
+        template_ds[varname] = ds[varname].isel(time=0, drop=True).load()
+
+    return month_dates, stats_list, template_ds
+
+
+def read_stats(fp, varname):
+    """Read the statistics of each time step of a monthly (or coarser) file
+
+    Args:
+        fp (pathlib.Path): path to a file written by aggregate_monthly
+        varname (str): name of the daily variable
+
+    Returns:
+        tuple of (dates, stats_list), see read_daily_stats
+    """
+    with xr.open_dataset(fp) as ds:
+        dates = ds.indexes["time"]
+        arrs = {stat: ds[f"{varname}_{stat}"].values for stat in stat_names}
+    stats_list = [
+        {stat: arrs[stat][i] for stat in stat_names} for i in range(len(dates))
+    ]
+
+    return dates, stats_list
+
+
+def make_stats_ds(dates, stats_list, template_ds, varname, period, profile="default"):
+    """Make the dataset of the statistics of each period, with the mean of the
+    valid days, and set the encoding for serialization
+
+    Args:
+        dates (pandas.DatetimeIndex): first day of each period
+        stats_list (list): statistics of each period, see get_stats
+        template_ds (xarray.Dataset): daily dataset without the time dimension,
+            from read_daily_stats
+        varname (str): name of the daily variable
+        period (str): name of the period, "monthly", "seasonal" or "annual"
+        profile (str): name of the encoding profile in luts.encoding_profiles
+
+    Returns:
+        ds (xarray.Dataset): dataset with the {varname}_{stat} variables
+    """
+    da = template_ds[varname]
+    dims = ("time",) + da.dims
+    ds = template_ds.drop_vars(varname).assign_coords(time=dates)
+    ds["time"].attrs = luts.coord_attrs["time"]
+    ds.attrs = dict(template_ds.attrs)
+    ds.attrs["history"] += f"\naggregate date: {time.ctime()} AKST"
+
+    arrs = {stat: np.stack([stats[stat] for stats in stats_list]) for stat in stat_names}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        arrs["mean"] = arrs["sum"] / arrs["count"]
+    descriptions = {
+        "mean": "mean of the valid daily values",
+        "sum": "sum of the valid daily values",
+        "count": "number of valid daily values",
+        "min": "minimum of the valid daily values",
+        "max": "maximum of the valid daily values",
+    }
+    for stat in ["mean"] + stat_names:
+        attrs = dict(da.attrs)
+        # the range of the daily data does not apply to the statistics
+        attrs.pop("valid_min", None)
+        attrs.pop("valid_max", None)
+        attrs["temporal_resampling"] = (
+            f"{period.capitalize()}: these data represent the {descriptions[stat]} "
+            f"of the daily {varname} data in each period."
+        )
+        if stat == "count":
+            for attr in ["units", "_FillValue", "missing_value"]:
+                attrs.pop(attr, None)
+        out_varname = f"{varname}_{stat}"
+        ds[out_varname] = (dims, arrs[stat], attrs)
+        encoding = get_profile_encoding(
+            luts.encoding_profiles[profile], dims, arrs[stat].shape
+        )
+        if stat == "count":
+            encoding.update(dtype="int16", _FillValue=None)
+        ds[out_varname].encoding = encoding
+
+    return ds
+
+
+def get_aggregate_fp(restack_dir, period, varname, fn_str, year):
+    """Get the path of the file of a period, e.g. monthly/t2/t2_monthly_wrf_GFDL-CM3_rcp85_2050.nc"""
+    return restack_dir.joinpath(
+        period, varname, f"{varname}_{period}_wrf_{fn_str}_{year}.nc"
+    )
+
+
+def write_ds(ds, out_fp):
+    """Write a dataset, creating the parent directory"""
+    out_fp.parent.mkdir(exist_ok=True, parents=True)
+    ds.to_netcdf(out_fp)
+
+    return
+
+
+def aggregate_monthly(restack_dir, varname, fn_str, year, profile="default"):
+    """Make the monthly file of a daily variable-year
+
+    Args:
+        restack_dir (pathlib.Path): directory containing the "daily" directory, and
+            where the "monthly", "seasonal" and "annual" directories are written
+        varname (str): name of the daily variable
+        fn_str (str): string name of model / scenario used in the filenames
+        year (int): year to aggregate
+        profile (str): name of the encoding profile in luts.encoding_profiles
+
+    Returns:
+        None, writes the monthly file
+    """
+    daily_fp = restack_dir.joinpath(
+        "daily", varname, f"{varname}_daily_wrf_{fn_str}_{year}.nc"
+    )
+    month_dates, stats_list, template_ds = read_daily_stats(daily_fp, varname)
+    ds = make_stats_ds(month_dates, stats_list, template_ds, varname, "monthly", profile)
+    write_ds(ds, get_aggregate_fp(restack_dir, "monthly", varname, fn_str, year))
+
+    return
+
+
+def aggregate_seasonal_annual(
+    restack_dir, varname, fn_str, year, profile="default", skip_incomplete=False
+):
+    """Make the seasonal and annual files of a variable-year from the monthly files
+
+    Args:
+        restack_dir (pathlib.Path): directory containing the "monthly" directory
+        varname (str): name of the daily variable
+        fn_str (str): string name of model / scenario used in the filenames
+        year (int): year to aggregate
+        profile (str): name of the encoding profile in luts.encoding_profiles
+        skip_incomplete (bool): leave out the seasons and the year if they are
+            missing months, instead of aggregating the months there are
+
+    Returns:
+        None, writes the seasonal and annual files
+    """
+    monthly_fp = get_aggregate_fp(restack_dir, "monthly", varname, fn_str, year)
+    month_dates, year_stats = read_stats(monthly_fp, varname)
+    month_stats = dict(zip(month_dates, year_stats))
+    prev_fp = get_aggregate_fp(restack_dir, "monthly", varname, fn_str, year - 1)
+    if prev_fp.exists():
+        prev_dates, prev_stats_list = read_stats(prev_fp, varname)
+        month_stats.update(
+            (date, stats)
+            for date, stats in zip(prev_dates, prev_stats_list)
+            if date.month == 12
+        )
+
+    with xr.open_dataset(monthly_fp) as monthly_ds:
+        template_ds = monthly_ds.drop_dims("time").load()
+        template_ds[varname] = monthly_ds[f"{varname}_mean"].isel(time=0, drop=True)
+        template_ds[varname].attrs.pop("temporal_resampling")
+
+    season_names, season_dates, season_stats = [], [], []
+    for season, months in luts.seasons.items():
+        # December is in the DJF season of the next year
+        dates = [
+            pd.Timestamp(year - 1 if month == 12 and months[0] == 12 else year, month, 1)
+            for month in months
+        ]
+        stats_list = [month_stats[date] for date in dates if date in month_stats]
+        if len(stats_list) == 0:
+            continue
+        if len(stats_list) < len(months):
+            print(
+                f"WARNING: {season} {year} of {varname} is missing months "
+                f"{[f'{date:%Y-%m}' for date in dates if date not in month_stats]}"
+            )
+            if skip_incomplete:
+                continue
+        season_names.append(season)
+        season_dates.append(dates[0])
+        season_stats.append(combine_stats(stats_list))
+    if len(season_stats) > 0:
+        ds = make_stats_ds(
+            pd.DatetimeIndex(season_dates), season_stats, template_ds, varname, "seasonal", profile
+        )
+        ds = ds.assign_coords(season=("time", season_names))
+        write_ds(ds, get_aggregate_fp(restack_dir, "seasonal", varname, fn_str, year))
+
+    dates = pd.date_range(f"{year}-01-01", periods=12, freq="MS")
+    if len(year_stats) < len(dates):
+        print(
+            f"WARNING: {year} of {varname} is missing months "
+            f"{[f'{date:%Y-%m}' for date in dates if date not in month_dates]}"
+        )
+        if skip_incomplete:
+            return
+    ds = make_stats_ds(
+        pd.DatetimeIndex([pd.Timestamp(year, 1, 1)]),
+        [combine_stats(year_stats)],
+        template_ds,
+        varname,
+        "annual",
+        profile,
+    )
+    write_ds(ds, get_aggregate_fp(restack_dir, "annual", varname, fn_str, year))
+
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Aggregate the daily WRF outputs to monthly, seasonal and annual"
+    )
+    parser.add_argument(
+        "-r",
+        dest="restack_dir",
+        help="Path to directory containing the daily directory of resampled outputs, where the monthly, seasonal and annual directories will be written",
+    )
+    parser.add_argument(
+        "-y", dest="year_str", help="String for years to process, in '<start year>-<end year>' format, or '_'-separated list of individual years"
+    )
+    parser.add_argument(
+        "-v", dest="varnames", nargs="+", help="Names of the daily variables to aggregate"
+    )
+    parser.add_argument(
+        "-fs",
+        dest="fn_str",
+        help="Substring for WRF group being worked on",
+    )
+    parser.add_argument(
+        "-n",
+        dest="ncpus",
+        type=int,
+        help="Number of CPUs to use for multiprocessing",
+    )
+    parser.add_argument(
+        "-p",
+        dest="profile",
+        default="default",
+        choices=list(luts.encoding_profiles),
+        help="Name of the encoding profile in luts.encoding_profiles to write with",
+    )
+    parser.add_argument(
+        "--skip_incomplete",
+        action="store_true",
+        dest="skip_incomplete",
+        default=False,
+        help="Switch for not writing the seasons and years that are missing months",
+    )
+    args = parser.parse_args()
+    restack_dir = Path(args.restack_dir)
+    years = parse_year_str(args.year_str)
+    varnames = [varname.lower() for varname in args.varnames]
+    fn_str = args.fn_str
+    profile = args.profile
+
+    tic = time.perf_counter()
+    pool_args = [
+        (restack_dir, varname, fn_str, year, profile)
+        for varname in varnames
+        for year in years
+    ]
+    with Pool(args.ncpus) as pool:
+        # all monthly files are written before the seasonal files, which
+        #  need the December of the previous year
+        pool.starmap(aggregate_monthly, pool_args)
+        pool.starmap(
+            aggregate_seasonal_annual,
+            [pool_arg + (args.skip_incomplete,) for pool_arg in pool_args],
+        )
+
+    print((
+        f"Daily files in {restack_dir.joinpath('daily')} for {fn_str} "
+        f"aggregated to monthly, seasonal and annual in {restack_dir} in "
+        f"{round((time.perf_counter() - tic) / 60)}m"
+    ))
@@ -0,0 +1,171 @@
+"""Benchmark the encoding profiles in luts.encoding_profiles on restacked data.
+
+Each supplied file (restacked hourly or resampled daily data) is rewritten with every
+encoding profile, and the write time, file size and read latency are recorded for the
+two main access patterns: full maps at single time steps, and the whole time series
+at single pixels. Reads are done at random times / pixels, from freshly opened files.
+Results are printed and written to a .csv in the output directory.
+
+Note - the files are read right after they are written, so the read latencies are
+for data that may still be in the page cache. Use an output directory on the
+filesystem the data will be read from (e.g. scratch space) for realistic numbers.
+
+Usage:
+    python benchmark_encoding.py -f /center1/DYNDOWN/kmredilla/wrf_data/restacked/hourly/t2/t2_hourly_wrf_GFDL-CM3_rcp85_2050.nc -o /center1/DYNDOWN/kmredilla/wrf_data/encoding_benchmark
+"""
+
+import argparse
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import xarray as xr
+# project
+import luts
+from restack import get_profile_encoding
+
+
+def write_with_profile(ds, varname, profile, out_fp):
+    """Write a dataset with the encoding from an encoding profile
+
+    Args:
+        ds (xarray.Dataset): dataset with data loaded into memory
+        varname (str): name of the data variable
+        profile (str): name of the encoding profile in luts.encoding_profiles
+        out_fp (pathlib.Path): path to write the dataset to
+
+    Returns:
+        write time in seconds
+    """
+    encoding = dict(ds[varname].encoding)
+    encoding.update(
+        get_profile_encoding(
+            luts.encoding_profiles[profile], ds[varname].dims, ds[varname].shape
+        )
+    )
+    ds[varname].encoding = encoding
+
+    if out_fp.exists():
+        out_fp.unlink()
+    tic = time.perf_counter()
+    ds.to_netcdf(out_fp, engine="netcdf4")
+
+    return time.perf_counter() - tic
+
+
+def time_reads(fp, varname, indexers):
+    """Time reads of a variable from a file, opening the file for each read
+
+    Args:
+        fp (pathlib.Path): path to the file to read
+        varname (str): name of the data variable
+        indexers (list): dicts of indexers for xarray.DataArray.isel, one per read
+
+    Returns:
+        list of read times in seconds
+    """
+    times = []
+    for indexer in indexers:
+        tic = time.perf_counter()
+        with xr.open_dataset(fp) as ds:
+            ds[varname].isel(indexer).values
+        times.append(time.perf_counter() - tic)
+
+    return times
+
+
+def benchmark_file(fp, profiles, out_dir, nreads):
+    """Benchmark the encoding profiles on a single file
+
+    Args:
+        fp (pathlib.Path): path to a restacked or resampled file
+        profiles (list): names of the encoding profiles to benchmark
+        out_dir (pathlib.Path): directory to write the rewritten files to
+        nreads (int): number of reads to time for each access pattern
+
+    Returns:
+        rows (list): dicts of results for each profile
+    """
+    with xr.open_dataset(fp) as ds:
+        ds.load()
+    (varname,) = list(ds.data_vars)
+    da = ds[varname]
+
+    # the same random maps and pixels for every profile
+    indexers = {
+        "map": [
+            {"time": idx} for idx in np.random.randint(da.sizes["time"], size=nreads)
+        ],
+        "timeseries": [
+            {"yc": yc, "xc": xc}
+            for yc, xc in zip(
+                np.random.randint(da.sizes["yc"], size=nreads),
+                np.random.randint(da.sizes["xc"], size=nreads),
+            )
+        ],
+    }
+
+    rows = []
+    for profile in profiles:
+        out_fp = out_dir.joinpath(f"{fp.stem}_{profile}.nc")
+        write_time = write_with_profile(ds, varname, profile, out_fp)
+        row = {
+            "filename": fp.name,
+            "profile": profile,
+            "write_s": round(write_time, 2),
+            "size_mb": round(out_fp.stat().st_size / 1e6, 1),
+        }
+        for pattern in indexers:
+            times = time_reads(out_fp, varname, indexers[pattern])
+            row[f"{pattern}_read_ms"] = round(np.median(times) * 1000, 1)
+        rows.append(row)
+        out_fp.unlink()
+        print(row)
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark encoding profiles on restacked WRF outputs"
+    )
+    parser.add_argument(
+        "-f",
+        dest="fps",
+        nargs="+",
+        help="Paths to restacked hourly or resampled daily files to benchmark with",
+    )
+    parser.add_argument(
+        "-o",
+        dest="out_dir",
+        help="Directory to write the benchmark files and results to",
+    )
+    parser.add_argument(
+        "-p",
+        dest="profiles",
+        nargs="+",
+        default=list(luts.encoding_profiles),
+        choices=list(luts.encoding_profiles),
+        help="Names of encoding profiles to benchmark (default is all of them)",
+    )
+    parser.add_argument(
+        "-r",
+        dest="nreads",
+        type=int,
+        default=20,
+        help="Number of reads to time for each access pattern",
+    )
+    args = parser.parse_args()
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(exist_ok=True, parents=True)
+
+    np.random.seed(907)
+    rows = []
+    for fp in args.fps:
+        rows.extend(benchmark_file(Path(fp), args.profiles, out_dir, args.nreads))
+
+    results_df = pd.DataFrame(rows)
+    results_fp = out_dir.joinpath("encoding_benchmark_results.csv")
+    results_df.to_csv(results_fp, index=False)
+    print(results_df.to_string(index=False))
+    print(f"Benchmark results written to {results_fp}")
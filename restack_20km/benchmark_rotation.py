@@ -0,0 +1,123 @@
+"""Benchmark the per-file cost of rotating winds to earth coordinates, with the
+geogrid rotation fields read for every hourly file (as before they were loaded once
+per worker) and with them loaded once and reused.
+
+Each supplied hourly file is rotated repeatedly with run_rotate_winds, and the
+median time per file is reported for both cases. Results are printed and written
+to a .csv in the output directory.
+
+Usage:
+    python benchmark_rotation.py -f /import/SNAP/wrf_data/project_data/wrf_data/hourly/2050/WRFDS_d01.2050-06-01_00.nc -v U10 U -g /import/SNAP/wrf_data/project_data/wrf_data/ancillary/geo_em.d01.nc -o /center1/DYNDOWN/kmredilla/wrf_data/rotation_benchmark
+"""
+
+import argparse
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+# project
+from restack import get_rotation_coefs, run_rotate_winds
+
+
+def time_rotations(fp, varname, geogrid_fp, nrepeats, reload):
+    """Time the rotation of a wind variable from an hourly file
+
+    Args:
+        fp (pathlib.Path): path to the hourly file
+        varname (str): name of the wind variable to rotate
+        geogrid_fp (pathlib.Path): path to the ancillary WRF geogrid file
+        nrepeats (int): number of rotations to time
+        reload (bool): read the rotation fields from the geogrid file for every
+            rotation instead of reusing them
+
+    Returns:
+        list of rotation times in seconds
+    """
+    get_rotation_coefs.cache_clear()
+    if not reload:
+        get_rotation_coefs(geogrid_fp)
+    times = []
+    for _ in range(nrepeats):
+        if reload:
+            get_rotation_coefs.cache_clear()
+        tic = time.perf_counter()
+        run_rotate_winds(fp, varname, geogrid_fp)
+        times.append(time.perf_counter() - tic)
+    get_rotation_coefs.cache_clear()
+
+    return times
+
+
+def benchmark_file(fp, varnames, geogrid_fp, nrepeats):
+    """Benchmark the rotation of wind variables from a single hourly file
+
+    Args:
+        fp (pathlib.Path): path to the hourly file
+        varnames (list): names of the wind variables to rotate
+        geogrid_fp (pathlib.Path): path to the ancillary WRF geogrid file
+        nrepeats (int): number of rotations to time for each case
+
+    Returns:
+        rows (list): dicts of results for each variable
+    """
+    rows = []
+    for varname in varnames:
+        row = {"filename": fp.name, "varname": varname}
+        for case, reload in [("per_file", True), ("per_worker", False)]:
+            times = time_rotations(fp, varname, geogrid_fp, nrepeats, reload)
+            row[f"{case}_ms"] = round(np.median(times) * 1000, 2)
+        rows.append(row)
+        print(row)
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark loading the wind rotation fields once per worker"
+    )
+    parser.add_argument(
+        "-f",
+        dest="fps",
+        nargs="+",
+        help="Paths to hourly WRF files to benchmark with",
+    )
+    parser.add_argument(
+        "-v",
+        dest="varnames",
+        nargs="+",
+        default=["U10"],
+        help="Names of the wind variables to rotate",
+    )
+    parser.add_argument(
+        "-g",
+        dest="geogrid_fp",
+        help="Path to the ancillary WRF geogrid file",
+    )
+    parser.add_argument(
+        "-o",
+        dest="out_dir",
+        help="Directory to write the benchmark results to",
+    )
+    parser.add_argument(
+        "-r",
+        dest="nrepeats",
+        type=int,
+        default=200,
+        help="Number of rotations to time for each file and variable",
+    )
+    args = parser.parse_args()
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(exist_ok=True, parents=True)
+
+    rows = []
+    for fp in args.fps:
+        rows.extend(
+            benchmark_file(Path(fp), args.varnames, Path(args.geogrid_fp), args.nrepeats)
+        )
+
+    results_df = pd.DataFrame(rows)
+    results_fp = out_dir.joinpath("rotation_benchmark_results.csv")
+    results_df.to_csv(results_fp, index=False)
+    print(results_df.to_string(index=False))
+    print(f"Benchmark results written to {results_fp}")
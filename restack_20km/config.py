@@ -34,6 +34,9 @@ output_dir.mkdir(exist_ok=True)
 raw_scratch_dir = scratch_dir.joinpath("raw")
 raw_scratch_dir.mkdir(exist_ok=True)
 
+# inventory of raw wrf outputs, on $ARCHIVE and scratch, see inventory.py
+inventory_fp = scratch_dir.joinpath("raw_inventory.db")
+
 # where initially restacked data will be stored on scratch_space
 restack_scratch_dir = scratch_dir.joinpath("restacked")
 restack_scratch_dir.mkdir(exist_ok=True)
@@ -52,6 +55,7 @@ slurm_dir.mkdir(exist_ok=True)
 # cp_script = project_dir.joinpath("restack_20km/mp_cp.py") not used on Chinook, $ARCHIVE not accessible from compute nodes
 restack_script = project_dir.joinpath("restack_20km/restack.py")
 resample_script = project_dir.joinpath("restack_20km/resample.py")
+aggregate_script = project_dir.joinpath("restack_20km/aggregate.py")
 forecast_times_script = project_dir.joinpath("restack_20km/forecast_times.py")
 luts_fp = project_dir.joinpath("restack_20km/luts.py")
 
@@ -0,0 +1,98 @@
+"""Index of the forecast_time groups (forecast cycles) in the forecast times table, used to restack the
+accumulation variables. Kept apart from restack.py so that forecast_times.py can write the index with the
+catalog without importing the restacking dependencies.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def make_group_index(ftimes_df):
+    """Make the index of the forecast_time groups (forecast cycles) in the forecast
+    times table, with where each group starts and ends in the table, the years it
+    spans, and checks for gaps and discontinuities in it
+    
+    Args:
+        ftimes_df (pandas.DataFrame): table containing parsed filename
+            and forecast times, from read_ftimes. This may be a subset of the whole
+            table, e.g. only some years, as long as the row labels are those of
+            the whole table.
+        
+    Returns:
+        groups_df (pandas.DataFrame): table with a row for each forecast_time group,
+            with columns for the group id, the labels of its first and one past its
+            last row in ftimes_df (start, end), its first and last timestamps and
+            years, the number of time steps, whether there is a gap in the time
+            steps before or within it (has_gap), and whether forecast_time does not
+            advance with the timestamps within it (ftime_mismatch)
+    """
+    group_ids = ftimes_df["forecast_group"].values
+    labels = ftimes_df.index.values
+    # groups are stored as [start, end) row labels, so where rows of the whole
+    #  table were left out (e.g. years that were not read) the table is split
+    is_jump = np.append(True, np.diff(labels) != 1)
+    # positions of the first row of each group
+    starts = np.flatnonzero(
+        is_jump | np.append(True, group_ids[1:] != group_ids[:-1])
+    )
+    ends = np.append(starts[1:], len(group_ids))
+
+    times = ftimes_df["time"].values
+    time_steps = np.diff(times) / np.timedelta64(1, "h")
+    ftime_steps = np.diff(ftimes_df["forecast_time"].values)
+    step = np.median(time_steps[~is_jump[1:]]) if np.any(~is_jump[1:]) else 0
+    # flags for each row, for the step from the previous row
+    gap = ~is_jump & np.append(False, time_steps != step)
+    is_same_group = ~is_jump & np.append(False, group_ids[1:] == group_ids[:-1])
+    mismatch = is_same_group & np.append(False, ftime_steps != time_steps)
+
+    years = ftimes_df["year"].values
+    groups_df = pd.DataFrame(
+        {
+            "forecast_group": group_ids[starts],
+            "start": labels[starts],
+            "end": labels[ends - 1] + 1,
+            "start_time": times[starts],
+            "end_time": times[ends - 1],
+            "first_year": years[starts],
+            "last_year": years[ends - 1],
+            "n_steps": ends - starts,
+            "has_gap": np.logical_or.reduceat(gap, starts),
+            "ftime_mismatch": np.logical_or.reduceat(mismatch, starts),
+        }
+    )
+
+    return groups_df
+
+
+def check_group_index(groups_df, years):
+    """Print a warning for each forecast_time group used for restacking some years
+    (including the adjacent years) that has gaps or discontinuities
+    
+    Args:
+        groups_df (pandas.DataFrame): forecast_time group index, from make_group_index
+        years (list): years being worked on
+        
+    Returns:
+        bad_df (pandas.DataFrame): the rows of groups_df with gaps or discontinuities
+    """
+    groups_df = groups_df[
+        (groups_df["last_year"] >= min(years) - 1)
+        & (groups_df["first_year"] <= max(years) + 1)
+    ]
+    bad_df = groups_df[groups_df["has_gap"] | groups_df["ftime_mismatch"]]
+    for row in bad_df.itertuples():
+        issues = [
+            issue
+            for issue, flag in [
+                ("missing time steps", row.has_gap),
+                ("forecast_time not advancing with the timestamps", row.ftime_mismatch),
+            ]
+            if flag
+        ]
+        print(
+            f"Warning: forecast_time group {row.forecast_group} ({row.start_time} to "
+            f"{row.end_time}) has {' and '.join(issues)}"
+        )
+
+    return bad_df
@@ -1,15 +1,21 @@
 """Get date and time information and the forecast_time attribute for each hourly WRF file in a given directory.
 This script has been adapted to allow creation of the table from files on the $ARCHIVE filesystem, in case all of the data for a particular WRF group will not fit on the $CENTER1 (scratch) filesystem.
+
+The forecast_time attributes are cached along with the size and modification time of each file, so that rerunning the script (e.g. after adding or recopying some years) only opens the files that are new or have changed.
+
+The table is written as a Parquet catalog partitioned by year, with typed columns including the timestamp and forecast_time group of each file, so that restacking jobs only read the years they need (see restack.read_ftimes).
 """
 
 import argparse
+import shutil
 import time
 from multiprocessing import Pool
 from pathlib import Path
 import pandas as pd
-import xarray as xr
 # project
-from config import *
+import raw_reader
+from inventory import query_inventory, update_inventory
+from forecast_groups import check_group_index, make_group_index
 
 
 def get_forecast_time(fp):
@@ -22,8 +28,7 @@ def get_forecast_time(fp):
     Returns:
         forecast_time (int): value of file's forecast time attribute
     """
-    with xr.open_dataset(fp) as ds:
-        forecast_time = ds["PCPT"].attrs["forecast_time"]
+    forecast_time = raw_reader.read_attrs(fp, "PCPT")["forecast_time"]
 
     return forecast_time
 
@@ -52,17 +57,22 @@ def get_date_info(fp):
     return date_info
 
 
-def list_files(dirpath):
+def list_files(dirpath, inventory_fp=None):
     """list the files and split the filenames into their descriptor parts and return dataframe of elements and filename sorted by:['year', 'month', 'day', 'hour']
     
     Args:
         dirpath (pathlib.PosixPath): path to the directory containing annual subdirs of hourly WRF outputs
+        inventory_fp (path_like): path to the inventory of raw files (see inventory.py) to list the files from, instead of listing the directories
     
     Returns:
         files_df (pandas.DataFrame): dataframe of info derived from all files in dirpath
     """
-    # using 'WRFDS' prefix to match standard raw outputs
-    files = [get_date_info(fp) for fp in list(dirpath.glob("*/WRFDS*.nc"))]
+    if inventory_fp is not None:
+        fps = query_inventory(inventory_fp, dirpath)["path"]
+    else:
+        # using 'WRFDS' prefix to match standard raw outputs
+        fps = dirpath.glob("*/WRFDS*.nc")
+    files = [get_date_info(fp) for fp in fps]
     files_df = pd.DataFrame(files)
     files_df = files_df.sort_values(["year", "month", "day", "hour"]).reset_index()
 
@@ -97,6 +107,72 @@ def get_file_attrs(fp):
     return fp_args
 
 
+def read_cache(cache_fp):
+    """Read the cache of forecast_time attributes, keyed by file path, size and mtime
+    
+    Args:
+        cache_fp (pathlib.Path): path to the cache (.parquet)
+        
+    Returns:
+        cache_df (pandas.DataFrame): the cache, empty if there is none at cache_fp
+    """
+    if cache_fp.exists():
+        return pd.read_parquet(cache_fp)
+
+    return pd.DataFrame(
+        {
+            "path": pd.Series(dtype=str),
+            "size": pd.Series(dtype=int),
+            "mtime": pd.Series(dtype=float),
+            "forecast_time": pd.Series(dtype=int),
+        }
+    )
+
+
+def scan_files(fps, cache_df, pool):
+    """Get the date info and forecast_time attribute of hourly WRF files, only opening the
+    files that are not in the cache with the same size and modification time
+    
+    Args:
+        fps (list): paths to hourly WRF files
+        cache_df (pandas.DataFrame): cache of forecast_time attributes, from read_cache
+        pool (multiprocessing.Pool): worker pool to stat and open the files with
+        
+    Returns:
+        tuple of (df, cache_df), the table of file info (see get_file_attrs) and the updated
+            cache, with only the files in fps
+    """
+    stats = pool.map(raw_reader.stat_file, fps)
+    stat_df = pd.DataFrame(
+        {
+            "path": [str(fp) for fp in fps],
+            "size": [size for size, mtime in stats],
+            "mtime": [mtime for size, mtime in stats],
+        }
+    )
+    stat_df = stat_df.merge(cache_df, on=["path", "size", "mtime"], how="left")
+    is_cached = stat_df["forecast_time"].notna().values
+
+    new_fps = [fp for fp, cached in zip(fps, is_cached) if not cached]
+    print(f"{is_cached.sum()} files in cache, {len(new_fps)} files to open")
+    new_out = iter(pool.map(get_file_attrs, new_fps))
+    out = []
+    for fp, cached, forecast_time in zip(fps, is_cached, stat_df["forecast_time"]):
+        if cached:
+            fp_args = get_date_info(fp)
+            fp_args["forecast_time"] = int(forecast_time)
+        else:
+            fp_args = next(new_out)
+        out.append(fp_args)
+    df = pd.DataFrame(out)
+
+    # files that could not be read are tried again next time
+    stat_df["forecast_time"] = df["forecast_time"].astype(int).values
+    cache_df = stat_df[stat_df["forecast_time"] != -9999].reset_index(drop=True)
+
+    return df, cache_df
+
+
 def replace_archive_prefix(df, prefix):
     """In the case that source WRF folder is on $ARCHIVE, replace the filepaths in the output file with what they should be on scratch space
     
@@ -116,7 +192,65 @@ def replace_archive_prefix(df, prefix):
     return df
 
 
+def make_catalog(df):
+    """Make the forecast times catalog from the table of file info, with typed columns,
+    sorted by time, and the timestamp and forecast_time group id of each file
+    
+    Args:
+        df (pandas.DataFrame): table of date info and forecast_time attribute of each
+            file, from get_file_attrs
+    
+    Returns:
+        catalog_df (pandas.DataFrame): the catalog
+    """
+    catalog_df = df.copy()
+    catalog_df["filepath"] = catalog_df["filepath"].astype(str)
+    int_cols = ["year", "folder_year", "month", "day", "hour", "forecast_time"]
+    catalog_df[int_cols] = catalog_df[int_cols].astype(int)
+    # files that could not be read have nodata values for the date info
+    catalog_df["time"] = pd.to_datetime(
+        catalog_df[["year", "month", "day", "hour"]], errors="coerce"
+    )
+    catalog_df = catalog_df.sort_values("time").reset_index(drop=True)
+    # forecast_time groups start at forecast_time 6
+    catalog_df["forecast_group"] = (catalog_df["forecast_time"] == 6).cumsum()
+
+    return catalog_df[["filepath"] + int_cols + ["time", "forecast_group"]]
+
+
+def write_catalog(catalog_df, catalog_fp):
+    """Write the forecast times catalog to a Parquet dataset partitioned by year,
+    replacing any existing catalog at catalog_fp. The index of the forecast_time
+    groups (see forecast_groups.make_group_index) is written in the same directory, as
+    _forecast_groups.parquet, which is not read as part of the catalog.
+    
+    Args:
+        catalog_df (pandas.DataFrame): the catalog, from make_catalog
+        catalog_fp (pathlib.Path): path to the catalog (a directory)
+    
+    Returns:
+        None, writes the catalog to catalog_fp
+    """
+    # partitions are added to rather than replaced when writing
+    if catalog_fp.exists():
+        shutil.rmtree(catalog_fp)
+    # the row labels are kept for looking up the forecast_time groups
+    catalog_df.to_parquet(catalog_fp, partition_cols=["year"], index=True)
+    groups_df = make_group_index(catalog_df)
+    groups_df.to_parquet(catalog_fp.joinpath("_forecast_groups.parquet"), index=False)
+    bad_df = check_group_index(groups_df, groups_df["first_year"].unique())
+    print(
+        f"{len(groups_df)} forecast_time groups, "
+        f"{len(bad_df)} with gaps or discontinuities"
+    )
+
+    return
+
+
 if __name__ == "__main__":
+    # imported here so the catalog functions can be imported without the pipeline environment
+    from config import *
+
     parser = argparse.ArgumentParser(
         description="Get forecast times and date info from hourly WRF files in parallel"
     )
@@ -132,6 +266,24 @@ if __name__ == "__main__":
             "WRF output files to get forecast_time attribute from"
         ),
     )
+    parser.add_argument(
+        "-g",
+        "--group",
+        action="store",
+        dest="group",
+        type=str,
+        required=True,
+        help="WRF group being worked on, e.g. ccsm_rcp85, for naming the forecast times catalog",
+    )
+    parser.add_argument(
+        "-a",
+        "--anc_dir",
+        action="store",
+        dest="anc_dir",
+        type=str,
+        default=None,
+        help="path to the ancillary directory to write the forecast times catalog and cache to, config.anc_dir if not supplied",
+    )
     # This switch is probably only going to be used when there is not enough space on the scratch filesystem to copy everything off of $ARCHIVE
     parser.add_argument(
         "--is_archive",
@@ -149,29 +301,67 @@ if __name__ == "__main__":
         default=1,
         help="Number of CPUs to use for parallel reading of files",
     )
+    parser.add_argument(
+        "--rescan",
+        action="store_true",
+        dest="rescan",
+        default=False,
+        help="Switch for opening every file instead of using the cached forecast times",
+    )
+    parser.add_argument(
+        "--use_inventory",
+        action="store_true",
+        dest="use_inventory",
+        default=False,
+        help=(
+            "Switch for updating the inventory of raw files (config.inventory_fp, see "
+            "inventory.py) for wrf_dir and taking the forecast times from it, "
+            "instead of using the forecast times cache"
+        ),
+    )
     cl_args = parser.parse_args()
     wrf_dir = Path(cl_args.wrf_dir)
+    group = cl_args.group
     ncpus = cl_args.ncpus
+    if cl_args.anc_dir is not None:
+        anc_dir = Path(cl_args.anc_dir)
 
-    fp_df = list_files(wrf_dir)
-    fp_df = fp_df[fp_df.folder_year == fp_df.year]
-    print(f"number of files: {len(fp_df)}")
+    if cl_args.use_inventory:
+        tic = time.perf_counter()
+        with Pool(ncpus) as pool:
+            n_files, n_opened = update_inventory(inventory_fp, wrf_dir, pool)
+        print(
+            f"Inventory of {n_files} files updated ({n_opened} files opened), "
+            f"time elapsed: {round(time.perf_counter() - tic)}s"
+        )
+        files_df = query_inventory(inventory_fp, wrf_dir)
+        forecast_times = files_df.set_index("path")["forecast_time"].fillna(-9999)
+        fp_df = list_files(wrf_dir, inventory_fp)
+        fp_df = fp_df[fp_df.folder_year == fp_df.year]
+        print(f"number of files: {len(fp_df)}")
+        df = fp_df.drop(columns="index")
+        df["forecast_time"] = forecast_times[df["filepath"]].astype(int).values
+    else:
+        fp_df = list_files(wrf_dir)
+        fp_df = fp_df[fp_df.folder_year == fp_df.year]
+        print(f"number of files: {len(fp_df)}")
 
-    args = [df["filepath"] for group, df in fp_df.groupby("year")]
+        cache_fp = anc_dir.joinpath(f"WRFDS_forecast_time_cache_{group}.parquet")
+        cache_df = read_cache(cache_fp)
+        if cl_args.rescan:
+            cache_df = cache_df.iloc[0:0]
 
-    tic = time.perf_counter()
-    out = []
-    for arg in args:
+        tic = time.perf_counter()
+        # a single pool for all years
         with Pool(ncpus) as pool:
-            out.extend(pool.map(get_file_attrs, arg))
-    print(f"Pooling done, time elapsed: {round(time.perf_counter() - tic)}s")
-
-    df = pd.DataFrame(out)
+            df, cache_df = scan_files(list(fp_df["filepath"]), cache_df, pool)
+        print(f"Pooling done, time elapsed: {round(time.perf_counter() - tic)}s")
+        cache_df.to_parquet(cache_fp, index=False)
     
     # if wrf_dir is in $ARCHIVE, we want to replace all of the file paths with what the path SHOULD be on scratch space
     if cl_args.is_archive:
         replace_archive_prefix(df, raw_scratch_dir.joinpath(group))
     
-    ftime_fp = anc_dir.joinpath(f"WRFDS_forecast_time_attr_{group}.csv")
-    df.to_csv(ftime_fp, index=False)
-    print(f"Forecast times table for {hourly_dir} written to {ftime_fp}")
+    ftime_fp = anc_dir.joinpath(f"WRFDS_forecast_time_attr_{group}.parquet")
+    write_catalog(make_catalog(df), ftime_fp)
+    print(f"Forecast times catalog for {wrf_dir} written to {ftime_fp}")
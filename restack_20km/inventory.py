@@ -0,0 +1,281 @@
+"""Inventory of the raw hourly WRF files, kept in a local SQLite catalog.
+
+One pass over the annual directories of a WRF group records the path, size, modification time,
+layout class, variables, timestamp and forecast_time of every raw file. The other stages of the
+pipeline (listing files, checking copies on scratch space, QC) can then query the catalog instead
+of globbing and stat'ing the files on Lustre again. Rerunning the inventory for a directory only
+opens the files that are new or have changed size or modification time, and drops the files that
+no longer exist.
+
+The files in a directory are identified by the directory (root) containing the annual subdirs,
+so the source directory on $ARCHIVE and the copy on scratch space are inventoried separately.
+
+Usage:
+    python inventory.py -s /center1/DYNDOWN/kmredilla/wrf_data/raw/gfdl_rcp85 -n 24
+"""
+
+import argparse
+import sqlite3
+import time
+from datetime import datetime
+from multiprocessing import Pool
+from pathlib import Path
+import pandas as pd
+import xarray as xr
+# project
+import raw_reader
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    folder_year INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    layout TEXT,
+    variables TEXT,
+    time TEXT,
+    forecast_time INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_root_year ON files (root, folder_year);
+CREATE INDEX IF NOT EXISTS files_root_time ON files (root, time);
+"""
+COLUMNS = [
+    "path",
+    "root",
+    "folder_year",
+    "name",
+    "size",
+    "mtime",
+    "layout",
+    "variables",
+    "time",
+    "forecast_time",
+]
+
+
+def connect(inventory_fp):
+    """Connect to the inventory, creating it if it does not exist
+
+    Args:
+        inventory_fp (path_like): path to the SQLite inventory file
+
+    Returns:
+        sqlite3.Connection
+    """
+    con = sqlite3.connect(str(inventory_fp))
+    con.executescript(SCHEMA)
+
+    return con
+
+
+def scan_file(fp):
+    """Open a raw hourly WRF file and get the details for the inventory
+
+    Args:
+        fp (pathlib.Path): path to the raw file
+
+    Returns:
+        dict of the layout class (a hash of the header bytes that are the same for all
+            netCDF-3 files of the layout, or "xarray" for other files, or None if the
+            file could not be read), the comma-separated names of the variables, the
+            timestamp from the filename, and the forecast_time attribute of PCPT
+    """
+    try:
+        time_str = datetime.strptime(fp.name.split(".")[-2], "%Y-%m-%d_%H").isoformat()
+    except (IndexError, ValueError):
+        time_str = None
+
+    try:
+        with open(fp, "rb") as src:
+            try:
+                layout, header = raw_reader.get_layout(src.fileno())
+            except ValueError:
+                layout = None
+
+        if layout is not None:
+            layout_key = raw_reader.get_layout_key(layout)
+            varnames = list(layout["variables"])
+        else:
+            layout_key = "xarray"
+            with xr.open_dataset(fp) as ds:
+                varnames = list(ds.variables)
+        forecast_time = None
+        if "PCPT" in varnames:
+            forecast_time = raw_reader.read_attrs(fp, "PCPT").get("forecast_time")
+            forecast_time = None if forecast_time is None else int(forecast_time)
+    except Exception:
+        # unreadable files are still inventoried, so they can be found
+        layout_key, varnames, forecast_time = None, [], None
+
+    file_info = {
+        "layout": layout_key,
+        "variables": ",".join(varnames),
+        "time": time_str,
+        "forecast_time": forecast_time,
+    }
+
+    return file_info
+
+
+def update_inventory(inventory_fp, wrf_dir, pool, years=None):
+    """Update the inventory with the raw files in the annual subdirs of a directory, only
+    opening the files that are new or have changed size or modification time
+
+    Args:
+        inventory_fp (path_like): path to the SQLite inventory file
+        wrf_dir (path_like): path to the directory containing annual subdirs
+            of hourly WRF outputs
+        pool (multiprocessing.Pool): worker pool to stat and open the files with
+        years (list): years to update. All annual subdirs are updated if not supplied.
+
+    Returns:
+        tuple of the number of files in the inventoried years, and the number opened
+    """
+    # resolve so relative or symlinked paths to the same directory share rows
+    wrf_dir = Path(wrf_dir).resolve()
+    root = str(wrf_dir)
+    if years is None:
+        year_dirs = [path for path in wrf_dir.iterdir() if path.name.isdigit()]
+    else:
+        year_dirs = [wrf_dir.joinpath(str(year)) for year in years]
+    # using 'WRFDS' prefix to match standard raw outputs
+    fps = [fp for year_dir in year_dirs for fp in year_dir.glob("WRFDS*.nc")]
+    stats = pool.map(raw_reader.stat_file, fps)
+
+    folder_years = [int(year_dir.name) for year_dir in year_dirs]
+    with connect(inventory_fp) as con:
+        known = {
+            path: (size, mtime)
+            for path, size, mtime in con.execute(
+                "SELECT path, size, mtime FROM files WHERE root = ? AND folder_year IN "
+                f"({','.join('?' * len(folder_years))})",
+                [root] + folder_years,
+            )
+        }
+        new_fps = [
+            fp for fp, stat in zip(fps, stats) if known.get(str(fp)) != tuple(stat)
+        ]
+        new_infos = dict(zip(new_fps, pool.map(scan_file, new_fps)))
+
+        rows = [
+            (str(fp), root, int(fp.parent.name), fp.name, size, mtime)
+            + tuple(new_infos[fp][col] for col in COLUMNS[6:])
+            for fp, (size, mtime) in zip(fps, stats)
+            if fp in new_infos
+        ]
+        con.executemany(
+            f"INSERT OR REPLACE INTO files VALUES ({','.join('?' * len(COLUMNS))})", rows
+        )
+        # drop the files that are gone
+        current = set(str(fp) for fp in fps)
+        gone = [(path,) for path in known if path not in current]
+        con.executemany("DELETE FROM files WHERE path = ?", gone)
+    con.close()
+
+    return len(fps), len(new_fps)
+
+
+def query_inventory(inventory_fp, wrf_dir=None, years=None, where=None, params=()):
+    """Query the inventory for the raw files in a directory
+
+    Args:
+        inventory_fp (path_like): path to the SQLite inventory file
+        wrf_dir (path_like): directory containing annual subdirs of hourly WRF outputs
+            that was inventoried. Files in all directories are returned if not supplied.
+        years (list): annual subdirs to get the files of. All are returned if not supplied.
+        where (str): additional SQL condition on the columns of the inventory
+        params (tuple): parameters for the placeholders in where
+
+    Returns:
+        files_df (pandas.DataFrame): the inventory rows, sorted by path, with
+            the "path" column as pathlib.Path objects. Paths are stored with the
+            inventoried directory resolved, but if wrf_dir is supplied they are
+            returned under wrf_dir as given, the same as listing its annual subdirs
+            (see restack_20km.get_wrf_fps), so they match paths found that way.
+    """
+    conditions, all_params = [], []
+    if wrf_dir is not None:
+        conditions.append("root = ?")
+        all_params.append(str(Path(wrf_dir).resolve()))
+    if years is not None:
+        years = [int(year) for year in years]
+        conditions.append(f"folder_year IN ({','.join('?' * len(years))})")
+        all_params.extend(years)
+    if where is not None:
+        conditions.append(f"({where})")
+        all_params.extend(params)
+    sql = "SELECT * FROM files"
+    if len(conditions) > 0:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY path"
+
+    with connect(inventory_fp) as con:
+        files_df = pd.read_sql_query(sql, con, params=all_params)
+    con.close()
+    if wrf_dir is None:
+        files_df["path"] = [Path(path) for path in files_df["path"]]
+    else:
+        files_df["path"] = [
+            Path(wrf_dir).joinpath(str(folder_year), name)
+            for folder_year, name in zip(files_df["folder_year"], files_df["name"])
+        ]
+
+    return files_df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Update the inventory of raw hourly WRF files in a directory"
+    )
+    parser.add_argument(
+        "-s",
+        "--wrf_dir",
+        dest="wrf_dir",
+        help="Path to the directory containing annual subdirs of hourly WRF outputs",
+    )
+    parser.add_argument(
+        "-y",
+        dest="year_str",
+        default=None,
+        help="String for years to update, in '<start year>-<end year>' format, or '_'-separated list of individual years. All years are updated if not supplied.",
+    )
+    parser.add_argument(
+        "-i",
+        "--inventory_fp",
+        dest="inventory_fp",
+        default=None,
+        help="Path to the SQLite inventory file, config.inventory_fp if not supplied",
+    )
+    parser.add_argument(
+        "-n",
+        "--ncpus",
+        dest="ncpus",
+        type=int,
+        default=1,
+        help="Number of CPUs to use for parallel reading of files",
+    )
+    args = parser.parse_args()
+    wrf_dir = Path(args.wrf_dir)
+    if args.inventory_fp is None:
+        from config import inventory_fp
+    else:
+        inventory_fp = Path(args.inventory_fp)
+
+    if args.year_str is None:
+        years = None
+    else:
+        # imported here so that importing this module does not import restack
+        from restack import parse_year_str
+
+        years = parse_year_str(args.year_str)
+
+    tic = time.perf_counter()
+    with Pool(args.ncpus) as pool:
+        n_files, n_opened = update_inventory(inventory_fp, wrf_dir, pool, years)
+    print(
+        f"Inventory of {n_files} files in {wrf_dir} updated in {inventory_fp} "
+        f"({n_opened} files opened), time elapsed: {round(time.perf_counter() - tic)}s"
+    )
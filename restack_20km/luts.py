@@ -42,8 +42,25 @@ group_fn_lu = {
 
 wind_varnames = ["U", "U10", "UBOT", "V", "V10", "VBOT"]
 
+# wind speed and direction variables that can optionally be derived
+#  from the rotated wind components when restacking
+wind_derived_varnames = ["WSPD", "WSPD10", "WSPDBOT", "WDIR", "WDIR10", "WDIRBOT"]
+
 accum_varnames = ["ACSNOW", "PCPT", "PCPC", "PCPNC", "POTEVP"]
 
+# variables (hourly or daily) that can not have negative values, checked with
+#  the statistics sidecars in qc.py
+nonnegative_varnames = [
+    "ACSNOW",
+    "PCPT",
+    "PCPC",
+    "PCPNC",
+    "Q2",
+    "WSPD",
+    "WSPD10",
+    "WSPDBOT",
+]
+
 # names of variables that should be resampled to daily
 resample_varnames = ["T2", "T2MIN", "T2MAX", "Q2", "PCPC", "PCPT"]
 
@@ -115,6 +132,15 @@ var_attrs = {
     "V": {"long_name": "v-component of wind", "units": "m/s"},
     "V10": {"long_name": "v-component of wind at 10m height", "units": "m/s"},
     "VBOT": {"long_name": "v-component of wind at lowest model level", "units": "m/s"},
+    "WSPD": {"long_name": "Wind speed", "units": "m/s"},
+    "WSPD10": {"long_name": "Wind speed at 10m height", "units": "m/s"},
+    "WSPDBOT": {"long_name": "Wind speed at lowest model level", "units": "m/s"},
+    "WDIR": {"long_name": "Wind direction (from)", "units": "degrees"},
+    "WDIR10": {"long_name": "Wind direction (from) at 10m height", "units": "degrees"},
+    "WDIRBOT": {
+        "long_name": "Wind direction (from) at lowest model level",
+        "units": "degrees",
+    },
     "OMEGA": {"long_name": "Pressure vertical velocity", "units": "Pa/s"},
     "QVAPOR": {"long_name": "Specific humidity", "units": "kg/kg"},
     "Q2": {"long_name": "Specific humidity at 2m height", "units": "kg/kg"},
@@ -249,3 +275,58 @@ resample_varnames = {
         "aggr": "sum",
     },
 }
+
+# months of the seasons for aggregating the daily data, see aggregate.py.
+#  December is in the DJF season of the following year
+seasons = {
+    "DJF": [12, 1, 2],
+    "MAM": [3, 4, 5],
+    "JJA": [6, 7, 8],
+    "SON": [9, 10, 11],
+}
+
+# named encoding profiles for writing restacked and resampled data. Chunk sizes
+#  are given by dimension, where "level" is the pressure level or soil depth
+#  dimension of levelled variables, and dimensions that are left out or set
+#  to None are not split into chunks. The codec is "zlib" or None for no
+#  compression (other codecs, such as "zstd", need netCDF4>=1.6, which is
+#  newer than the version in environment.yml).
+encoding_profiles = {
+    # same as the original restacked files, with the chunk shape left
+    #  to the netCDF library
+    "default": {
+        "codec": "zlib",
+        "complevel": 5,
+        "shuffle": True,
+        "chunks": None,
+    },
+    # general purpose, a day of time steps per chunk
+    "day-chunked": {
+        "codec": "zlib",
+        "complevel": 5,
+        "shuffle": True,
+        "chunks": {"time": 24, "level": 1},
+    },
+    # fast reads of full maps at single time steps
+    "map-optimized": {
+        "codec": "zlib",
+        "complevel": 1,
+        "shuffle": True,
+        "chunks": {"time": 1, "level": 1},
+    },
+    # fast reads of long time series at single pixels. A whole file of
+    #  time steps per chunk means a year is restacked at once
+    "timeseries-optimized": {
+        "codec": "zlib",
+        "complevel": 4,
+        "shuffle": True,
+        "chunks": {"time": None, "level": 1, "yc": 16, "xc": 16},
+    },
+    # smallest files for long term storage, slow to write
+    "archive-max": {
+        "codec": "zlib",
+        "complevel": 9,
+        "shuffle": True,
+        "chunks": {"time": 168, "level": 1},
+    },
+}
@@ -9,19 +9,30 @@ This notebook will check consistency by comparing a random slice in time between
 
 Given space constraints, it will not be feasible to run a comparison for all WRF groups at once. So this notebook should be executed after the completion of restacking, resampling, and quality checking each of the five WRF groups. Simply run this notebook as a final step before replacing the old production data with new data.
 
+With --hashes, every time step is checked instead: the hashes of the time steps of each file (see restack.StepStats) are matched, taken from the
+statistics sidecars written with the files, or computed by reading files that do not have them, and only the time steps whose hashes differ are read
+from both files and compared value by value.
+
+With --diff, both files are read a block of time steps at a time and the size of any differences is measured: the number of differing values (beyond
+an optional tolerance), the maximum and mean absolute and relative differences, the time steps affected and the spatial bounding box of the differences.
+
 Usage:
     python prod_comparison.py -n /import/SNAP/wrf_data/project_data/wrf_data/restacked/
+    python prod_comparison.py -n /import/SNAP/wrf_data/project_data/wrf_data/restacked/ --hashes
+    python prod_comparison.py -n /import/SNAP/wrf_data/project_data/wrf_data/restacked/ --diff --atol 1e-6 --ncpus 24
 """
 
 import argparse
+import functools
 from multiprocessing.pool import Pool
 from pathlib import Path
 import tqdm
+import netCDF4
 import numpy as np
 import pandas as pd
 import xarray as xr
 import luts
-from config import *
+from restack import get_stats_fp, hash_steps
 # for a type of warning that can occur when comparing times between files
 import warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -104,11 +115,360 @@ def compare_scratch(args):
     return result
 
 
+def read_step_hashes(fp, varname):
+    """Get the timestamps and hashes of the time steps of a restacked or resampled file,
+    from its statistics sidecar if it has one with hashes for the time steps of the
+    file, otherwise by reading the file one chunk of time steps at a time
+    
+    Args:
+        fp (pathlib.Path): path to the restacked or resampled file
+        varname (str): name of the data variable
+    
+    Returns:
+        tuple of (times, hashes) numpy arrays
+    """
+    with xr.open_dataset(fp) as ds:
+        times = ds["time"].values.astype("datetime64[ns]")
+    stats_fp = get_stats_fp(fp)
+    if stats_fp.exists():
+        stats_df = pd.read_parquet(stats_fp)
+        # sidecars written before the hashes were added do not have them, and a
+        #  sidecar left next to a file that was since rewritten may not match it
+        if (
+            "hash" in stats_df.columns
+            and stats_df["hash"].notna().all()
+            and np.array_equal(stats_df["time"].values.astype("datetime64[ns]"), times)
+        ):
+            return times, stats_df["hash"].values
+
+    hashes = []
+    with netCDF4.Dataset(fp) as nc:
+        var = nc.variables[varname]
+        # hash the values as stored, same as when written
+        var.set_auto_maskandscale(False)
+        chunking = var.chunking()
+        chunk_steps = 24 if chunking == "contiguous" else chunking[0]
+        for start in range(0, var.shape[0], chunk_steps):
+            hashes.extend(hash_steps(var[start : start + chunk_steps], var.dtype))
+
+    return times, np.array(hashes)
+
+
+def get_runs(idx, max_steps=240):
+    """Split sorted time step indices into runs of consecutive steps, of
+    at most max_steps steps, so each run can be read as a single slice"""
+    breaks = np.nonzero(np.diff(idx) != 1)[0] + 1
+    runs = []
+    for run in np.split(idx, breaks):
+        runs.extend(run[i : i + max_steps] for i in range(0, len(run), max_steps))
+
+    return runs
+
+
+def read_steps(var, idx):
+    """Read time steps of a netCDF4 variable, as a slice if they are consecutive"""
+    if idx[-1] - idx[0] + 1 == len(idx):
+        return var[idx[0] : idx[-1] + 1]
+
+    return var[list(idx)]
+
+
+def compare_hashes(args):
+    """Run a comparison of every time step between a scratch file and a production file.
+    The hashes of the time steps with the same timestamp in both files are matched,
+    and only the time steps where they differ are read from both files, a run of
+    consecutive steps at a time, and compared value by value (NaNs in the same
+    places are equal).
+    
+    Args:
+        new_restack_fp (path_like): path to file containing restacked data to check
+        restack_prod_fp (path_like): path to production file containing restacked data to compare with
+    
+    Returns:
+        dict with the variable, file names, numbers of time steps compared and
+            with differing hashes and values, and the array and time results
+    """
+    new_restack_fp, restack_prod_fp = args
+    varname = new_restack_fp.parent.name
+    result = {
+        "varname": varname,
+        "scratch_filename": new_restack_fp,
+        "prod_filename": restack_prod_fp,
+        "prod_exists": restack_prod_fp.exists(),
+        "n_steps": None,
+        "n_common_steps": None,
+        "n_hash_mismatch": None,
+        "n_steps_mismatch": None,
+        "n_mismatch": None,
+        "arr_result": False,
+        "time_result": None,
+        "error": None,
+    }
+    if not result["prod_exists"]:
+        result["error"] = "FileNotFoundError"
+        return result
+
+    new_times, new_hashes = read_step_hashes(new_restack_fp, varname)
+    try:
+        prod_times, prod_hashes = read_step_hashes(restack_prod_fp, varname)
+    except (OSError, RuntimeError):
+        # e.g. "RuntimeError: NetCDF: HDF error" for corrupt production files
+        result["error"] = "RuntimeError"
+        return result
+
+    _, new_idx, prod_idx = np.intersect1d(new_times, prod_times, return_indices=True)
+    differ = new_hashes[new_idx] != prod_hashes[prod_idx]
+    n_steps_mismatch, n_mismatch = 0, 0
+    if differ.any():
+        with netCDF4.Dataset(new_restack_fp) as new_nc, netCDF4.Dataset(restack_prod_fp) as prod_nc:
+            new_var, prod_var = new_nc.variables[varname], prod_nc.variables[varname]
+            new_var.set_auto_maskandscale(False)
+            prod_var.set_auto_maskandscale(False)
+            diff_pos = np.nonzero(differ)[0]
+            for run in get_runs(new_idx[diff_pos]):
+                # positions of the run's steps in the common timestamps
+                run_pos = diff_pos[np.searchsorted(new_idx[diff_pos], run)]
+                new_arr = read_steps(new_var, run)
+                prod_arr = read_steps(prod_var, prod_idx[run_pos])
+                mismatch = (new_arr != prod_arr) & ~(np.isnan(new_arr) & np.isnan(prod_arr))
+                n_mismatch += int(mismatch.sum())
+                n_steps_mismatch += int(mismatch.reshape(len(run), -1).any(axis=1).sum())
+
+    result.update(
+        n_steps=len(new_times),
+        n_common_steps=len(new_idx),
+        n_hash_mismatch=int(differ.sum()),
+        n_steps_mismatch=n_steps_mismatch,
+        n_mismatch=n_mismatch,
+        arr_result=n_mismatch == 0,
+        time_result=np.array_equal(new_times, prod_times),
+    )
+
+    return result
+
+
+class DiffCounter:
+    """Accumulate the differences between new and production data, a block of time
+    steps at a time. Values differ when |new - prod| > atol + rtol * |prod|, same as
+    numpy.isclose, or when only one of them is NaN.
+    
+    Args:
+        atol (float): absolute tolerance
+        rtol (float): relative tolerance
+    """
+
+    def __init__(self, atol=0.0, rtol=0.0):
+        self.atol = atol
+        self.rtol = rtol
+        self.n_values = 0
+        self.n_diff = 0
+        self.n_nan_mismatch = 0
+        self.max_abs_diff = 0.0
+        self.sum_abs_diff = 0.0
+        self.max_rel_diff = 0.0
+        self.sum_rel_diff = 0.0
+        self.n_rel = 0
+        self.diff_steps = []
+        # [y_min, y_max, x_min, x_max] indices of the differing values
+        self.bbox = None
+
+    def update(self, start, new_arr, prod_arr):
+        """Compare a block of time steps, time dimension first and the
+        spatial (yc, xc) dimensions last
+        
+        Args:
+            start (int): index of the first time step of the block
+            new_arr (numpy.ndarray): new data for the block
+            prod_arr (numpy.ndarray): production data for the block
+        """
+        new_arr = new_arr.astype(np.float64, copy=False)
+        prod_arr = prod_arr.astype(np.float64, copy=False)
+        nan_mismatch = np.isnan(new_arr) != np.isnan(prod_arr)
+        with np.errstate(invalid="ignore"):
+            abs_diff = np.abs(new_arr - prod_arr)
+            # NaN differences are False here, they are counted as NaN mismatches
+            value_diff = abs_diff > self.atol + self.rtol * np.abs(prod_arr)
+        diff = value_diff | nan_mismatch
+        self.n_values += diff.size
+        if not diff.any():
+            return
+
+        self.n_diff += int(diff.sum())
+        self.n_nan_mismatch += int(nan_mismatch.sum())
+        if value_diff.any():
+            abs_diffs = abs_diff[value_diff]
+            self.max_abs_diff = max(self.max_abs_diff, float(abs_diffs.max()))
+            self.sum_abs_diff += float(abs_diffs.sum())
+            prod_values = np.abs(prod_arr[value_diff])
+            # relative differences are not defined where production data are zero
+            nonzero = prod_values > 0
+            if nonzero.any():
+                rel_diffs = abs_diffs[nonzero] / prod_values[nonzero]
+                self.max_rel_diff = max(self.max_rel_diff, float(rel_diffs.max()))
+                self.sum_rel_diff += float(rel_diffs.sum())
+                self.n_rel += int(nonzero.sum())
+
+        steps = np.nonzero(diff.reshape(len(diff), -1).any(axis=1))[0] + start
+        self.diff_steps.extend(steps.tolist())
+        yx_diff = diff.any(axis=tuple(range(diff.ndim - 2)))
+        ys = np.nonzero(yx_diff.any(axis=1))[0]
+        xs = np.nonzero(yx_diff.any(axis=0))[0]
+        bbox = [int(ys[0]), int(ys[-1]), int(xs[0]), int(xs[-1])]
+        if self.bbox is None:
+            self.bbox = bbox
+        else:
+            self.bbox = [
+                min(self.bbox[0], bbox[0]),
+                max(self.bbox[1], bbox[1]),
+                min(self.bbox[2], bbox[2]),
+                max(self.bbox[3], bbox[3]),
+            ]
+
+        return
+
+    def result(self, times, yc, xc):
+        """Get the results, with the timestamps of the time steps and the
+        coordinates of the spatial dimensions for the affected times and bounds
+        
+        Args:
+            times (numpy.ndarray): timestamps of the time steps compared
+            yc (numpy.ndarray): values of the yc coordinate
+            xc (numpy.ndarray): values of the xc coordinate
+        
+        Returns:
+            dict of the counts of differing values, the maximum and mean (over the
+                differing values) absolute and relative differences, the number of
+                affected time steps, the first and last of them, and the bounding box
+        """
+        n_value_diff = self.n_diff - self.n_nan_mismatch
+        result = {
+            "n_values": self.n_values,
+            "n_diff": self.n_diff,
+            "n_nan_mismatch": self.n_nan_mismatch,
+            "max_abs_diff": self.max_abs_diff,
+            "mean_abs_diff": self.sum_abs_diff / n_value_diff if n_value_diff > 0 else 0.0,
+            "max_rel_diff": self.max_rel_diff,
+            "mean_rel_diff": self.sum_rel_diff / self.n_rel if self.n_rel > 0 else 0.0,
+            "n_steps_diff": len(self.diff_steps),
+            "first_diff_time": times[self.diff_steps[0]] if self.diff_steps else None,
+            "last_diff_time": times[self.diff_steps[-1]] if self.diff_steps else None,
+            "yc_min": None,
+            "yc_max": None,
+            "xc_min": None,
+            "xc_max": None,
+        }
+        if self.bbox is not None:
+            ys, xs = yc[self.bbox[:2]], xc[self.bbox[2:]]
+            result.update(yc_min=ys.min(), yc_max=ys.max(), xc_min=xs.min(), xc_max=xs.max())
+
+        return result
+
+
+def read_values(var, idx):
+    """Read time steps of a netCDF4 variable with fill values as NaN, see read_steps.
+    Values outside of valid_min / valid_max are kept, so that a range that does
+    not match the data does not hide differences."""
+    var.set_auto_maskandscale(False)
+    arr = read_steps(var, idx).astype(np.float64)
+    for attr in ["_FillValue", "missing_value"]:
+        if attr in var.ncattrs() and not np.isnan(var.getncattr(attr)):
+            arr[arr == var.getncattr(attr)] = np.nan
+
+    return arr
+
+
+def diff_files(args, atol=0.0, rtol=0.0, block_steps=48):
+    """Measure the differences between a scratch file and a production file. The time
+    steps with the same timestamp in both files are read a block at a time, so at most
+    one block of each file is held in memory, and compared with DiffCounter.
+    
+    Args:
+        args (tuple): argument tuple consisting of the following:
+            new_restack_fp (path_like): path to file containing restacked data to check
+            restack_prod_fp (path_like): path to production file containing restacked data to compare with
+        atol (float): absolute tolerance for values to differ
+        rtol (float): relative tolerance for values to differ
+        block_steps (int): number of time steps to compare at a time
+    
+    Returns:
+        dict with the variable, year, file names, numbers of time steps, the
+            array and time results, and the differences, see DiffCounter.result
+    """
+    new_restack_fp, restack_prod_fp = args
+    varname = new_restack_fp.parent.name
+    result = {
+        "varname": varname,
+        "year": int(new_restack_fp.stem.split("_")[-1]),
+        "scratch_filename": new_restack_fp,
+        "prod_filename": restack_prod_fp,
+        "prod_exists": restack_prod_fp.exists(),
+        "n_steps": None,
+        "n_common_steps": None,
+        "arr_result": False,
+        "time_result": None,
+        "error": None,
+    }
+    if not result["prod_exists"]:
+        result["error"] = "FileNotFoundError"
+        return result
+
+    counter = DiffCounter(atol, rtol)
+    try:
+        with xr.open_dataset(new_restack_fp) as new_ds, xr.open_dataset(restack_prod_fp) as prod_ds:
+            new_times, prod_times = new_ds["time"].values, prod_ds["time"].values
+            yc, xc = new_ds["yc"].values, new_ds["xc"].values
+        common_times, new_idx, prod_idx = np.intersect1d(
+            new_times, prod_times, return_indices=True
+        )
+        with netCDF4.Dataset(new_restack_fp) as new_nc, netCDF4.Dataset(restack_prod_fp) as prod_nc:
+            new_var, prod_var = new_nc.variables[varname], prod_nc.variables[varname]
+            for start in range(0, len(common_times), block_steps):
+                stop = start + block_steps
+                counter.update(
+                    start,
+                    read_values(new_var, new_idx[start:stop]),
+                    read_values(prod_var, prod_idx[start:stop]),
+                )
+    except (OSError, RuntimeError):
+        # e.g. "RuntimeError: NetCDF: HDF error" for corrupt production files
+        result["error"] = "RuntimeError"
+        return result
+
+    result.update(
+        n_steps=len(new_times),
+        n_common_steps=len(common_times),
+        arr_result=counter.n_diff == 0,
+        time_result=np.array_equal(new_times, prod_times),
+    )
+    result.update(counter.result(common_times, yc, xc))
+
+    return result
+
+
 if __name__ == "__main__":
+    # imported here so the comparisons can be imported without the pipeline environment
+    from config import *
+
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("-n", dest="new_restack_dir", type=str, help="Parent directory of newly restacked outputs to compare with production")
+    parser.add_argument("--hashes", dest="hashes", action="store_true", default=False, help="Compare every time step by matching the hashes of the time steps, instead of a random time step")
+    parser.add_argument("--diff", dest="diff", action="store_true", default=False, help="Compare every value and measure the differences, instead of a random time step")
+    parser.add_argument("--atol", dest="atol", type=float, default=0.0, help="Absolute tolerance for values to differ with --diff")
+    parser.add_argument("--rtol", dest="rtol", type=float, default=0.0, help="Relative tolerance for values to differ with --diff")
+    parser.add_argument("-b", dest="block_steps", type=int, default=48, help="Number of time steps of each file to hold in memory at a time with --diff")
+    parser.add_argument("--ncpus", dest="ncpus", type=int, default=20, help="Number of files to compare at once")
     args = parser.parse_args()
     new_restack_dir = Path(args.new_restack_dir)
+    ncpus = args.ncpus
+    if args.diff:
+        compare_fn = functools.partial(
+            diff_files, atol=args.atol, rtol=args.rtol, block_steps=args.block_steps
+        )
+        results_suffix = "_diff"
+    elif args.hashes:
+        compare_fn, results_suffix = compare_hashes, "_hashes"
+    else:
+        compare_fn, results_suffix = compare_scratch, ""
     
     # these paths should be constant for any SNAPer running this pipeline
     # assumes all folders are created in restack_20km.ipynb
@@ -130,16 +490,16 @@ if __name__ == "__main__":
             args.append((new_restack_fp, restack_prod_fp))
             
     np.random.seed(99709)
-    with Pool(20) as pool:
+    with Pool(ncpus) as pool:
         new_rows = [
             result for result in tqdm.tqdm(
-                pool.imap_unordered(compare_scratch, args), total=len(args))
+                pool.imap_unordered(compare_fn, args), total=len(args))
         ]
         
     hourly_results_df = pd.DataFrame(new_rows)
     hourly_results_fp = anc_dir.joinpath(
         "production_data_comparisons",
-        f"prod_comparison_{luts.groups[group]['fn_str']}_hourly.csv"
+        f"prod_comparison_{luts.groups[group]['fn_str']}_hourly{results_suffix}.csv"
     )
     hourly_results_df.to_csv(hourly_results_fp, index=False)
     
@@ -156,15 +516,15 @@ if __name__ == "__main__":
             args.append((resample_scratch_fp, resample_prod_fp))
              
     np.random.seed(99709)
-    with Pool(20) as pool:
+    with Pool(ncpus) as pool:
         new_rows = [
             result for result in tqdm.tqdm(
-                pool.imap_unordered(compare_scratch, args), total=len(args))
+                pool.imap_unordered(compare_fn, args), total=len(args))
         ]
          
     daily_results_df = pd.DataFrame(new_rows)
     daily_results_fp = anc_dir.joinpath(
         "production_data_comparisons",
-        f"prod_comparison_{luts.groups[group]['fn_str']}_daily.csv"
+        f"prod_comparison_{luts.groups[group]['fn_str']}_daily{results_suffix}.csv"
     )
     daily_results_df.to_csv(daily_results_fp, index=False)
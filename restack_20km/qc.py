@@ -3,9 +3,14 @@
 Usage:
     # e.g. if WRF group is GFDL projected data
     python qc.py -n /center1/DYNDOWN/kmredilla/wrf_data/restacked/ -r /center1/DYNDOWN/kmredilla/wrf_data/raw/gfdl_rcp85/
+    # check the statistics sidecars written with the outputs for anomalies, without reading any data
+    python qc.py -n /center1/DYNDOWN/kmredilla/wrf_data/restacked/ -r /center1/DYNDOWN/kmredilla/wrf_data/raw/gfdl_rcp85/ --stats
+    # check every time step of every file instead of a random one (see validate.py)
+    python qc.py -n /center1/DYNDOWN/kmredilla/wrf_data/restacked/ -r /center1/DYNDOWN/kmredilla/wrf_data/raw/gfdl_rcp85/ --full -f /import/SNAP/wrf_data/project_data/wrf_data/ancillary/WRFDS_forecast_time_attr_gfdl_rcp85.parquet -g /import/SNAP/wrf_data/project_data/wrf_data/ancillary/geo_em.d01.nc
 """
 
 import argparse
+import sys
 import time
 from multiprocessing import Pool
 from pathlib import Path
@@ -16,6 +21,137 @@ import tqdm
 from config import group, project_dir
 import luts
 import restack_20km as main
+from restack import read_ftimes, summarize_stats
+from validate import validate_resampled_file_full, validate_restacked_year
+
+
+def run_full_qc(
+    hourly_dir,
+    daily_dir,
+    group_fn_str,
+    ftimes_fp,
+    geogrid_fp,
+    block_steps,
+    ncpus,
+    atol=0.0,
+    rtol=0.0,
+):
+    """Check every time step of the restacked and resampled files of a WRF group,
+    and write the mismatch counts of each file to a table in the project directory
+    
+    Args:
+        hourly_dir (pathlib.Path): directory of restacked hourly data, by variable
+        daily_dir (pathlib.Path): directory of resampled daily data, by variable
+        group_fn_str (str): string name of model / scenario used in the filenames
+        ftimes_fp (path_like): path to the forecast times catalog for the WRF group
+        geogrid_fp (path_like): path to the ancillary WRF geogrid file
+        block_steps (int): number of hourly time steps to check at a time
+        ncpus (int): number of CPUs to use for reading the files
+        atol (float): absolute tolerance for values to differ, see validate.MismatchCounter
+        rtol (float): relative tolerance for values to differ, see validate.MismatchCounter
+        
+    Returns:
+        None, writes the results tables and prints a summary
+    """
+    # group the hourly files by year, so each raw file is read once for all variables
+    hourly_fps = {}
+    for fp in hourly_dir.glob(f"*/*{group_fn_str}*.nc"):
+        year = int(fp.name.split("_")[-1].split(".")[0])
+        hourly_fps.setdefault(year, {})[fp.parent.name.upper()] = fp
+    years = sorted(hourly_fps)
+    ftimes_df = read_ftimes(ftimes_fp, years)
+
+    rows = []
+    with Pool(ncpus) as pool:
+        for year in years:
+            rows.extend(
+                validate_restacked_year(
+                    ftimes_df,
+                    year,
+                    hourly_fps[year],
+                    luts,
+                    geogrid_fp,
+                    pool,
+                    block_steps,
+                    atol,
+                    rtol,
+                )
+            )
+    results_df = pd.DataFrame(rows)
+
+    daily_args = []
+    for fp in daily_dir.glob(f"*/*{group_fn_str}*.nc"):
+        varname = fp.parent.name
+        wrf_varname = luts.resample_varnames[varname.upper()]["wrf_varname"]
+        hourly_fp = hourly_dir.joinpath(
+            wrf_varname, fp.name.replace("daily", "hourly").replace(varname, wrf_varname, 1)
+        )
+        aggr = luts.resample_varnames[varname.upper()]["aggr"]
+        daily_args.append((fp, hourly_fp, varname, wrf_varname, aggr, 32, atol, rtol))
+    with Pool(ncpus) as pool:
+        daily_rows = list(
+            tqdm.tqdm(
+                pool.imap_unordered(validate_resampled_file_full, daily_args),
+                total=len(daily_args),
+            )
+        )
+    daily_results_df = pd.DataFrame(daily_rows)
+
+    for period, df in [("hourly", results_df), ("daily", daily_results_df)]:
+        qc_fp = project_dir.joinpath(f"{group_fn_str}_{period}_qc_full_results.csv")
+        df.to_csv(qc_fp, index=False)
+        if len(df) == 0:
+            print(f"No {period} files found")
+            continue
+        bad_df = df[~df["match"]]
+        print(
+            f"{period.capitalize()} files checked: {len(df)}, values checked: {df['n_values'].sum()}, "
+            f"files with mismatches: {len(bad_df)}, results written to {qc_fp}"
+        )
+        if len(bad_df) > 0:
+            print(bad_df[["fp", "n_mismatch", "n_steps_mismatch", "max_abs_error"]].to_string())
+
+    return
+
+
+def run_stats_qc(restack_dir, group_fn_str):
+    """Check the statistics sidecars of the restacked and resampled files of a WRF
+    group (see restack.StepStats) for negative values of variables that can not be
+    negative and for time steps with no valid values, and write the summary
+    statistics of each file to a table in the project directory
+    
+    Args:
+        restack_dir (pathlib.Path): directory containing the hourly and daily directories
+        group_fn_str (str): string name of model / scenario used in the filenames
+        
+    Returns:
+        None, writes the results table and prints the files with anomalies
+    """
+    rows = []
+    for period in ["hourly", "daily"]:
+        for fp in sorted(restack_dir.joinpath(period).glob(f"*/*{group_fn_str}*_stats.parquet")):
+            row = {"period": period, "variable": fp.parent.name, "fp": str(fp)}
+            row.update(summarize_stats(pd.read_parquet(fp)))
+            rows.append(row)
+    if len(rows) == 0:
+        print(f"No statistics sidecars found in {restack_dir}")
+        return
+
+    results_df = pd.DataFrame(rows)
+    results_df["negative"] = results_df["variable"].str.upper().isin(
+        luts.nonnegative_varnames
+    ) & (results_df["min"] < 0)
+    stats_qc_fp = project_dir.joinpath(f"{group_fn_str}_stats_qc_results.csv")
+    results_df.to_csv(stats_qc_fp, index=False)
+    bad_df = results_df[results_df["negative"] | (results_df["n_empty_steps"] > 0)]
+    print(
+        f"Statistics of {len(results_df)} files checked, files with anomalies: "
+        f"{len(bad_df)}, results written to {stats_qc_fp}"
+    )
+    if len(bad_df) > 0:
+        print(bad_df[["fp", "min", "max", "n_empty_steps"]].to_string())
+
+    return
 
 
 if __name__ == "__main__":
@@ -32,15 +168,99 @@ if __name__ == "__main__":
         type=str,
         help="Parent directory of WRF group containing annual folders of WRF hourly outputs"
     )
+    parser.add_argument(
+        "-i",
+        dest="inventory_fp",
+        type=str,
+        default=None,
+        help="Path to the inventory of raw files (see inventory.py) to look up the raw files in, instead of listing the annual folders"
+    )
+    parser.add_argument(
+        "--full",
+        dest="full",
+        action="store_true",
+        default=False,
+        help="Check every time step of every file against values recomputed from the raw files, including wind and accumulation variables, instead of a random time step of some variables",
+    )
+    parser.add_argument(
+        "--stats",
+        dest="stats",
+        action="store_true",
+        default=False,
+        help="Check the statistics sidecars written with the outputs for negative values of non-negative variables and empty time steps, instead of reading the data",
+    )
+    parser.add_argument(
+        "-f",
+        dest="ftimes_fp",
+        type=str,
+        default=None,
+        help="Path to the forecast times catalog for the WRF group, required with --full",
+    )
+    parser.add_argument(
+        "-g",
+        dest="geogrid_fp",
+        type=str,
+        default=None,
+        help="Path to the ancillary WRF geogrid file, required with --full",
+    )
+    parser.add_argument(
+        "-b",
+        dest="block_steps",
+        type=int,
+        default=240,
+        help="Number of hourly time steps to check at a time with --full",
+    )
+    parser.add_argument(
+        "--atol",
+        dest="atol",
+        type=float,
+        default=0.0,
+        help="Absolute tolerance for values to differ with --full",
+    )
+    parser.add_argument(
+        "--rtol",
+        dest="rtol",
+        type=float,
+        default=0.0,
+        help="Relative tolerance for values to differ with --full",
+    )
+    parser.add_argument(
+        "--ncpus",
+        dest="ncpus",
+        type=int,
+        default=20,
+        help="Number of CPUs to use with --full",
+    )
     args = parser.parse_args()
     new_restack_dir = Path(args.new_restack_dir)
     raw_dir = Path(args.raw_dir)
+    inventory_fp = args.inventory_fp
     group_fn_str = luts.groups[group]["fn_str"]
     
+    if args.stats:
+        run_stats_qc(new_restack_dir, group_fn_str)
+        sys.exit(0)
+
+    if args.full:
+        if args.ftimes_fp is None or args.geogrid_fp is None:
+            parser.error("--full requires -f and -g")
+        run_full_qc(
+            new_restack_dir.joinpath("hourly"),
+            new_restack_dir.joinpath("daily"),
+            group_fn_str,
+            args.ftimes_fp,
+            args.geogrid_fp,
+            args.block_steps,
+            args.ncpus,
+            args.atol,
+            args.rtol,
+        )
+        sys.exit(0)
+
     # hourly QC
     hourly_dir = new_restack_dir.joinpath("hourly")
     all_wrf_fps = list(hourly_dir.glob(f"*/*{group_fn_str}*.nc"))
-    args = [(fp, raw_dir) for fp in all_wrf_fps]
+    args = [(fp, raw_dir, inventory_fp) for fp in all_wrf_fps]
     # set random seed
     np.random.seed(907)
     
@@ -0,0 +1,420 @@
+"""Build a virtual reference index over the raw hourly WRF files, and open it as an xarray dataset
+that reads the data straight from the raw files, for quick extracts without staging and restacking.
+
+The index is a JSON file listing every raw file in the indexed year directories with its timestamp
+and size, and the byte offsets, dtypes and shapes of the variables for each of the few netCDF-3
+layouts the files come in (see raw_reader). Opening the index does not touch the raw files, and
+indexing a variable of the dataset only reads the bytes of the requested steps and pixels of each
+file. Variables that can not be read from the raw bytes (see raw_reader.needs_xarray), and files
+that are not netCDF-3, are read with xarray instead.
+
+The data are the raw values of the hourly files: accumulation variables are not differenced and
+wind components are not rotated to earth coordinates, as they are in the restacked data.
+
+Usage:
+    python raw_index.py -s /archive/DYNDOWN/DIONE/pbieniek/gfdl/rcp85/hourly -y 2015 -o $SCRATCH_DIR/raw_index/gfdl_rcp85_2015.json -n 24
+
+    then, e.g. in a notebook:
+
+    from raw_index import open_raw_index
+    ds = open_raw_index("gfdl_rcp85_2015.json")
+    ds["T2"].isel(south_north=[10, 20, 30], west_east=[40, 50, 60]).values
+"""
+
+import argparse
+import json
+import mmap
+import os
+import time
+from datetime import datetime
+from multiprocessing import Pool
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import xarray as xr
+from xarray.backends import BackendArray, BackendEntrypoint
+from xarray.core import indexing
+# project
+import luts
+import raw_reader
+from restack import parse_year_str
+
+
+def get_file_time(fp):
+    """Get the timestamp of a raw hourly WRF file from its name,
+    e.g. WRFDS_d01.2015-01-01_00.nc"""
+    return datetime.strptime(fp.name.split(".")[-2], "%Y-%m-%d_%H")
+
+
+def to_json_value(value):
+    """Convert an attribute value to a JSON serializable value"""
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+
+    return value
+
+
+def index_file(fp):
+    """Get the size, timestamp and layout key of a raw hourly WRF file
+
+    Args:
+        fp (pathlib.Path): path to the raw file
+
+    Returns:
+        dict of the file info, with a key identifying the netCDF-3 layout
+            of the file (None if the file is not netCDF-3) and the
+            forecast_time attribute of PCPT (None if not present)
+    """
+    with open(fp, "rb") as src:
+        try:
+            layout, header = raw_reader.get_layout(src.fileno())
+        except ValueError:
+            layout = None
+        stat = os.fstat(src.fileno())
+
+    if layout is None:
+        key = None
+        forecast_time = raw_reader.read_attrs(fp, "PCPT").get("forecast_time")
+    else:
+        key = raw_reader.get_layout_key(layout)
+        forecast_time = None
+        if "PCPT" in layout["variables"]:
+            attrs = raw_reader.decode_attrs(layout["variables"]["PCPT"]["attrs"], header)
+            forecast_time = attrs.get("forecast_time")
+
+    file_info = {
+        "path": str(fp),
+        "time": get_file_time(fp).isoformat(),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "key": key,
+        "forecast_time": to_json_value(forecast_time),
+    }
+
+    return file_info
+
+
+def describe_layout(fp):
+    """Describe the layout of a raw hourly WRF file for the index, with the variable
+    attributes of this file other than forecast_time, which varies between the files
+    and is listed for each file instead
+
+    Args:
+        fp (path_like): path to the raw file
+
+    Returns:
+        dict of the record size, global attributes and variable references,
+            with dims, shape, dtype, byte offset and attributes for each variable.
+            Variables that must be read with xarray have "virtual" set to False,
+            which is the case for all variables of files that are not netCDF-3.
+    """
+    with open(fp, "rb") as src:
+        try:
+            layout, header = raw_reader.get_layout(src.fileno())
+        except ValueError:
+            layout = None
+
+    if layout is None:
+        with xr.open_dataset(fp) as ds:
+            variables = {
+                varname: {
+                    "dims": list(da.dims),
+                    "shape": list(da.shape),
+                    "dtype": da.dtype.str,
+                    "virtual": False,
+                    "attrs": {
+                        k: to_json_value(v)
+                        for k, v in da.attrs.items()
+                        if k != "forecast_time"
+                    },
+                }
+                for varname, da in ds.variables.items()
+            }
+            attrs = {k: to_json_value(v) for k, v in ds.attrs.items()}
+
+        return {"recsize": None, "attrs": attrs, "variables": variables}
+
+    variables = {}
+    for varname, var in layout["variables"].items():
+        var_attrs = raw_reader.decode_attrs(var["attrs"], header)
+        variables[varname] = {
+            "dims": list(var["dims"]),
+            "shape": list(var["shape"]),
+            "dtype": var["dtype"].str,
+            "begin": var["begin"],
+            "record": var["record"],
+            "virtual": not raw_reader.needs_xarray(var_attrs, var["dtype"]),
+            "attrs": {
+                k: to_json_value(v)
+                for k, v in var_attrs.items()
+                if k != "forecast_time"
+            },
+        }
+    attrs = {
+        k: to_json_value(v)
+        for k, v in raw_reader.decode_attrs(layout["attrs"], header).items()
+    }
+
+    return {"recsize": layout["recsize"], "attrs": attrs, "variables": variables}
+
+
+def build_index(wrf_dir, years, pool):
+    """Build the reference index of the raw hourly WRF files for some years
+
+    Args:
+        wrf_dir (pathlib.Path): path to the directory containing annual subdirs
+            of hourly WRF outputs
+        years (list): years to index
+        pool (multiprocessing.Pool): worker pool to scan the files with
+
+    Returns:
+        index (dict): the reference index, with a list of the files in time order
+            and the layouts of the files keyed by layout id
+    """
+    fps = []
+    for year in years:
+        # files at the start of a year directory can be from the previous year
+        fps.extend(
+            fp
+            for fp in wrf_dir.joinpath(str(year)).glob("WRFDS*.nc")
+            if get_file_time(fp).year == int(year)
+        )
+    if len(fps) == 0:
+        raise ValueError(f"No WRFDS*.nc files found in {wrf_dir} for {years}")
+    files = sorted(pool.map(index_file, fps), key=lambda file_info: file_info["time"])
+
+    # one description of each distinct layout, from the first file with it
+    layout_ids = {}
+    layouts = {}
+    for file_info in files:
+        key = file_info.pop("key")
+        if key not in layout_ids:
+            layout_id = str(len(layout_ids))
+            layout_ids[key] = layout_id
+            layouts[layout_id] = describe_layout(file_info["path"])
+        file_info["layout"] = layout_ids[key]
+
+    first = layouts["0"]["variables"]
+    for layout_id, layout in layouts.items():
+        for varname, var in layout["variables"].items():
+            if varname in first and (
+                var["dims"] != first[varname]["dims"]
+                or var["shape"] != first[varname]["shape"]
+            ):
+                raise ValueError(
+                    f"{varname} has different dimensions in files of layout {layout_id}"
+                )
+
+    index = {
+        "version": 1,
+        "created": time.ctime(),
+        "root": str(wrf_dir),
+        "layouts": layouts,
+        "files": files,
+    }
+
+    return index
+
+
+class RawVariableArray(BackendArray):
+    """Lazy array of a variable stacked along time over the raw files of a reference index,
+    reading only the requested steps and pixels of each file when indexed
+
+    Args:
+        varname (str): name of the variable
+        files (list): file info dicts from the index, with paths resolved
+        layouts (dict): layouts from the index
+        shape (tuple): shape of the variable in a single file
+        dtype (numpy.dtype): dtype of the variable's values
+    """
+
+    def __init__(self, varname, files, layouts, shape, dtype):
+        self.varname = varname
+        self.files = files
+        self.layouts = layouts
+        self.shape = (len(files),) + tuple(shape)
+        self.dtype = dtype
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key, self.shape, indexing.IndexingSupport.OUTER, self._getitem
+        )
+
+    def _getitem(self, key):
+        file_idx = np.arange(self.shape[0])[key[0]]
+        arrs = [self.read_file(i, key[1:]) for i in np.atleast_1d(file_idx)]
+        if np.ndim(file_idx) == 0:
+            return arrs[0]
+        if len(arrs) == 0:
+            shape = apply_outer_key(np.empty(self.shape[1:]), key[1:]).shape
+            return np.empty((0,) + shape, dtype=self.dtype)
+
+        return np.stack(arrs)
+
+    def read_file(self, i, key):
+        """Read the variable from a single file, applying the
+        outer indexer key (one int, slice or int array per axis)"""
+        file_info = self.files[i]
+        var = self.layouts[file_info["layout"]]["variables"][self.varname]
+        fp = file_info["path"]
+        if not var["virtual"]:
+            with xr.open_dataset(fp) as ds:
+                return apply_outer_key(ds[self.varname].values, key)
+
+        with open(fp, "rb") as src:
+            size = os.fstat(src.fileno()).st_size
+            if size != file_info["size"]:
+                raise ValueError(
+                    f"{fp} has changed since it was indexed ({size} bytes, "
+                    f"{file_info['size']} in the index), rebuild the index"
+                )
+            ref = dict(var, shape=tuple(var["shape"]), dtype=np.dtype(var["dtype"]))
+            with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = raw_reader.map_var(
+                    mm, ref, self.layouts[file_info["layout"]]["recsize"]
+                )
+                arr = np.array(apply_outer_key(view, key), dtype=self.dtype)
+                # the map can only be closed once nothing refers to it
+                del view
+
+        return raw_reader.mask_fill_values(arr, var["attrs"])
+
+
+def apply_outer_key(arr, key):
+    """Index an array with an outer indexer, one int, slice or int array per axis,
+    one axis at a time starting from the last so that dropped axes do not shift"""
+    for axis in reversed(range(len(key))):
+        arr = arr[(slice(None),) * axis + (key[axis],)]
+
+    return arr
+
+
+class RawIndexBackend(BackendEntrypoint):
+    """xarray backend for reference indexes of raw hourly WRF files, see open_raw_index"""
+
+    description = "Open a reference index of raw hourly WRF files written by raw_index.py"
+    open_dataset_parameters = ["filename_or_obj", "drop_variables", "root"]
+
+    def open_dataset(self, filename_or_obj, *, drop_variables=None, root=None):
+        ds = read_raw_index(filename_or_obj, root)
+        if drop_variables is not None:
+            ds = ds.drop_vars(drop_variables)
+
+        return ds
+
+    def guess_can_open(self, filename_or_obj):
+        return False
+
+
+def open_raw_index(index_fp, root=None):
+    """Open a reference index of raw hourly WRF files as an xarray dataset. Every variable
+    that varies between files is stacked along a new time dimension and only read from the
+    raw files when its values are accessed. Dimension coordinates and the latitude and
+    longitude variables are read from the first file.
+
+    Args:
+        index_fp (path_like): path to the index file written by raw_index.py
+        root (path_like): directory containing annual subdirs of the same hourly WRF
+            files as the indexed one, e.g. copies on scratch space of files indexed on
+            $ARCHIVE. The indexed directory is used if not supplied.
+
+    Returns:
+        ds (xarray.Dataset): dataset of the raw hourly data
+    """
+    # not cached, so that reading a subset of a variable does not keep all of it
+    return xr.open_dataset(index_fp, engine=RawIndexBackend, root=root, cache=False)
+
+
+def read_raw_index(index_fp, root=None):
+    """Make the dataset of a reference index for RawIndexBackend, see open_raw_index"""
+    with open(index_fp) as src:
+        index = json.load(src)
+
+    files = index["files"]
+    if root is not None:
+        indexed_root = Path(index["root"])
+        files = [
+            dict(file_info, path=str(Path(root).joinpath(rel_fp)))
+            for file_info, rel_fp in (
+                (file_info, Path(file_info["path"]).relative_to(indexed_root))
+                for file_info in files
+            )
+        ]
+    layouts = index["layouts"]
+    first_layout = layouts[files[0]["layout"]]
+
+    static_varnames = [luts.lat_variable, luts.lon_variable]
+    coords = {"time": pd.to_datetime([file_info["time"] for file_info in files])}
+    data_vars = {}
+    with xr.open_dataset(files[0]["path"]) as first_ds:
+        for varname, var in first_layout["variables"].items():
+            if var["dims"] == [varname] or varname in static_varnames:
+                coords[varname] = first_ds[varname].load().variable
+                continue
+            if var["virtual"]:
+                dtype = np.dtype(var["dtype"]).newbyteorder("=")
+            else:
+                dtype = first_ds[varname].dtype
+            arr = RawVariableArray(varname, files, layouts, var["shape"], dtype)
+            # the lazy wrapper for backend arrays, as in xarray's backend docs
+            data_vars[varname] = xr.Variable(
+                ["time"] + var["dims"],
+                indexing.LazilyIndexedArray(arr),
+                attrs=var["attrs"],
+            )
+
+    ds = xr.Dataset(data_vars, coords=coords, attrs=first_layout["attrs"])
+    forecast_times = [file_info["forecast_time"] for file_info in files]
+    if None not in forecast_times:
+        ds["forecast_time"] = ("time", forecast_times)
+
+    return ds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build a virtual reference index over raw hourly WRF files"
+    )
+    parser.add_argument(
+        "-s",
+        "--wrf_dir",
+        dest="wrf_dir",
+        help="Path to the directory containing annual subdirs of hourly WRF outputs",
+    )
+    parser.add_argument(
+        "-y",
+        dest="year_str",
+        help="String for years to index, in '<start year>-<end year>' format, or '_'-separated list of individual years",
+    )
+    parser.add_argument(
+        "-o",
+        dest="index_fp",
+        help="Path to write the index to (.json)",
+    )
+    parser.add_argument(
+        "-n",
+        "--ncpus",
+        dest="ncpus",
+        type=int,
+        default=1,
+        help="Number of CPUs to use for parallel reading of file headers",
+    )
+    args = parser.parse_args()
+    wrf_dir = Path(args.wrf_dir)
+    year_str = args.year_str
+    index_fp = Path(args.index_fp)
+    years = parse_year_str(year_str)
+
+    tic = time.perf_counter()
+    with Pool(args.ncpus) as pool:
+        index = build_index(wrf_dir, years, pool)
+
+    index_fp.parent.mkdir(exist_ok=True, parents=True)
+    with open(index_fp, "w") as f:
+        json.dump(index, f)
+
+    print(
+        f"Index of {len(index['files'])} files in {wrf_dir} for {year_str}, "
+        f"with {len(index['layouts'])} layout(s), written to {index_fp} in "
+        f"{round(time.perf_counter() - tic)}s"
+    )
@@ -0,0 +1,380 @@
+"""Fast reader for the raw hourly WRF files.
+
+The raw hourly files are netCDF-3 (classic or 64-bit offset) files that come in only
+a handful of fixed layouts, where every variable sits at the same byte offset in every
+file of a given layout. The header of the first file seen for each file size is parsed
+once and the variable offsets, dtypes and shapes are cached. Every other file of that
+size only has its header bytes checked against the cached one (ignoring attribute values,
+such as forecast_time, which vary between files), and variables are then read straight
+from a memory map of the file instead of going through xr.open_dataset.
+
+Any file that is not netCDF-3, does not match the cached layout for its size, or has a
+variable needing decoding beyond masking fill values (packed data, times, strings)
+is read with xarray instead, so results are always the same as xr.open_dataset.
+
+Glossary:
+- path_like: a pathlib.Path object or string that can be interpreted as one.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import numpy as np
+import xarray as xr
+
+
+# nc_type codes from the netCDF-3 format specification
+NC_TYPES = {1: ">i1", 2: "S1", 3: ">i2", 4: ">i4", 5: ">f4", 6: ">f8"}
+# list tags
+NC_DIMENSION = 10
+NC_VARIABLE = 11
+NC_ATTRIBUTE = 12
+
+# parsed layouts keyed by file size
+layouts = {}
+
+
+class Header:
+    """Cursor over the bytes of a netCDF-3 header, for parsing it front to back.
+    Raises EOFError if the header extends beyond the bytes supplied.
+
+    Args:
+        buf (bytes): bytes from the start of the file
+    """
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+        self.mask = np.ones(len(buf), dtype=bool)
+
+    def read(self, n):
+        if self.pos + n > len(self.buf):
+            raise EOFError
+        out = self.buf[self.pos : self.pos + n]
+        self.pos += n
+
+        return out
+
+    def int(self):
+        return struct.unpack(">i", self.read(4))[0]
+
+    def offset(self, version):
+        # begin offsets are 64 bit in the 64-bit offset format
+        if version == 2:
+            return struct.unpack(">q", self.read(8))[0]
+        return self.int()
+
+    def name(self):
+        n = self.int()
+        name = self.read(n).decode("utf-8")
+        self.read(-n % 4)
+
+        return name
+
+    def attrs(self):
+        """parse an attribute list into a dict of (nc_type, nelems, value offset)
+        tuples, leaving the attribute values out of the header mask"""
+        tag, nelems = self.int(), self.int()
+        if tag not in (0, NC_ATTRIBUTE):
+            raise ValueError("Unexpected attribute list tag")
+        attrs = {}
+        for _ in range(nelems):
+            name = self.name()
+            nc_type, n = self.int(), self.int()
+            nbytes = n * np.dtype(NC_TYPES[nc_type]).itemsize
+            attrs[name] = (nc_type, n, self.pos)
+            # values can differ between files of the same layout
+            self.mask[self.pos : self.pos + nbytes + (-nbytes % 4)] = False
+            self.read(nbytes + (-nbytes % 4))
+
+        return attrs
+
+
+def parse_header(buf):
+    """Parse the header of a netCDF-3 file
+
+    Args:
+        buf (bytes): bytes from the start of the file, at least as long as the header
+
+    Returns:
+        layout (dict): the header bytes and mask of the bytes that are the same for all
+            files of this layout, the record size and number of records, and the
+            global and variable attributes, dimensions, dtypes, shapes and data
+            offsets of each variable
+    """
+    header = Header(buf)
+    magic = header.read(4)
+    if magic[:3] != b"CDF" or magic[3] not in (1, 2):
+        raise ValueError("Not a netCDF-3 classic or 64-bit offset file")
+    version = magic[3]
+    numrecs = header.int()
+
+    tag, ndims = header.int(), header.int()
+    if tag not in (0, NC_DIMENSION):
+        raise ValueError("Unexpected dimension list tag")
+    dims = [(header.name(), header.int()) for _ in range(ndims)]
+
+    gattrs = header.attrs()
+
+    tag, nvars = header.int(), header.int()
+    if tag not in (0, NC_VARIABLE):
+        raise ValueError("Unexpected variable list tag")
+    variables = {}
+    for _ in range(nvars):
+        name = header.name()
+        dimids = [header.int() for _ in range(header.int())]
+        attrs = header.attrs()
+        nc_type = header.int()
+        vsize = header.int()
+        begin = header.offset(version)
+        record = len(dimids) > 0 and dims[dimids[0]][1] == 0
+        shape = tuple(numrecs if dims[i][1] == 0 else dims[i][1] for i in dimids)
+        variables[name] = {
+            "dims": tuple(dims[i][0] for i in dimids),
+            "shape": shape,
+            "dtype": np.dtype(NC_TYPES[nc_type]),
+            "begin": begin,
+            "vsize": vsize,
+            "record": record,
+            "attrs": attrs,
+        }
+
+    # record variables are interleaved, one record of each variable at a time,
+    #  without padding if there is only one of them
+    rec_vars = [var for var in variables.values() if var["record"]]
+    if len(rec_vars) == 1:
+        var = rec_vars[0]
+        recsize = int(np.prod(var["shape"][1:])) * var["dtype"].itemsize
+    else:
+        recsize = sum(var["vsize"] for var in rec_vars)
+
+    layout = {
+        "header": np.frombuffer(buf[: header.pos], dtype=np.uint8),
+        "mask": header.mask[: header.pos],
+        "numrecs": numrecs,
+        "recsize": recsize,
+        "attrs": gattrs,
+        "variables": variables,
+    }
+
+    return layout
+
+
+def read_header(fd, size):
+    """Read and parse the header of an open file, reading more of the
+    file until the whole header has been read"""
+    n = 65536
+    while True:
+        buf = os.pread(fd, n, 0)
+        try:
+            return parse_header(buf)
+        except EOFError:
+            if n >= size:
+                raise ValueError("Truncated netCDF-3 header")
+            n *= 4
+
+
+def get_layout(fd):
+    """Get the layout of an open file, parsing the header only if no file of the same
+    size has been seen before or if the header does not match the cached layout.
+
+    Args:
+        fd (int): file descriptor of the open file
+
+    Returns:
+        tuple of layout (dict), see parse_header, and the header
+            bytes of this file (numpy.ndarray)
+    """
+    size = os.fstat(fd).st_size
+    layout = layouts.get(size)
+    if layout is not None:
+        n = len(layout["header"])
+        header = np.frombuffer(os.pread(fd, n, 0), dtype=np.uint8)
+        if len(header) == n and np.array_equal(
+            header[layout["mask"]], layout["header"][layout["mask"]]
+        ):
+            return layout, header
+
+    layout = read_header(fd, size)
+    layouts[size] = layout
+
+    return layout, layout["header"]
+
+
+def get_layout_key(layout):
+    """Get a key identifying a layout, from a hash of the header bytes that
+    are the same for all files of the layout"""
+    return hashlib.sha1(layout["header"][layout["mask"]].tobytes()).hexdigest()[:16]
+
+
+def stat_file(fp):
+    """Get the size and modification time of a file, for checking it against
+    the inventory (see inventory.py) or the forecast times cache (see forecast_times.py)
+
+    Args:
+        fp (path_like): path to the file
+
+    Returns:
+        tuple of (size, mtime)
+    """
+    stat = os.stat(fp)
+
+    return stat.st_size, stat.st_mtime
+
+
+def decode_attrs(attrs, header):
+    """Decode attribute values from the header bytes of a file
+
+    Args:
+        attrs (dict): attributes from the file's layout, see Header.attrs
+        header (numpy.ndarray): header bytes of the file
+
+    Returns:
+        dict of attribute values, as strings or numpy scalars or arrays
+    """
+    out = {}
+    for name, (nc_type, n, pos) in attrs.items():
+        dtype = np.dtype(NC_TYPES[nc_type])
+        raw = header[pos : pos + n * dtype.itemsize].tobytes()
+        if nc_type == 2:
+            out[name] = raw.rstrip(b"\x00").decode("utf-8")
+        else:
+            value = np.frombuffer(raw, dtype=dtype).astype(dtype.newbyteorder("="))
+            out[name] = value[0] if n == 1 else value
+
+    return out
+
+
+def needs_xarray(attrs, dtype):
+    """Check whether a variable needs decoding by xarray beyond masking fill values"""
+    if dtype.kind not in "f":
+        return True
+    if any(key in attrs for key in ("scale_factor", "add_offset", "_Unsigned")):
+        return True
+    if " since " in str(attrs.get("units", "")):
+        return True
+
+    return False
+
+
+def map_var(mm, var, recsize):
+    """Get a read-only array view of a variable's data in a memory map of a file,
+    with records recsize bytes apart for record variables"""
+    shape, dtype = var["shape"], var["dtype"]
+    # C-order strides
+    strides, step = [], dtype.itemsize
+    for n in reversed(shape):
+        strides.insert(0, step)
+        step *= n
+    if var["record"]:
+        strides[0] = recsize
+
+    return np.ndarray(shape, dtype, buffer=mm, offset=var["begin"], strides=strides)
+
+
+def mask_fill_values(arr, attrs):
+    """Replace the fill values of a variable in an array of its data with NaN, in place"""
+    for name in ("_FillValue", "missing_value"):
+        if name in attrs:
+            fill_values = np.atleast_1d(attrs[name])
+            for fill_value in fill_values[~np.isnan(fill_values)]:
+                arr[arr == np.array(fill_value, dtype=arr.dtype)] = np.nan
+
+    return arr
+
+
+def read_from_map(mm, layout, var, attrs, key):
+    """Read a variable's data from a memory map of a file, masking fill values"""
+    arr = map_var(mm, var, layout["recsize"])
+    if key is not None:
+        arr = arr[key]
+    arr = np.array(arr, dtype=var["dtype"].newbyteorder("="))
+
+    return mask_fill_values(arr, attrs)
+
+
+def read_vars(fp, varnames, key=None):
+    """Read the data of variables from a raw hourly WRF file
+
+    Args:
+        fp (path_like): path to the file to read
+        varnames (list): names of the variables to read
+        key (tuple): optional index into the variables' arrays, e.g. (0,)
+            to read only the first level of a 3D variable
+
+    Returns:
+        arrs (dict): numpy arrays of the variables' data keyed by variable name, the
+            same as the values of the variables from xr.open_dataset(fp)
+    """
+    arrs = {}
+    fallback = []
+    with open(fp, "rb") as src:
+        try:
+            layout, header = get_layout(src.fileno())
+        except ValueError:
+            layout = None
+
+        if layout is not None:
+            with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for varname in varnames:
+                    var = layout["variables"].get(varname)
+                    if var is None:
+                        fallback.append(varname)
+                        continue
+                    attrs = decode_attrs(var["attrs"], header)
+                    if needs_xarray(attrs, var["dtype"]):
+                        fallback.append(varname)
+                        continue
+                    arrs[varname] = read_from_map(mm, layout, var, attrs, key)
+        else:
+            fallback = list(varnames)
+
+    if fallback:
+        with xr.open_dataset(fp) as ds:
+            for varname in fallback:
+                da = ds[varname]
+                arrs[varname] = (da if key is None else da[key]).values
+
+    return arrs
+
+
+def read_var(fp, varname, key=None):
+    """Read the data of a single variable from a raw hourly WRF file, see read_vars
+
+    Args:
+        fp (path_like): path to the file to read
+        varname (str): name of the variable to read
+        key (tuple): optional index into the variable's array
+
+    Returns:
+        arr (numpy.ndarray): the same as xr.open_dataset(fp)[varname].values
+    """
+    return read_vars(fp, [varname], key)[varname]
+
+
+def read_attrs(fp, varname=None):
+    """Read the attributes of a raw hourly WRF file or one of its variables
+
+    Args:
+        fp (path_like): path to the file to read
+        varname (str): name of the variable to read attributes of. Global attributes
+            of the file are read if not supplied.
+
+    Returns:
+        attrs (dict): attribute values keyed by name
+    """
+    with open(fp, "rb") as src:
+        try:
+            layout, header = get_layout(src.fileno())
+        except ValueError:
+            layout = None
+
+    if layout is None or (varname is not None and varname not in layout["variables"]):
+        with xr.open_dataset(fp) as ds:
+            return dict((ds if varname is None else ds[varname]).attrs)
+
+    if varname is None:
+        return decode_attrs(layout["attrs"], header)
+
+    return decode_attrs(layout["variables"][varname]["attrs"], header)
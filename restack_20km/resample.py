@@ -1,4 +1,6 @@
 """Resample hourly file to daily. Reads a file, resamples based on provided aggregation info, writes new daily file.
+Multiple aggregations (e.g. max, min and mean of t2) can be given, in which case each hourly file is read once and all daily files are written from it.
+With -z, reads each year from the Zarr store of the hourly data for the WRF group and writes it to a Zarr store of the daily data.
 
 Usage:
     Designed to be called via slurm scripts created by `slurm.write_sbatch_resample.py`
@@ -6,34 +8,169 @@ Usage:
 
 import argparse
 import time
+import warnings
 from multiprocessing import Pool
 from pathlib import Path
 import xarray as xr
 import numpy as np
 import pandas as pd
+# project
+import luts
+from restack import get_profile_encoding, get_stats_fp, make_zarr_store, StepStats, ZarrWriter
 
 
-def resample(fp, aggr, varname, out_varname, out_fp):
-    """Resample a restacked hourly WRF dataset to a daily resolution using the provided aggregation function
+# aggregations done with aggregate_daily, with the numpy functions for
+#  data with and without missing values
+daily_reducers = {
+    "max": (np.max, np.nanmax),
+    "min": (np.min, np.nanmin),
+    "mean": (np.mean, np.nanmean),
+    "sum": (np.sum, np.nansum),
+}
+
+
+def reduce_steps(arr, aggr, axis, skipna):
+    """Reduce an array along an axis of time steps with one of daily_reducers
+    
+    Args:
+        arr (numpy.ndarray): array to reduce
+        aggr (str): aggregation function to use, a key of daily_reducers
+        axis (int): axis to reduce
+        skipna (bool): ignore missing values, same as xarray
+        
+    Returns:
+        numpy.ndarray of arr reduced along axis, with the dtype of arr
+    """
+    func = daily_reducers[aggr][int(skipna)]
+
+    # means and sums accumulate in the dtype of arr, same as xarray
+    return func(arr, axis=axis)
+
+
+def get_steps_per_day(times):
+    """Get the number of time steps in a complete day from the most common
+    interval between timestamps (24 for hourly data)
+    
+    Args:
+        times (pandas.DatetimeIndex): sorted timestamps
+        
+    Returns:
+        int number of time steps per day
+    """
+    if len(times) < 2:
+        return 24
+    step = pd.Series(np.diff(times.values)).mode()[0]
+
+    return max(1, pd.Timedelta("1D") // pd.Timedelta(step))
+
+
+def aggregate_daily(arr, times, aggr, steps_per_day=None):
+    """Aggregate an hourly array to daily. The time steps of consecutive complete days
+    are reshaped to (days, steps_per_day, ...) and reduced in a single call, and only
+    the days with missing hours are reduced one at a time.
+    
+    Args:
+        arr (numpy.ndarray): hourly data, time dimension first
+        times (pandas.DatetimeIndex): sorted timestamps of the time steps in arr
+        aggr (str): aggregation function to use, a key of daily_reducers
+        steps_per_day (int): number of time steps in a complete day, from
+            get_steps_per_day if not supplied
+        
+    Returns:
+        tuple of (daily_dates, daily_arr, missing), where daily_dates is a
+            pandas.DatetimeIndex of every day from the first to the last day in times,
+            daily_arr is the daily data (missing values for days with no time steps),
+            and missing is a pandas.DataFrame of the number of time steps ("n_steps")
+            of the days that do not have steps_per_day ("expected_steps") of them
+    """
+    if steps_per_day is None:
+        steps_per_day = get_steps_per_day(times)
+    days = times.floor("D")
+    daily_dates = pd.date_range(days[0], days[-1], freq="D")
+    day_idx = daily_dates.get_indexer(days)
+    counts = np.bincount(day_idx, minlength=len(daily_dates))
+    starts = np.searchsorted(day_idx, np.arange(len(daily_dates)))
+    complete = counts == steps_per_day
+    # data restacked from the raw files may have missing values
+    skipna = bool(np.isnan(arr).any())
+
+    daily_arr = np.full((len(daily_dates),) + arr.shape[1:], np.nan, dtype=arr.dtype)
+    with warnings.catch_warnings():
+        # all-missing slices give missing values, same as xarray
+        warnings.simplefilter("ignore", RuntimeWarning)
+        # runs of consecutive complete days, as [first day, last day + 1)
+        runs = np.flatnonzero(np.diff(np.concatenate([[0], complete, [0]])))
+        for first, stop in runs.reshape(-1, 2):
+            block = arr[starts[first] : starts[first] + (stop - first) * steps_per_day]
+            daily_arr[first:stop] = reduce_steps(
+                block.reshape((stop - first, steps_per_day) + arr.shape[1:]),
+                aggr,
+                1,
+                skipna,
+            )
+        for i in np.flatnonzero(~complete & (counts > 0)):
+            daily_arr[i] = reduce_steps(
+                arr[starts[i] : starts[i] + counts[i]], aggr, 0, skipna
+            )
+
+    missing = pd.DataFrame(
+        {"n_steps": counts[~complete], "expected_steps": steps_per_day},
+        index=daily_dates[~complete],
+    )
+
+    return daily_dates, daily_arr, missing
+
+
+def report_missing_hours(missing, varname, aggr, max_days=10):
+    """Print the days with missing hours from aggregate_daily, listing up to max_days of them"""
+    if len(missing) == 0:
+        return
+    days_str = ", ".join(
+        f"{row.Index:%Y-%m-%d} ({row.n_steps}/{row.expected_steps})"
+        for row in missing.iloc[:max_days].itertuples()
+    )
+    if len(missing) > max_days:
+        days_str += ", ..."
+    print(
+        f"WARNING: daily {aggr} of {varname} made from {len(missing)} incomplete days "
+        f"(time steps/expected): {days_str}"
+    )
+
+    return
+
+
+def make_daily_ds(ds, aggr, varname, out_varname, report=True):
+    """Resample a restacked hourly WRF dataset to a daily resolution using the provided
+    aggregation function, and update the metadata for the daily data
     
     Args:
-        fp (path_like): path to hourly WRF dataset
+        ds (xarray.Dataset): hourly WRF dataset
         aggr (str): aggregation function to use
         varname (str): name of WRF variable
         out_varname (str): name of the new aggregate variable
-        out_fp (pathlike): path to write resampled dataset
+        report (bool): print the days that are missing any hours
         
     Returns:
-        day_ds (xarray.Dataset): daily WRF dataset created from hourly input
+        ds_day (xarray.Dataset): daily WRF dataset created from hourly input
     """
-    # do the resampling based on aggregation type
-    with xr.open_dataset(fp) as ds:
+    if aggr in daily_reducers:
+        da = ds[varname]
+        daily_dates, daily_arr, missing = aggregate_daily(
+            da.values, ds.indexes["time"], aggr
+        )
+        if report:
+            report_missing_hours(missing, varname, aggr)
+        ds_day = ds.drop_vars([varname, "time"]).assign_coords(time=daily_dates)
+        ds_day[out_varname] = (da.dims, daily_arr, da.attrs)
+    else:
         # metric switch -- aggregation
         aggr_str = "1D"
         # use string name of aggr that to call the matching method
         ds_day = getattr(ds.resample(time=aggr_str), aggr)()
+        ds_day = ds_day.rename({varname: out_varname})
 
-    ds_day = ds_day.rename({wrf_varname: out_varname})
+    # copy so that the attributes of the hourly dataset are not changed
+    ds_day.attrs = dict(ds_day.attrs)
     ds_day.attrs["history"] += f"\nresample date: {time.ctime()} AKST"
     # update local attrs
     ds_day[out_varname].attrs.update(temporal_resampling=(
@@ -53,6 +190,9 @@ def resample(fp, aggr, varname, out_varname, out_fp):
         "level_indicator",
         "center",
         "coordinates",
+        # the range of the hourly data, set for the daily data when written
+        "valid_min",
+        "valid_max",
     ]
     for attr in rm_attrs:
         try:
@@ -61,12 +201,130 @@ def resample(fp, aggr, varname, out_varname, out_fp):
         except KeyError:
             pass
 
+    return ds_day
+
+
+def make_daily_zarr_store(fp, aggr, varname, out_varname, out_fp, profile="default"):
+    """Create the Zarr store for the daily data of a WRF group, with every day from the
+    first to the last time step in the Zarr store of the hourly data (the same days that
+    aggregate_daily gives), see restack.make_zarr_store
+    
+    Args:
+        fp (path_like): path to the Zarr store of the hourly WRF data
+        aggr (str): aggregation function to use
+        varname (str): name of WRF variable
+        out_varname (str): name of the new aggregate variable
+        out_fp (pathlib.Path): path to the Zarr store to create
+        profile (str): name of the encoding profile in luts.encoding_profiles
+        
+    Returns:
+        None, creates the store at out_fp
+    """
+    with xr.open_zarr(fp) as ds:
+        days = ds.indexes["time"].floor("D")
+        daily_dates = pd.date_range(days[0], days[-1], freq="D")
+        # metadata are taken from the first day
+        ds_day = make_daily_ds(
+            ds.isel(time=slice(0, 1)), aggr, varname, out_varname, report=False
+        )
+
+    da = ds_day[out_varname]
+    placeholder = np.broadcast_to(np.float32(np.nan), (len(daily_dates),) + da.shape[1:])
+    time_attrs = ds_day["time"].attrs
+    ds_day = ds_day.drop_vars([out_varname, "time"]).assign_coords(time=daily_dates)
+    ds_day["time"].attrs = time_attrs
+    ds_day[out_varname] = (da.dims, placeholder, da.attrs)
+    ds_day[out_varname].encoding = get_profile_encoding(
+        luts.encoding_profiles[profile], da.dims, placeholder.shape
+    )
+    make_zarr_store(out_fp, ds_day)
+
+    return
+
+
+def write_daily_ds(ds_day, out_varname, out_fp, profile="default"):
+    """Write a daily WRF dataset to a file, or to its year's slice of a Zarr store,
+    with the statistics of each day in a sidecar file, see restack.StepStats
+    
+    Args:
+        ds_day (xarray.Dataset): daily WRF dataset from make_daily_ds
+        out_varname (str): name of the aggregate variable
+        out_fp (pathlike): path to write resampled dataset, or the Zarr store of the
+            daily data for the WRF group, from make_daily_zarr_store, to write
+            the year to if it has the ".zarr" suffix
+        profile (str): name of the encoding profile in luts.encoding_profiles.
+            Not used for Zarr stores, which are encoded when created.
+        
+    Returns:
+        None, writes ds_day to out_fp
+    """
+    if out_fp.suffix == ".zarr":
+        with ZarrWriter(out_fp, out_varname, ds_day.indexes["time"]) as writer:
+            writer.write(0, ds_day[out_varname].values)
+
+        return
+
     # set output compression and encoding for serialization
     encoding = ds_day[out_varname].encoding
-    encoding.update(zlib=True, complevel=5, contiguous=False, chunksizes=None, dtype="float32")
+    encoding.update(
+        get_profile_encoding(
+            luts.encoding_profiles[profile],
+            ds_day[out_varname].dims,
+            ds_day[out_varname].shape,
+        )
+    )
     ds_day[out_varname].encoding = encoding
+    stats = StepStats(ds_day.indexes["time"], encoding["dtype"])
+    stats.update(0, ds_day[out_varname].values)
+    valid_range = stats.valid_range()
+    if valid_range is not None:
+        dtype = np.dtype(encoding["dtype"]).type
+        ds_day[out_varname].attrs.update(
+            valid_min=dtype(valid_range[0]), valid_max=dtype(valid_range[1])
+        )
     # write
     ds_day.to_netcdf(out_fp)
+    stats.write(get_stats_fp(out_fp))
+
+    return
+
+
+def resample(fp, aggr, varname, out_varname, out_fp, profile="default", year=None):
+    """Resample a restacked hourly WRF dataset to a daily resolution using the provided aggregation function(s)
+    
+    Args:
+        fp (path_like): path to hourly WRF dataset, or to the Zarr store of the
+            hourly data for the WRF group if it has the ".zarr" suffix
+        aggr (str or list): aggregation function to use, or list of aggregation functions
+            to compute from a single read of the hourly data
+        varname (str): name of WRF variable
+        out_varname (str or list): name of the new aggregate variable, or list of names
+            matching aggr
+        out_fp (pathlike or list): path to write resampled dataset, or the Zarr store of the
+            daily data for the WRF group, from make_daily_zarr_store, to write
+            the year to if it has the ".zarr" suffix. List of paths matching aggr.
+        profile (str): name of the encoding profile in luts.encoding_profiles.
+            Not used for Zarr stores, which are encoded when created.
+        year (int): year to resample from the Zarr store of the hourly data
+        
+    Returns:
+        None, writes the daily WRF dataset(s) created from hourly input to out_fp
+    """
+    if isinstance(aggr, str):
+        aggr, out_varname, out_fp = [aggr], [out_varname], [out_fp]
+
+    # read and decompress the hourly data once for all aggregations
+    if fp.suffix == ".zarr":
+        with xr.open_zarr(fp) as ds:
+            ds = ds.sel(time=str(year)).load()
+    else:
+        with xr.open_dataset(fp) as ds:
+            ds.load()
+
+    # do the resampling based on aggregation type
+    for day_aggr, day_varname, day_fp in zip(aggr, out_varname, out_fp):
+        ds_day = make_daily_ds(ds, day_aggr, varname, day_varname)
+        write_daily_ds(ds_day, day_varname, day_fp, profile)
 
     return
 
@@ -86,13 +344,13 @@ if __name__ == '__main__':
         "-y", dest="year_str", help="String for years to process, in '<start year>-<end year>' format, or '_'-separated list of individual years"
     )
     parser.add_argument(
-        "-a", dest="aggr", help="Name of aggregation method"
+        "-a", dest="aggr", nargs="+", help="Name of aggregation method, or names of multiple methods to compute from one read of each hourly file"
     )
     parser.add_argument(
         "-wv", dest="wrf_varname", help="Name of WRF variable"
     )
     parser.add_argument(
-        "-ov", dest="out_varname", help="Name of output variable"
+        "-ov", dest="out_varname", nargs="+", help="Name of output variable, or names of output variables matching the aggregation methods"
     )
     parser.add_argument(
         "-fs",
@@ -105,17 +363,38 @@ if __name__ == '__main__':
         type=int,
         help="Number of CPUs to use for multiprocessing",
     )
+    parser.add_argument(
+        "-p",
+        dest="profile",
+        default="default",
+        choices=list(luts.encoding_profiles),
+        help="Name of the encoding profile in luts.encoding_profiles to write with",
+    )
+    parser.add_argument(
+        "-z",
+        dest="zarr",
+        action="store_true",
+        default=False,
+        help=(
+            "Read from the Zarr store of the hourly data for the WRF group and write to "
+            "a Zarr store of the daily data, which is created if it does not exist yet"
+        ),
+    )
     
     # parse the args and unpack
     args = parser.parse_args()
     hourly_dir = Path(args.hourly_dir)
     daily_dir = Path(args.daily_dir)
     year_str = args.year_str
-    aggr = args.aggr
+    aggrs = args.aggr
     wrf_varname = args.wrf_varname
-    out_varname = args.out_varname
+    out_varnames = args.out_varname
     fn_str = args.fn_str
     ncpus = args.ncpus
+    profile = args.profile
+    use_zarr = args.zarr
+    if len(aggrs) != len(out_varnames):
+        parser.error("-a and -ov must be given the same number of names")
     
     # years to work on
     if "_" in year_str:
@@ -125,16 +404,32 @@ if __name__ == '__main__':
     else:
         years = [int(year_str)]
     
-    # output dir is derived from hourly restack dir 
-    out_dir = daily_dir.joinpath(out_varname)
-    out_dir.mkdir(exist_ok=True, parents=True)
+    # output dirs are derived from hourly restack dir 
+    out_dirs = [daily_dir.joinpath(out_varname) for out_varname in out_varnames]
+    for out_dir in out_dirs:
+        out_dir.mkdir(exist_ok=True, parents=True)
     
     # generate args for pooling
     args = []
-    for year in years:
-        fp = hourly_dir.joinpath(wrf_varname, f"{wrf_varname}_hourly_wrf_{fn_str}_{year}.nc")
-        out_fp = out_dir.joinpath(f"{out_varname}_daily_wrf_{fn_str}_{year}.nc")
-        args.append((fp, aggr, wrf_varname, out_varname, out_fp))
+    if use_zarr:
+        fp = hourly_dir.joinpath(wrf_varname, f"{wrf_varname}_hourly_wrf_{fn_str}.zarr")
+        out_fps = [
+            out_dir.joinpath(f"{out_varname}_daily_wrf_{fn_str}.zarr")
+            for out_dir, out_varname in zip(out_dirs, out_varnames)
+        ]
+        for aggr, out_varname, out_fp in zip(aggrs, out_varnames, out_fps):
+            if not out_fp.exists():
+                make_daily_zarr_store(fp, aggr, wrf_varname, out_varname, out_fp, profile)
+        for year in years:
+            args.append((fp, aggrs, wrf_varname, out_varnames, out_fps, profile, year))
+    else:
+        for year in years:
+            fp = hourly_dir.joinpath(wrf_varname, f"{wrf_varname}_hourly_wrf_{fn_str}_{year}.nc")
+            out_fps = [
+                out_dir.joinpath(f"{out_varname}_daily_wrf_{fn_str}_{year}.nc")
+                for out_dir, out_varname in zip(out_dirs, out_varnames)
+            ]
+            args.append((fp, aggrs, wrf_varname, out_varnames, out_fps, profile))
 
     # run the resampling
     tic = time.perf_counter()
@@ -143,6 +438,6 @@ if __name__ == '__main__':
 
     print((
         f"Hourly files in {hourly_dir.joinpath(wrf_varname)} for {fn_str} "
-        f"resampled to daily and written to {out_dir} in "
+        f"resampled to daily and written to {', '.join(str(out_dir) for out_dir in out_dirs)} in "
         f"{round((time.perf_counter() - tic) / 60)}m"
     ))
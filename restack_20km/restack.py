@@ -5,17 +5,25 @@ Usage:
 """
 
 import argparse
+import functools
+import hashlib
 import importlib.util
 import os
 import sys
 import time
-from datetime import datetime
-from multiprocessing import Pool
+import warnings
+from multiprocessing import Pool, resource_tracker, shared_memory
 from pathlib import Path
+import netCDF4
 import numpy as np
+import numcodecs
 import pandas as pd
 import xarray as xr
+import zarr
 from pyproj import Proj, Transformer
+# project
+import raw_reader
+from forecast_groups import check_group_index, make_group_index
 
 
 def interp_1d_along_axis(y):
@@ -27,6 +35,55 @@ def interp_1d_along_axis(y):
     return y
 
 
+def interp_nan_slices(arr):
+    """Interpolate across the time slices of a 3D array that are entirely NaN,
+    such as those inserted by diff_stacked at the start of each forecast_time group.
+    Each slice is filled from the weighted neighboring valid slices, which gives
+    the same values as interp_1d_along_axis on every pixel without looping
+    over the pixels. Falls back to interp_1d_along_axis if there are NaNs
+    outside of whole NaN slices.
+    
+    Args:
+        arr (numpy.ndarray): 3D (or more) array with time as the first dimension
+        
+    Returns:
+        arr (numpy.ndarray): the array with NaN slices filled in place
+    """
+    nans = np.isnan(arr).reshape(arr.shape[0], -1)
+    nan_slices = nans.all(axis=1)
+    (nan_idx,) = np.nonzero(nan_slices)
+    (valid_idx,) = np.nonzero(~nan_slices)
+    if nans[valid_idx].any() or len(valid_idx) == 0:
+        # NaNs that differ between pixels need to be interpolated pixel by pixel
+        return np.apply_along_axis(interp_1d_along_axis, axis=0, arr=arr)
+    del nans
+
+    # index of the first valid slice after each NaN slice
+    right = np.searchsorted(valid_idx, nan_idx)
+    for idx, r in zip(nan_idx, right):
+        if r == 0:
+            # before the first valid slice, use its values like np.interp does
+            arr[idx] = arr[valid_idx[0]]
+        elif r == len(valid_idx):
+            arr[idx] = arr[valid_idx[-1]]
+        else:
+            # match the double precision arithmetic of np.interp
+            x0, x1 = float(valid_idx[r - 1]), float(valid_idx[r])
+            y0 = arr[valid_idx[r - 1]].astype(np.float64)
+            y1 = arr[valid_idx[r]].astype(np.float64)
+            slope = (y1 - y0) / (x1 - x0)
+            interp = slope * (idx - x0) + y0
+            # np.interp tries from the other side if it gets a NaN
+            redo = np.isnan(interp)
+            if redo.any():
+                interp[redo] = slope[redo] * (idx - x1) + y1[redo]
+                same = np.isnan(interp) & (y0 == y1)
+                interp[same] = y0[same]
+            arr[idx] = interp
+
+    return arr
+
+
 def open_ds(fp, varname):
     """Open a file as an xarray dataset and read
     a supplied variable's data in as an arr
@@ -38,30 +95,233 @@ def open_ds(fp, varname):
     Returns:
         arr (numpy.ndarray): the data array underlying the variable of interest
     """
-    with xr.open_dataset(fp) as ds:
-        arr = ds[varname].values
+    arr = raw_reader.read_var(fp, varname)
 
     return arr
 
 
-def restack(fps, varname, ncpus):
+def open_ds_vars(fp, varnames, wind_varnames=(), geogrid_fp=None):
+    """Open a file as an xarray dataset once and read the data
+    of every supplied variable, rotating any wind components
+    
+    Args:
+        fp (path_like): path to the file to open
+        varnames (list): names of dataset variables to read
+        wind_varnames (list): subset of varnames that are wind components
+            needing rotation to earth coordinates, or wind speed or direction
+            derived from them
+        geogrid_fp (path_like): path to the ancillary WRF geogrid file,
+            required if wind_varnames is not empty
+        
+    Returns:
+        arrs (dict): data arrays keyed by variable name
+    """
+    src_varnames = []
+    for varname in varnames:
+        if varname in wind_varnames:
+            src_varnames.extend(get_wind_component_names(varname))
+        else:
+            src_varnames.append(varname)
+    src_arrs = raw_reader.read_vars(fp, list(dict.fromkeys(src_varnames)))
+
+    arrs = {}
+    rotated = {}
+    for varname in varnames:
+        if varname in wind_varnames:
+            Uvar, Vvar = get_wind_component_names(varname)
+            # rotate each pair of components once for every variable using it
+            if Uvar not in rotated:
+                rotated[Uvar] = rotate_grid_winds(
+                    src_arrs[Uvar], src_arrs[Vvar], geogrid_fp
+                )
+            arrs[varname] = select_wind(varname, *rotated[Uvar])
+        else:
+            arrs[varname] = src_arrs[varname]
+
+    return arrs
+
+
+class SharedCube:
+    """A float32 array in shared memory, for pool workers to write restacked
+    time slices into directly instead of returning them to the parent process.
+    Use as a context manager or call release() when done with the data.
+    
+    Args:
+        shape (tuple): shape of the cube, time dimension first
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(int(n) for n in shape)
+        count = int(np.prod(self.shape))
+        size = count * np.dtype(np.float32).itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.arr = np.frombuffer(self.shm.buf, dtype=np.float32, count=count).reshape(
+            self.shape
+        )
+        self.released = False
+
+    @property
+    def spec(self):
+        """picklable (name, shape) tuple for attaching to the cube from a worker"""
+        return self.shm.name, self.shape
+
+    def release(self):
+        """Close and unlink the shared memory. Arrays built on the cube's array
+        should be deleted first, the memory stays mapped while any are referenced.
+        Releasing a cube more than once does nothing."""
+        if self.released:
+            return
+        self.released = True
+        self.arr = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # views of the array are still referenced, e.g. by the traceback of
+            #  an error. The memory is unmapped once they are gone
+            pass
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def make_pool(ncpus, geogrid_fp=None):
+    """Start a worker pool for restacking into shared memory cubes. The shared
+    memory resource tracker is started first so that the workers use the same
+    one as the parent process, instead of starting their own that would
+    warn about (and try to unlink) cubes that the parent is responsible for.
+    
+    Args:
+        ncpus (int): number of CPUs to use with multiprocessing
+        geogrid_fp (path_like): path to the ancillary WRF geogrid file. If
+            supplied, each worker loads the wind rotation fields once at
+            startup instead of for every hourly file it rotates.
+        
+    Returns:
+        multiprocessing.Pool
+    """
+    resource_tracker.ensure_running()
+    if geogrid_fp is None:
+        return Pool(ncpus)
+
+    return Pool(ncpus, initializer=get_rotation_coefs, initargs=(geogrid_fp,))
+
+
+def write_to_cube(spec, idx, arr):
+    """Write a time slice into a shared memory cube, flipped along the y axis
+    to match the flipped lat/lon arrays and y-coordinate of the output
+    
+    Args:
+        spec (tuple): (name, shape) tuple from SharedCube.spec
+        idx (int): index along the time dimension to write to
+        arr (numpy.ndarray): 2D or 3D data for a single time step
+        
+    Returns:
+        None, writes arr into the cube
+    """
+    shm_name, shape = spec
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        cube = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        cube[idx] = np.flip(arr, axis=-2)
+        del cube
+    finally:
+        shm.close()
+
+    return
+
+
+def read_to_cube(fp, varname, spec, idx):
+    """Read a variable from an hourly file into a shared memory cube"""
+    write_to_cube(spec, idx, open_ds(fp, varname))
+
+    return
+
+
+def read_vars_to_cubes(fp, targets, wind_varnames, geogrid_fp):
+    """Read multiple variables from an hourly file into shared memory cubes
+    
+    Args:
+        fp (path_like): path to the file to open
+        targets (dict): (spec, idx) tuples of the cube and time index
+            to write to, keyed by variable name
+        wind_varnames (list): names of targets that are wind components
+        geogrid_fp (path_like): path to the ancillary WRF geogrid file
+        
+    Returns:
+        None, writes the data into the cubes
+    """
+    arrs = open_ds_vars(fp, list(targets), wind_varnames, geogrid_fp)
+    for varname, (spec, idx) in targets.items():
+        write_to_cube(spec, idx, arrs[varname])
+
+    return
+
+
+def get_var_shapes(fp, varnames):
+    """Get the shape of a single time slice of variables from an hourly file
+    
+    Args:
+        fp (path_like): path to the file to open
+        varnames (list): names of dataset variables
+        
+    Returns:
+        dict of shape tuples keyed by variable name
+    """
+    with xr.open_dataset(fp) as ds:
+        shapes = {
+            # derived wind variables have the shape of the wind components
+            varname: ds[get_src_varname(varname, ds)].shape
+            for varname in varnames
+        }
+
+    return shapes
+
+
+def get_src_varname(varname, ds):
+    """Get the name of the variable in an hourly file that a variable is
+    restacked from, which is the U wind component for variables derived
+    from the wind components
+    
+    Args:
+        varname (str): name of variable being restacked
+        ds (xarray.Dataset): open hourly dataset
+        
+    Returns:
+        name of the variable in ds
+    """
+    if varname in ds:
+        return varname
+
+    return get_wind_component_names(varname)[0]
+
+
+def restack(fps, varname, pool, cube, time_idx=None):
     """Open list of hourly netCDF files, extract specified variable,
     and stack in order of provided filepath list.
     
     Args:
         fps (list): list of filepaths to extract data from and stack
         varname (str): name of variable to exrtact from hourly WRF files
-        ncpus (int): number of CPUs to use with multiprocessing
+        pool (multiprocessing.Pool): worker pool to read the files with
+        cube (SharedCube): shared memory cube of shape (len(fps), ...) to stack into
+        time_idx (list): indices along the time dimension of the cube to write the
+            data from each file to, if not in the order of fps
         
     Returns:
         stacked_arr (numpy.ndarray): 3D array of hourly WRF outputs for a
-            single variable that have been stacked along the time dimension
+            single variable that have been stacked along the time dimension,
+            as float32 and flipped along the y axis (the cube's array)
     """
-    args = [(fp, varname) for fp in fps]
-    with Pool(ncpus) as pool:
-        stacked_arr = np.array(pool.starmap(open_ds, args))
+    if time_idx is None:
+        time_idx = range(len(fps))
+    args = [(fp, varname, cube.spec, idx) for fp, idx in zip(fps, time_idx)]
+    pool.starmap(read_to_cube, args)
 
-    return stacked_arr
+    return cube.arr
 
 
 def diff_stacked(stacked_arr):
@@ -86,60 +346,89 @@ def diff_stacked(stacked_arr):
     return diff_arr
 
 
-def restack_accum(ftimes_df, year, varname, ncpus):
-    """Re-stack, diff, interpolate accumulation variables.
+def get_accum_groups(ftimes_df, year, groups_df=None):
+    """Get the forecast_time groups that overlap with a year, plus the
+    adjacent groups on either side for a seamless time series.
     
     Args:
-        ftimes_df (pandas.DataFrame): Path to the table containing parsed filename
+        ftimes_df (pandas.DataFrame): table containing parsed filename
             and forecast times
         year (int): year being worked on
-        varname (str): name of variable to extract from hourly WRF files
-        ncpus (int): number of CPUs to use with multiprocessing
+        groups_df (pandas.DataFrame): forecast_time group index for ftimes_df, from
+            read_group_index. Made from ftimes_df if not supplied, which may
+            be only some years of the forecast times table.
         
     Returns:
-        arr (numpy.ndarray): 3D array of stacked, diff'd, interpolated accumulation variable data
+        tuple of (groups, current_year_ind), where groups is a chronological list of
+            data frames for each forecast_time group and current_year_ind is
+            the index array of the year's time steps along the concatenated groups
     """
-    # group the data into forecast_time begin/end groups
-    groups = ftimes_df.groupby((ftimes_df["forecast_time"] == 6).cumsum())
-    # unpack to get just data frames
-    groups = [df for idx, df in groups]
-    # which indexes correspond to the year in question?
-    ind = [count for count, df in enumerate(groups) if year in df["year"].tolist()]
-
-    # test to be sure they are all chronological -- Should
-    #  be since dataframe is pre-sorted
-    assert np.diff(ind).all() == 1
+    if groups_df is None:
+        groups_df = make_group_index(ftimes_df)
+
+    # the groups that overlap with our current year, and the adjacent
+    #  groups where the series has them, for seamless time-series.
+    overlap_ids = groups_df["forecast_group"][
+        (groups_df["first_year"] <= year) & (groups_df["last_year"] >= year)
+    ]
+    ids = np.arange(overlap_ids.min() - 1, overlap_ids.max() + 2)
+    ids = ids[np.isin(ids, groups_df["forecast_group"])]
+    group_rows = groups_df.set_index("forecast_group").loc[ids]
+
+    # group ids are in chronological order, and row labels
+    #  are sorted, so each group is a slice of the table
+    groups = []
+    for group_id, start, end in group_rows[["start", "end"]].itertuples():
+        start, end = int(start), int(end)
+        group_df = ftimes_df.loc[start : end - 1]
+        if len(group_df) != end - start:
+            # e.g. a group extending into a year that read_ftimes did not read
+            raise ValueError(
+                f"Only {len(group_df)} of the {end - start} rows of forecast_time group "
+                f"{group_id} are in the forecast times table"
+            )
+        groups.append(group_df)
 
-    # handle beginning and ending years in the series
-    # get the forecast_time groups that overlap with our current year
-    #   and the adjacent groups for seamless time-series.
-    if ftimes_df["year"].max() > year > ftimes_df["year"].min():
-        first_outer_group_idx, last_outer_group_idx = (ind[0] - 1, ind[-1] + 1)
-        ind = [first_outer_group_idx] + ind + [last_outer_group_idx]
+    # we need some indexing for slicing the output array to ONLY this current year
+    groups_df = pd.concat(groups)  # should be chronological
+    (current_year_ind,) = np.where(groups_df["year"] == year)  # along time dimension
 
-    elif year == ftimes_df["year"].min():
-        last_outer_group_idx = ind[-1] + 1
-        ind = ind + [last_outer_group_idx]
+    return groups, current_year_ind
 
-    elif year == ftimes_df["year"].max():
-        first_outer_group_idx = ind[0] - 1
-        ind = [first_outer_group_idx] + ind
 
-    else:
-        AttributeError("broken groups and indexing issues...")
+def split_groups(stacked_arr, groups):
+    """Split an array stacked from the concatenated forecast_time groups
+    back into an array for each group
+    
+    Args:
+        stacked_arr (numpy.ndarray): array stacked along the time dimension
+            from the files of all groups, in order
+        groups (list): list of data frames for each forecast_time group
+        
+    Returns:
+        list of views of stacked_arr, one for each group
+    """
+    bounds = np.cumsum([len(df) for df in groups])[:-1]
 
-    # get the corresponding groups for current year processing
-    groups = [groups[idx] for idx in ind]
+    return np.split(stacked_arr, bounds)
 
-    # we need some indexing for slicing the output array to ONLY this current year
-    groups_df = pd.concat(groups)  # should be chronological
-    (current_year_ind,) = np.where(groups_df["year"] == year)  # along time dimension
 
-    # process groups and concatenate 3D cubes along time axis chronologically
-    stacked_arrs = [restack(df["filepath"], varname, ncpus) for df in groups]
+def diff_interp_groups(stacked_arrs, current_year_ind):
+    """Diff each stacked forecast_time group, interpolate across the
+    gaps this creates between groups, and slice to the current year.
+    
+    Args:
+        stacked_arrs (list): chronological list of 3D arrays of stacked
+            accumulation variable data, one for each forecast_time group
+        current_year_ind (numpy.ndarray): indices of the current year's time steps
+            along the concatenated groups
+        
+    Returns:
+        arr (numpy.ndarray): 3D array of diff'd, interpolated accumulation variable data
+    """
     arr = np.concatenate([diff_stacked(arr) for arr in stacked_arrs])
     # interpolate across the np.nan's brought in with differencing each forecast_time group
-    arr = np.apply_along_axis(interp_1d_along_axis, axis=0, arr=arr)
+    arr = interp_nan_slices(arr)
     # slice back to the current year
     arr = arr[current_year_ind, ...]
 
@@ -149,6 +438,315 @@ def restack_accum(ftimes_df, year, varname, ncpus):
     return arr
 
 
+class StackedCache:
+    """Cache of restacked time slices of accumulation variables, keyed by
+    variable name and hourly file path, size and modification time, for reusing
+    the forecast_time groups that are shared by consecutive years instead of
+    reading them again. Slices of files that have changed since they were cached
+    (e.g. recopied or fixed) are not used. Slices are kept in memory, and also saved
+    to cache_dir if supplied so that they can be reused by other restacking jobs.
+    
+    Args:
+        cache_dir (path_like): directory to save cached slices in
+    """
+
+    def __init__(self, cache_dir=None):
+        self.slices = {}
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+        # slices saved by this cache, the only ones it removes from cache_dir
+        self.saved_fps = {}
+
+    def get_key(self, varname, fp):
+        """Key of the slice of a variable from an hourly file, or None if the file
+        can not be stat'ed"""
+        try:
+            stat = os.stat(fp)
+        except OSError:
+            return None
+
+        return varname, str(fp), stat.st_size, stat.st_mtime_ns
+
+    def get_fp(self, key):
+        """Path for saving the slice with a key from get_key"""
+        varname, fp, size, mtime_ns = key
+        fn = hashlib.sha1(f"{fp}:{size}:{mtime_ns}".encode()).hexdigest() + ".npy"
+
+        return self.cache_dir.joinpath(varname, fn)
+
+    def get(self, varname, fp):
+        """Get the cached slice of a variable from an hourly file, or None"""
+        key = self.get_key(varname, fp)
+        if key is None:
+            return None
+        if key not in self.slices and self.cache_dir is not None:
+            try:
+                self.slices[key] = np.load(self.get_fp(key))
+            except (FileNotFoundError, ValueError):
+                # not cached, or partially written by another job
+                return None
+
+        return self.slices.get(key)
+
+    def keep(self, varname, fps, arr):
+        """Replace the cached slices of a variable with those supplied. Slices saved
+        to cache_dir by this cache that are not kept are removed, those saved by
+        other jobs sharing cache_dir are left alone.
+        
+        Args:
+            varname (str): name of the variable
+            fps (list): paths of the hourly files for each slice
+            arr (numpy.ndarray): restacked slices in the order of fps
+        """
+        self.slices = {
+            key: value for key, value in self.slices.items() if key[0] != varname
+        }
+        keep_fps = set()
+        for fp, arr_slice in zip(fps, arr):
+            key = self.get_key(varname, fp)
+            if key is None:
+                continue
+            self.slices[key] = np.array(arr_slice)
+            if self.cache_dir is not None:
+                cache_fp = self.get_fp(key)
+                keep_fps.add(cache_fp)
+                if not cache_fp.exists():
+                    cache_fp.parent.mkdir(exist_ok=True, parents=True)
+                    # write to a temporary file first so other jobs never
+                    #  read a partial slice
+                    tmp_fp = cache_fp.with_suffix(f".{os.getpid()}.tmp")
+                    with open(tmp_fp, "wb") as f:
+                        np.save(f, arr_slice)
+                    tmp_fp.replace(cache_fp)
+                    self.saved_fps.setdefault(varname, set()).add(cache_fp)
+
+        if self.cache_dir is not None:
+            saved_fps = self.saved_fps.get(varname, set())
+            for cache_fp in saved_fps - keep_fps:
+                cache_fp.unlink(missing_ok=True)
+            self.saved_fps[varname] = saved_fps & keep_fps
+
+        return
+
+
+def cache_boundary_groups(stacked_cache, varname, groups, stacked_arrs):
+    """Keep the restacked data of the last forecast_time groups of a year
+    for the next year. The group before the one spanning the new year, that one,
+    and the one after are the first groups of the next year.
+    
+    Args:
+        stacked_cache (StackedCache): cache of restacked slices
+        varname (str): name of the variable
+        groups (list): list of data frames for each forecast_time group
+        stacked_arrs (list): restacked data of each group
+        
+    Returns:
+        None, updates stacked_cache
+    """
+    fps = [fp for df in groups[-3:] for fp in df["filepath"]]
+    stacked_cache.keep(varname, fps, np.concatenate(stacked_arrs[-3:]))
+
+    return
+
+
+def restack_accum(
+    ftimes_df, year, varname, pool, cube, stacked_cache=None, groups_df=None
+):
+    """Re-stack, diff, interpolate accumulation variables.
+    
+    Args:
+        ftimes_df (pandas.DataFrame): Path to the table containing parsed filename
+            and forecast times
+        year (int): year being worked on
+        varname (str): name of variable to extract from hourly WRF files
+        pool (multiprocessing.Pool): worker pool to read the files with
+        cube (SharedCube): shared memory cube for the year's data
+        stacked_cache (StackedCache): cache of restacked slices to use instead of
+            reading the files again. Updated with this year's boundary groups
+            if supplied.
+        groups_df (pandas.DataFrame): forecast_time group index, see get_accum_groups
+        
+    Returns:
+        arr (numpy.ndarray): 3D array of stacked, diff'd, interpolated accumulation
+            variable data (the cube's array)
+    """
+    groups, current_year_ind = get_accum_groups(ftimes_df, year, groups_df)
+    fps = list(pd.concat(groups)["filepath"])
+    # restack the files of all groups chronologically in one go, then split
+    #  back into groups for differencing
+    with SharedCube((len(fps),) + cube.shape[1:]) as groups_cube:
+        read_idx = []
+        for idx, fp in enumerate(fps):
+            arr = None if stacked_cache is None else stacked_cache.get(varname, fp)
+            if arr is None:
+                read_idx.append(idx)
+            else:
+                groups_cube.arr[idx] = arr
+        read_fps = [fps[idx] for idx in read_idx]
+        restack(read_fps, varname, pool, groups_cube, read_idx)
+
+        stacked_arrs = split_groups(groups_cube.arr, groups)
+        cube.arr[:] = diff_interp_groups(stacked_arrs, current_year_ind)
+        if stacked_cache is not None:
+            cache_boundary_groups(stacked_cache, varname, groups, stacked_arrs)
+        del stacked_arrs
+
+    return cube.arr
+
+
+def restack_vars(
+    ftimes_df,
+    year,
+    varnames,
+    accum_varnames,
+    wind_varnames,
+    geogrid_fp,
+    pool,
+    cubes,
+    stacked_cache=None,
+    groups_df=None,
+):
+    """Restack multiple variables for a single year, reading each hourly file only once.
+    Accumulation and wind variables are handled the same way as in
+    restack_accum and restack_winds.
+    
+    Args:
+        ftimes_df (pandas.DataFrame): table containing parsed filename
+            and forecast times
+        year (int): year being worked on
+        varnames (list): names of variables to extract from hourly WRF files
+        accum_varnames (list): names of all accumulation variables
+        wind_varnames (list): names of all wind component variables
+        geogrid_fp (path_like): path to the ancillary WRF geogrid file
+        pool (multiprocessing.Pool): worker pool to read the files with
+        cubes (dict): shared memory cubes for the year's data, keyed by variable name
+        stacked_cache (StackedCache): cache of restacked slices of accumulation
+            variables, see restack_accum
+        groups_df (pandas.DataFrame): forecast_time group index, see get_accum_groups
+        
+    Returns:
+        arrs (dict): 3D (or 4D) arrays of restacked data keyed by variable name
+            (the cubes' arrays)
+    """
+    accum = [varname for varname in varnames if varname in accum_varnames]
+    winds = [varname for varname in varnames if varname in wind_varnames]
+    other = [varname for varname in varnames if varname not in accum]
+
+    if len(accum) > 0:
+        # accumulation variables need the groups on either side of the year,
+        #  files outside of the year only need to be read for those
+        groups, current_year_ind = get_accum_groups(ftimes_df, year, groups_df)
+        read_df = pd.concat(groups)
+    else:
+        read_df = ftimes_df[ftimes_df["year"] == year]
+    is_year = (read_df["year"] == year).values
+    year_idx = np.cumsum(is_year) - 1
+
+    # accumulation data are stacked across all of the groups before diffing
+    accum_cubes = {}
+    try:
+        for varname in accum:
+            accum_cubes[varname] = SharedCube(
+                (len(read_df),) + cubes[varname].shape[1:]
+            )
+        args = []
+        for idx, fp in enumerate(read_df["filepath"]):
+            targets = {}
+            for varname in accum:
+                arr = None if stacked_cache is None else stacked_cache.get(varname, fp)
+                if arr is None:
+                    targets[varname] = (accum_cubes[varname].spec, idx)
+                else:
+                    accum_cubes[varname].arr[idx] = arr
+            if is_year[idx]:
+                targets.update(
+                    {varname: (cubes[varname].spec, year_idx[idx]) for varname in other}
+                )
+            if len(targets) > 0:
+                args.append((fp, targets, winds, geogrid_fp))
+        pool.starmap(read_vars_to_cubes, args)
+
+        # split the stacked accumulation data back into forecast_time groups
+        for varname in accum:
+            stacked_arrs = split_groups(accum_cubes[varname].arr, groups)
+            cubes[varname].arr[:] = diff_interp_groups(stacked_arrs, current_year_ind)
+            if stacked_cache is not None:
+                cache_boundary_groups(stacked_cache, varname, groups, stacked_arrs)
+            del stacked_arrs
+            # free each variable's stack as soon as it is done with
+            accum_cubes[varname].release()
+    finally:
+        for accum_cube in accum_cubes.values():
+            accum_cube.release()
+
+    return {varname: cubes[varname].arr for varname in varnames}
+
+
+def get_wind_component_names(varname):
+    """Get the names of the U and V wind components that pair with a wind variable
+    
+    Args:
+        varname (str): name of the wind variable being worked on
+        
+    Returns:
+        tuple of U and V variable names
+    """
+    if varname[:4] in ["WSPD", "WDIR"]:
+        # derived wind speed and direction share the suffix of the components
+        Uvar = "U" + varname[4:]
+        Vvar = "V" + varname[4:]
+    elif varname in ["U", "U10", "UBOT"]:
+        Uvar = varname
+        Vvar = varname.replace("U", "V")
+    else:
+        Uvar = varname.replace("V", "U")
+        Vvar = varname
+
+    return Uvar, Vvar
+
+
+@functools.lru_cache()
+def get_rotation_coefs(geogrid_fp):
+    """Read the rotation fields needed to rotate grid-relative winds to
+    earth-relative from the geogrid file
+    
+    Args:
+        geogrid_fp (path_like): path to the ancillary WRF geogrid file
+        
+    Returns:
+        tuple of cosalpha (numpy.ndarray), sinalpha (numpy.ndarray), read-only
+    
+    Results are cached so the geogrid is only read once per process. Pool
+    workers load them at startup via the initializer set up in make_pool.
+    """
+    with xr.open_dataset(geogrid_fp) as geo_ds:
+        cosalpha = geo_ds["COSALPHA"].values
+        sinalpha = geo_ds["SINALPHA"].values
+
+    cosalpha.flags.writeable = False
+    sinalpha.flags.writeable = False
+
+    return cosalpha, sinalpha
+
+
+def rotate_grid_winds(Ugrid, Vgrid, geogrid_fp):
+    """Rotate grid-relative U and V wind component arrays to earth-relative
+    
+    Args:
+        Ugrid (numpy.ndarray): grid-relative U wind component
+        Vgrid (numpy.ndarray): grid-relative V wind component
+        geogrid_fp (path_like): path to the ancillary WRF geogrid file
+        
+    Returns:
+        tuple of Uearth (numpy.ndarray), Vearth (numpy.ndarray)
+    """
+    # levelled winds are broadcast against the 2D rotation fields
+    cosalpha, sinalpha = get_rotation_coefs(geogrid_fp)
+    Vearth = (Vgrid * cosalpha) + (Ugrid * sinalpha)
+    Uearth = (Ugrid * cosalpha) - (Vgrid * sinalpha)
+
+    return Uearth, Vearth
+
+
 def rotate_winds_to_earth_coords(fp, varname, geogrid_fp):
     """
     rotate the winds data from grid-centric to earth-centric
@@ -169,30 +767,12 @@ def rotate_winds_to_earth_coords(fp, varname, geogrid_fp):
             for information on rotating the wind components from a WRF
             run.
     """
-
-    if varname in ["U", "U10", "UBOT"]:
-        Uvar = varname
-        Vvar = varname.replace("U", "V")
-    else:
-        Uvar = varname.replace("V", "U")
-        Vvar = varname
+    Uvar, Vvar = get_wind_component_names(varname)
     # need to read both wind components to correctly rotate
-    with xr.open_dataset(fp) as ds:
-        Ugrid = ds[Uvar].values
-        Vgrid = ds[Vvar].values
-
-    with xr.open_dataset(geogrid_fp) as geo_ds:
-        cosalpha = geo_ds["COSALPHA"].copy(deep=True)
-        sinalpha = geo_ds["SINALPHA"].copy(deep=True)
-
-    if len(Ugrid.shape) == 3:  # deal with levels
-        cosalpha = np.broadcast_to(cosalpha, Ugrid.shape)
-        sinalpha = np.broadcast_to(sinalpha, Ugrid.shape)
-
-    Vearth = (Vgrid * cosalpha) + (Ugrid * sinalpha)
-    Uearth = (Ugrid * cosalpha) - (Vgrid * sinalpha)
+    arrs = raw_reader.read_vars(fp, [Uvar, Vvar])
+    Ugrid, Vgrid = arrs[Uvar], arrs[Vvar]
 
-    return Uearth, Vearth
+    return rotate_grid_winds(Ugrid, Vgrid, geogrid_fp)
 
 
 def run_rotate_winds(fp, varname, geogrid_fp):
@@ -209,27 +789,58 @@ def run_rotate_winds(fp, varname, geogrid_fp):
         
     Since both wind components are needed to restack a single wind component, 
     this is not the most efficient when processing all wind variables,
-    but it makes things a little less complicated.
+    but it makes things a little less complicated. Restack both components
+    together with restack_vars to only rotate them once.
     """
     ue, ve = rotate_winds_to_earth_coords(fp, varname, geogrid_fp)
 
+    return select_wind(varname, ue, ve)
+
+
+def select_wind(varname, ue, ve):
+    """Get the data for a wind variable from the rotated wind components,
+    deriving wind speed or direction if needed
+    
+    Args:
+        varname (str): name of the wind variable being worked on, a wind
+            component, or wind speed ("WSPD*") or direction ("WDIR*")
+        ue (numpy.ndarray): earth-relative U wind component
+        ve (numpy.ndarray): earth-relative V wind component
+        
+    Returns:
+        arr (numpy.ndarray): data for varname
+    """
+    ue, ve = np.squeeze(np.array(ue)), np.squeeze(np.array(ve))
     if varname in ["U", "U10", "UBOT"]:
         arr = ue
     elif varname in ["V", "V10", "VBOT"]:
         arr = ve
+    elif varname.startswith("WSPD"):
+        arr = np.sqrt(ue ** 2 + ve ** 2)
+    elif varname.startswith("WDIR"):
+        # meteorological convention, the direction the wind is blowing from
+        arr = np.degrees(np.arctan2(-ue, -ve)) % 360
 
-    return np.squeeze(np.array(arr))
+    return arr
+
+
+def rotate_to_cube(fp, varname, geogrid_fp, spec, idx):
+    """Rotate the winds from an hourly file into a shared memory cube"""
+    write_to_cube(spec, idx, run_rotate_winds(fp, varname, geogrid_fp))
+
+    return
 
 
-def restack_winds(fps, varname, geogrid_fp, ncpus):
-    """Run the stacking and rotation using multiple cores"""
-    args = [(fp, varname, geogrid_fp) for fp in fps]
-    with Pool(ncpus) as pool:
-        stacked_arr = np.array(pool.starmap(run_rotate_winds, args))
+def restack_winds(fps, varname, geogrid_fp, pool, cube):
+    """Run the stacking and rotation using the worker pool, writing into
+    the shared memory cube. Returns the cube's array."""
+    args = [(fp, varname, geogrid_fp, cube.spec, idx) for idx, fp in enumerate(fps)]
+    pool.starmap(rotate_to_cube, args)
 
-    return stacked_arr
+    return cube.arr
 
 
+@functools.lru_cache()
 def derive_xy(geogrid_fp, wrf_proj_str):
     """Derive the x and y coordinate axes for the WRF grid
     
@@ -240,6 +851,9 @@ def derive_xy(geogrid_fp, wrf_proj_str):
     
     Returns:
         tuple of x and y arrays containing x and y coordinate values 
+    
+    Results are cached so the geogrid is only read once when restacking
+    multiple variables or years.
     """
     wrf_proj = Proj(wrf_proj_str)
     wgs_proj = Proj(proj="latlong", datum="WGS84")
@@ -261,135 +875,183 @@ def derive_xy(geogrid_fp, wrf_proj_str):
     return x, y
 
 
-def path_import(module_fp):
-    """Import a module given its path. Intended for loading luts.py.
+def read_ftimes(ftimes_fp, years=None):
+    """Read the forecast times table, either the Parquet catalog partitioned by year
+    written by forecast_times.py or a .csv table from an older version of it
     
     Args:
-        module_fp (path_like): path to the module to import
+        ftimes_fp (path_like): path to the Parquet catalog (directory) or .csv file
+        years (list): years to read, along with the years on either side of them, which
+            are needed for the forecast_time groups of accumulation variables. All
+            years are read if not supplied. Only the partitions of these years are
+            read from the Parquet catalog.
     
     Returns:
-        a module object created from the module at path in module_fp
+        ftimes_df (pandas.DataFrame): table containing parsed filename and forecast
+            times, sorted by time, with a "time" column of timestamps and a
+            "forecast_group" column of forecast_time group ids. The index holds the
+            row labels of the whole table.
     """
-    module_name = module_fp.name.split(".")[0]
-    spec = importlib.util.spec_from_file_location(module_name, module_fp)
-    module = importlib.util.module_from_spec(spec)
-    sys.modules[module_name] = module
-    spec.loader.exec_module(module)
+    ftimes_fp = Path(ftimes_fp)
+    if years is not None:
+        read_years = sorted(
+            set(int(year) + offset for year in years for offset in (-1, 0, 1))
+        )
 
-    return module
+    if ftimes_fp.suffix == ".csv":
+        ftimes_df = pd.read_csv(ftimes_fp)
+        ftimes_df["time"] = pd.to_datetime(ftimes_df[["year", "month", "day", "hour"]])
+        # forecast_time groups start at forecast_time 6
+        ftimes_df["forecast_group"] = (ftimes_df["forecast_time"] == 6).cumsum()
+        if years is not None:
+            ftimes_df = ftimes_df[ftimes_df["year"].isin(read_years)]
+    else:
+        filters = None if years is None else [("year", "in", read_years)]
+        ftimes_df = pd.read_parquet(ftimes_fp, filters=filters)
+        # the partition column is read as a categorical
+        ftimes_df["year"] = ftimes_df["year"].astype(int)
 
+    # the index is kept as the row labels of the whole table, which
+    #  the forecast_time group index refers to
+    ftimes_df = ftimes_df.sort_values("time")
 
-if __name__ == "__main__":
-    # parse some args
-    parser = argparse.ArgumentParser(
-        description="stack the hourly raw WRF outputs to hourly NetCDF files by year."
-    )
-    parser.add_argument(
-        "-y", "--year", action="store", dest="year", type=int, help="year to process"
-    )
-    parser.add_argument(
-        "-v",
-        "--varname",
-        action="store",
-        dest="varname",
-        help="WRF variable name (exact, in file)",
-    )
-    parser.add_argument(
-        "-f",
-        "--ftimes_fp",
-        action="store",
-        dest="ftimes_fp",
-        help="path to the .csv file containing parsed filename and forecast times",
-    )
-    parser.add_argument(
-        "-o",
-        "--out_fp",
-        action="store",
-        dest="out_fp",
-        help="output file path for the new NetCDF hourly data for the input year",
-    )
-    parser.add_argument(
-        "-l",
-        "--luts_fp",
-        action="store",
-        dest="luts_fp",
-        help="Path to luts.py file for the restack_20km pipeline",
-    )
-    parser.add_argument(
-        "-n",
-        "--ncpus",
-        action="store",
-        dest="ncpus",
-        type=int,
-        help="Number of CPUs to use for multiprocessing",
-    )
-    parser.add_argument(
-        "-g",
-        "--geogrid_fp",
-        action="store",
-        dest="geogrid_fp",
-        default=None,
-        help="Path to ancillary WRF geogrid file.",
-    )
-    # parse the args and unpack
-    args = parser.parse_args()
-    year = args.year
-    varname = args.varname
-    ftimes_fp = args.ftimes_fp
-    out_fp = Path(args.out_fp)
-    luts_fp = Path(args.luts_fp)
-    ncpus = args.ncpus
-    geogrid_fp = args.geogrid_fp
+    return ftimes_df
 
-    # import the luts table supplied as a path
-    luts = path_import(luts_fp)
 
-    # read in pre-built dataframe with forecast_time as a field
-    ftimes_df = pd.read_csv(ftimes_fp)
+def read_group_index(ftimes_fp, ftimes_df):
+    """Read the forecast_time group index written with the Parquet catalog by
+    forecast_times.py, or make it from the forecast times table if there is none
+    
+    Args:
+        ftimes_fp (path_like): path to the Parquet catalog (directory) or .csv file
+        ftimes_df (pandas.DataFrame): table read from ftimes_fp with read_ftimes
+    
+    Returns:
+        groups_df (pandas.DataFrame): forecast_time group index, see make_group_index
+    """
+    groups_fp = Path(ftimes_fp).joinpath("_forecast_groups.parquet")
+    if groups_fp.exists():
+        return pd.read_parquet(groups_fp)
+
+    return make_group_index(ftimes_df)
 
-    # run the re-stacking of data through time, and handle winds or accumulation
-    #  variables as needed
-    tic = time.perf_counter()
-    # interpolate accumulation vars at `ind`
-    if varname in luts.accum_varnames:
-        arr = restack_accum(ftimes_df, year, varname, ncpus)
-    else:
-        fps = ftimes_df[ftimes_df["year"] == year]["filepath"]
-        if varname in luts.wind_varnames:
-            arr = restack_winds(fps, varname, geogrid_fp, ncpus)
-        else:
-            arr = restack(fps, varname, ncpus)
-    print(
-        f"Data restacked, time elapsed: {round((time.perf_counter() - tic) / 60, 1)}m"
-    )
 
-    # subset the data frame to the desired year -- for naming stuff
+def get_year_dates(ftimes_df, year):
+    """Get the subset of the forecast times table for a single year and
+    the timestamps for the time dimension of restacked data
+    
+    Args:
+        ftimes_df (pandas.DataFrame): table containing parsed filename
+            and forecast times
+        year (int): year being worked on
+    
+    Returns:
+        tuple of (ftimes_year_df, new_dates), the subset table and the
+            pandas.DatetimeIndex of timestamps
+    """
     ftimes_year_df = ftimes_df[
         (ftimes_df["year"] == year) & (ftimes_df["folder_year"] == year)
     ].reset_index()
 
-    # build the output NetCDF Dataset
     # pull time stamp values from table instead of pandas.date_range()
     # that would have to be corrected later
-    new_dates = pd.DatetimeIndex(
-        [
-            datetime(
-                *[row[colname] for colname in ["year", "month", "day", "hour"]]
-            )
-            for i, row in ftimes_year_df.iterrows()
-        ]
-    )
+    new_dates = pd.DatetimeIndex(ftimes_year_df["time"].values)
+
+    return ftimes_year_df, new_dates
+
 
+def get_group_dates(ftimes_df):
+    """Get the timestamps for the time dimension of restacked data spanning
+    all of the years in the forecast times table, i.e. a whole WRF group
+    
+    Args:
+        ftimes_df (pandas.DataFrame): table containing parsed filename
+            and forecast times
+    
+    Returns:
+        pandas.DatetimeIndex of timestamps, the same as those from get_year_dates
+            for every year in ftimes_df
+    """
+    group_df = ftimes_df[ftimes_df["year"] == ftimes_df["folder_year"]]
+
+    return pd.DatetimeIndex(group_df["time"].values)
+
+
+def get_profile_encoding(profile, dims, shape):
+    """Get the encoding for serializing a variable with an encoding profile
+    
+    Args:
+        profile (dict): encoding profile, one of the values of luts.encoding_profiles
+        dims (tuple): names of the variable's dimensions
+        shape (tuple): shape of the variable
+        
+    Returns:
+        encoding (dict): encoding for the variable, as used by xarray. The chunk
+            sizes are None if the profile leaves them to the netCDF library.
+    """
+    if profile["chunks"] is None:
+        chunksizes = None
+    else:
+        chunksizes = []
+        for dim, n in zip(dims, shape):
+            # any other dimension is the level dimension of a levelled variable
+            key = dim if dim in ["time", "yc", "xc"] else "level"
+            size = profile["chunks"].get(key)
+            chunksizes.append(n if size is None else min(size, n))
+        chunksizes = tuple(chunksizes)
+
+    encoding = {
+        "contiguous": False,
+        "chunksizes": chunksizes,
+        "shuffle": profile["shuffle"],
+        "dtype": "float32",
+    }
+    codec = profile["codec"]
+    if codec is None:
+        encoding["zlib"] = False
+    elif codec == "zlib":
+        encoding.update(zlib=True, complevel=profile["complevel"])
+    else:
+        # other codecs need netCDF4>=1.6, the environment has netCDF4 1.5.3
+        raise ValueError(f"Unsupported codec {codec!r}, use 'zlib' or None")
+
+    return encoding
+
+
+def make_restacked_ds(
+    arr, varname, ftimes_year_df, new_dates, luts, geogrid_fp, profile="default"
+):
+    """Build the output dataset for restacked data, with new coordinates
+    and metadata, and set the encoding for serialization
+    
+    Args:
+        arr (numpy.ndarray): restacked float32 data, already flipped along the y axis
+        varname (str): name of the WRF variable
+        ftimes_year_df (pandas.DataFrame): forecast times table for the year
+            being worked on
+        new_dates (pandas.DatetimeIndex): timestamps for the time dimension
+        luts (module): the luts.py module for the restack_20km pipeline
+        geogrid_fp (path_like): path to the ancillary WRF geogrid file
+        profile (str): name of the encoding profile in luts.encoding_profiles
+        
+    Returns:
+        ds (xarray.Dataset): restacked dataset ready to be written
+    """
     tmp_fp = ftimes_year_df["filepath"].iloc[0]
     with xr.open_dataset(tmp_fp) as tmp_ds:
+        src_varname = get_src_varname(varname, tmp_ds)
         global_attrs = tmp_ds.attrs
-        local_attrs = tmp_ds[varname].attrs
-        encoding = tmp_ds[varname].encoding
+        if src_varname == varname:
+            local_attrs = tmp_ds[varname].attrs
+        else:
+            # derived variables only get the attributes from the luts
+            local_attrs = dict(luts.var_attrs[varname])
+        encoding = tmp_ds[src_varname].encoding
         lon_arr = tmp_ds[luts.lon_variable].values
         lat_arr = tmp_ds[luts.lat_variable].values
         # get level name if present, should always be the first one
-        if len(tmp_ds[varname].dims) == 3:
-            levelname = tmp_ds[varname].dims[0]
+        if len(tmp_ds[src_varname].dims) == 3:
+            levelname = tmp_ds[src_varname].dims[0]
             levels = tmp_ds[levelname].values
         else:
             levelname = None
@@ -438,29 +1100,1200 @@ if __name__ == "__main__":
     local_attrs["grid_mapping"] = "spatial_ref"
     new_varname = varname.lower()
     data_dict = {
-        # add the data flipped along y axis to match flipped lat/lon arrays
-        #  and y-coordinate array
-        new_varname: (dims, np.flip(arr.astype(np.float32), axis=-2), local_attrs),
+        # data are flipped along y axis when restacked to match flipped
+        #  lat/lon arrays and y-coordinate array
+        new_varname: (dims, arr, local_attrs),
     }
     ds = xr.Dataset(data_dict, coords_dict, global_attrs)
 
     # set output compression and encoding for serialization
     encoding.update(
-        zlib=True, complevel=5, contiguous=False, chunksizes=None, dtype="float32"
+        get_profile_encoding(luts.encoding_profiles[profile], dims, arr.shape)
     )
     ds[new_varname].encoding = encoding
 
-    # write to disk
+    return ds
+
+
+def write_restacked_ds(ds, out_fp):
+    """Write a restacked dataset to disk
+    
+    Args:
+        ds (xarray.Dataset): restacked dataset from make_restacked_ds
+        out_fp (pathlib.Path): path to write the dataset to
+        
+    Returns:
+        None, writes the dataset to out_fp
+    """
     # remove an existing one since I think that is best practice
     #   here (<- original author, untested but leaving for now)
     if out_fp.exists():
         out_fp.unlink()
 
-    tic = time.perf_counter()
     ds.to_netcdf(out_fp, engine="netcdf4")
-    print(
-        (
-            f"Restacked data for {varname}, {year} written to {out_fp} at {time.ctime()}, "
-            f"time elapsed: {round((time.perf_counter() - tic) / 60, 1)}m"
+
+    return
+
+
+def get_stats_fp(out_fp, year=None):
+    """Get the path of the statistics sidecar of an output file, e.g.
+    t2_hourly_wrf_GFDL-CM3_rcp85_2050_stats.parquet next to the file, or of the
+    year of a Zarr store of a whole WRF group if year is supplied"""
+    if year is None:
+        return out_fp.with_name(f"{out_fp.stem}_stats.parquet")
+
+    return out_fp.with_name(f"{out_fp.stem}_{year}_stats.parquet")
+
+
+def hash_steps(arr, dtype="float32"):
+    """Get a hash of the data of each time step of an array, as stored in a file
+    of the given dtype. NaNs are hashed as the same value whatever their bits,
+    so the hashes of data written to a file and read back match.
+    
+    Args:
+        arr (numpy.ndarray): data, time dimension first
+        dtype (str): data type the array is stored as
+        
+    Returns:
+        list of hexadecimal hashes of each time step
+    """
+    flat = np.ascontiguousarray(
+        arr.reshape(arr.shape[0], -1), dtype=np.dtype(dtype).newbyteorder("<")
+    )
+    nans = np.isnan(flat)
+    if nans.any():
+        flat = np.where(nans, flat.dtype.type(np.nan), flat)
+
+    return [hashlib.blake2b(step.tobytes(), digest_size=16).hexdigest() for step in flat]
+
+
+class StepStats:
+    """Summary statistics (minimum, maximum, mean, number of valid and NaN values)
+    and a hash of the data of each time step of an output variable, accumulated from
+    the blocks of data as they are written, so that the data never have to be read
+    back for them. The hashes are used to compare files without decompressing the
+    time steps that are the same, see prod_comparison.py.
+    
+    Args:
+        dates (pandas.DatetimeIndex): timestamps of the time steps
+        dtype (str): data type the data are stored as, for the hashes
+        block_steps (int): number of time steps to get the statistics of at a time,
+            which bounds the size of the temporary arrays made for them
+    """
+
+    def __init__(self, dates, dtype="float32", block_steps=24):
+        self.dates = dates
+        self.dtype = dtype
+        self.block_steps = block_steps
+        n = len(dates)
+        self.min = np.full(n, np.nan)
+        self.max = np.full(n, np.nan)
+        self.mean = np.full(n, np.nan)
+        self.n_valid = np.zeros(n, dtype=np.int64)
+        self.n_nan = np.zeros(n, dtype=np.int64)
+        self.hash = np.full(n, None, dtype=object)
+        self.written = np.zeros(n, dtype=bool)
+
+    def update(self, start, arr):
+        """Get the statistics and hashes of a block of time steps
+        
+        Args:
+            start (int): index along the time dimension of the first time step in arr
+            arr (numpy.ndarray): data for the block, time dimension first
+        """
+        # the NaN handling makes temporary copies of the data, so
+        #  go through a whole year written at once a few steps at a time
+        for i in range(0, arr.shape[0], self.block_steps):
+            self.update_steps(start + i, arr[i : i + self.block_steps])
+
+        return
+
+    def update_steps(self, start, arr):
+        stop = start + arr.shape[0]
+        flat = arr.reshape(arr.shape[0], -1)
+        nans = np.isnan(flat)
+        with warnings.catch_warnings():
+            # all-NaN time steps give NaN statistics
+            warnings.simplefilter("ignore", RuntimeWarning)
+            self.min[start:stop] = np.nanmin(flat, axis=1)
+            self.max[start:stop] = np.nanmax(flat, axis=1)
+            self.mean[start:stop] = np.nanmean(flat, axis=1, dtype=np.float64)
+        self.n_nan[start:stop] = nans.sum(axis=1)
+        self.n_valid[start:stop] = flat.shape[1] - self.n_nan[start:stop]
+        self.hash[start:stop] = hash_steps(arr, self.dtype)
+        self.written[start:stop] = True
+
+        return
+
+    @property
+    def complete(self):
+        """True if every time step has been written"""
+        return bool(self.written.all())
+
+    def valid_range(self):
+        """Get the minimum and maximum over all time steps, or None if there are
+        no valid values"""
+        if self.n_valid.sum() == 0:
+            return None
+
+        return np.nanmin(self.min), np.nanmax(self.max)
+
+    def to_frame(self):
+        return pd.DataFrame(
+            {
+                "time": self.dates,
+                "min": self.min,
+                "max": self.max,
+                "mean": self.mean,
+                "n_valid": self.n_valid,
+                "n_nan": self.n_nan,
+                "hash": self.hash,
+            }
+        )
+
+    def write(self, stats_fp):
+        """Write the statistics of each time step to a Parquet sidecar"""
+        self.to_frame().to_parquet(stats_fp, index=False)
+
+        return
+
+
+def summarize_stats(stats_df):
+    """Get the statistics of a whole file from the statistics of its time steps
+    
+    Args:
+        stats_df (pandas.DataFrame): statistics of each time step, from
+            a sidecar written by StepStats.write
+        
+    Returns:
+        dict of the minimum, maximum, mean, number of valid and NaN values, and
+            the number of time steps and of time steps with no valid values
+    """
+    n_valid = stats_df["n_valid"].sum()
+    summary = {
+        "min": stats_df["min"].min(),
+        "max": stats_df["max"].max(),
+        "mean": (
+            (stats_df["mean"] * stats_df["n_valid"]).sum() / n_valid
+            if n_valid > 0
+            else np.nan
+        ),
+        "n_valid": int(n_valid),
+        "n_nan": int(stats_df["n_nan"].sum()),
+        "n_steps": len(stats_df),
+        "n_empty_steps": int((stats_df["n_valid"] == 0).sum()),
+    }
+
+    return summary
+
+
+class RestackedWriter:
+    """Writer for a restacked file that is created up front, with all of the
+    coordinates and metadata of the restacked dataset, and then has the data
+    written to it in blocks of time steps as they are restacked. Blocks that
+    are a multiple of the chunk length along the time dimension (chunk_steps)
+    are written (and compressed) one whole chunk at a time. The statistics of
+    each time step are collected as the blocks are written, and written to a
+    sidecar file (see get_stats_fp) and the valid_min / valid_max attributes
+    when the writer is closed after all time steps were written. Use as a context
+    manager or call close() when done.
+    
+    Args:
+        ds (xarray.Dataset): restacked dataset from make_restacked_ds. Only the shape
+            and encoding of the data variable are used, so it can be built on a
+            placeholder array, e.g. from np.broadcast_to
+        out_fp (pathlib.Path): path to write the dataset to
+    """
+
+    def __init__(self, ds, out_fp):
+        (self.varname,) = list(ds.data_vars)
+        da = ds[self.varname]
+        self.shape = da.shape
+        encoding = da.encoding
+
+        # remove an existing one, same as write_restacked_ds
+        if out_fp.exists():
+            out_fp.unlink()
+        # let xarray write the coordinates and metadata, then add the
+        #  data variable without writing any data yet
+        ds.drop_vars(self.varname).to_netcdf(out_fp, engine="netcdf4")
+        self.out_fp = out_fp
+        self.nc = netCDF4.Dataset(out_fp, "a")
+        # xarray puts the coordinates attribute on the file when there are
+        #  no data variables, it belongs to the data variable
+        attrs = dict(da.attrs)
+        if "coordinates" in self.nc.ncattrs():
+            attrs["coordinates"] = self.nc.getncattr("coordinates")
+            self.nc.delncattr("coordinates")
+
+        fill_value = encoding.get("_FillValue", np.nan)
+        if "missing_value" in encoding:
+            attrs["missing_value"] = encoding["missing_value"]
+        self.var = self.nc.createVariable(
+            self.varname,
+            encoding["dtype"],
+            da.dims,
+            zlib=encoding["zlib"],
+            complevel=encoding.get("complevel", 4),
+            shuffle=encoding["shuffle"],
+            chunksizes=encoding["chunksizes"],
+            fill_value=False if fill_value is None else fill_value,
+        )
+        self.var.setncatts(attrs)
+        # the chunk shape may have been chosen by the netCDF library
+        self.chunk_steps = self.var.chunking()[0]
+        self.stats = StepStats(ds.indexes["time"], encoding["dtype"])
+
+    def write(self, start, arr):
+        """Write a block of time steps to the data variable
+        
+        Args:
+            start (int): index along the time dimension of the first time step in arr
+            arr (numpy.ndarray): restacked data for the block, time dimension first
+        """
+        self.var[start : start + arr.shape[0]] = arr
+        self.stats.update(start, arr)
+
+        return
+
+    def close(self):
+        if self.nc.isopen():
+            # no statistics for files that were not completely written
+            if self.stats.complete:
+                valid_range = self.stats.valid_range()
+                if valid_range is not None:
+                    self.var.setncatts(
+                        {
+                            "valid_min": self.var.dtype.type(valid_range[0]),
+                            "valid_max": self.var.dtype.type(valid_range[1]),
+                        }
+                    )
+                self.stats.write(get_stats_fp(self.out_fp))
+            self.nc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def make_restacked_writer(
+    varname,
+    shape,
+    ftimes_year_df,
+    new_dates,
+    luts,
+    geogrid_fp,
+    out_fp,
+    profile="default",
+):
+    """Create the output file for a restacked variable, ready for writing
+    the data to in blocks of time steps
+    
+    Args:
+        varname (str): name of the WRF variable
+        shape (tuple): shape of a single time step of the variable
+        ftimes_year_df (pandas.DataFrame): forecast times table for the year
+            being worked on
+        new_dates (pandas.DatetimeIndex): timestamps for the time dimension
+        luts (module): the luts.py module for the restack_20km pipeline
+        geogrid_fp (path_like): path to the ancillary WRF geogrid file
+        out_fp (pathlib.Path): path to write the restacked data to, or the path
+            to the Zarr store of the whole WRF group, from make_restacked_zarr_store,
+            to write the year's data to if it has the ".zarr" suffix
+        profile (str): name of the encoding profile in luts.encoding_profiles.
+            Not used for Zarr stores, which are encoded when created.
+        
+    Returns:
+        RestackedWriter for the output file, or ZarrWriter for the Zarr store
+    """
+    if out_fp.suffix == ".zarr":
+        return ZarrWriter(out_fp, varname.lower(), new_dates)
+
+    # the dataset is only used for its metadata, no need to hold the data
+    placeholder = np.broadcast_to(np.float32(np.nan), (len(new_dates),) + shape)
+    ds = make_restacked_ds(
+        placeholder, varname, ftimes_year_df, new_dates, luts, geogrid_fp, profile
+    )
+    out_fp.parent.mkdir(exist_ok=True, parents=True)
+
+    return RestackedWriter(ds, out_fp)
+
+
+def get_zarr_codecs(encoding):
+    """Get the Zarr compressor and filters matching the netCDF encoding of a variable
+    
+    Args:
+        encoding (dict): encoding of the variable, see get_profile_encoding
+        
+    Returns:
+        tuple of (compressor, filters), numcodecs codec (or None) and list of
+            numcodecs filters (or None)
+    """
+    if encoding["zlib"]:
+        compressor = numcodecs.Zlib(level=encoding["complevel"])
+    else:
+        compressor = None
+    if encoding["shuffle"]:
+        filters = [numcodecs.Shuffle(elementsize=np.dtype(encoding["dtype"]).itemsize)]
+    else:
+        filters = None
+
+    return compressor, filters
+
+
+def make_zarr_store(store_fp, ds, max_time_chunk=8784):
+    """Create a consolidated Zarr store for a variable spanning a whole WRF group,
+    with all of the coordinates and metadata but no data. The data are then
+    written one year at a time (by any number of processes) with ZarrWriter.
+    
+    Args:
+        store_fp (pathlib.Path): path to the Zarr store to create
+        ds (xarray.Dataset): dataset with the time dimension of the whole WRF group,
+            from make_restacked_ds. Only the shape and encoding of the data
+            variable are used, so it can be built on a placeholder array.
+        max_time_chunk (int): maximum number of time steps in each chunk of the
+            data variable. Profiles with no chunking along the time dimension
+            get chunks of a (leap) year of hourly time steps.
+        
+    Returns:
+        None, creates the store at store_fp
+    """
+    (varname,) = list(ds.data_vars)
+    da = ds[varname]
+    encoding = da.encoding
+
+    store_fp.parent.mkdir(exist_ok=True, parents=True)
+    # let xarray write the coordinates and metadata, then add the
+    #  data variable without writing any data, same as RestackedWriter
+    ds.drop_vars(varname).to_zarr(store_fp, mode="w", consolidated=False)
+    group = zarr.open_group(str(store_fp), mode="a")
+    # attributes read from the raw files are numpy types, which are not JSON
+    attrs = {
+        key: value.tolist() if isinstance(value, (np.generic, np.ndarray)) else value
+        for key, value in da.attrs.items()
+    }
+    if "coordinates" in group.attrs:
+        attrs["coordinates"] = group.attrs["coordinates"]
+        del group.attrs["coordinates"]
+    # xarray's record of the dimension names
+    attrs["_ARRAY_DIMENSIONS"] = list(da.dims)
+
+    compressor, filters = get_zarr_codecs(encoding)
+    chunksizes = encoding["chunksizes"]
+    if chunksizes is None:
+        # zarr has no library default to match, use a day of time steps and
+        #  whole maps per chunk
+        chunksizes = (24,) + (1,) * (len(da.shape) - 3) + da.shape[-2:]
+    chunks = (min(chunksizes[0], max_time_chunk),) + tuple(chunksizes[1:])
+    arr = group.create_dataset(
+        varname,
+        shape=da.shape,
+        chunks=chunks,
+        dtype=encoding["dtype"],
+        compressor=compressor,
+        filters=filters,
+        fill_value=np.nan,
+    )
+    arr.attrs.update(attrs)
+    # the metadata do not change when data are written, so
+    #  consolidating once here is enough
+    zarr.consolidate_metadata(str(store_fp))
+
+    return
+
+
+def make_restacked_zarr_store(
+    ftimes_df, varname, shape, luts, geogrid_fp, store_fp, profile="default"
+):
+    """Create the Zarr store for a restacked variable for all years of the
+    forecast times table, see make_zarr_store
+    
+    Args:
+        ftimes_df (pandas.DataFrame): table containing parsed filename
+            and forecast times
+        varname (str): name of the WRF variable
+        shape (tuple): shape of a single time step of the variable
+        luts (module): the luts.py module for the restack_20km pipeline
+        geogrid_fp (path_like): path to the ancillary WRF geogrid file
+        store_fp (pathlib.Path): path to the Zarr store to create
+        profile (str): name of the encoding profile in luts.encoding_profiles
+        
+    Returns:
+        None, creates the store at store_fp
+    """
+    group_dates = get_group_dates(ftimes_df)
+    # attributes are taken from the first file, same as for a year
+    ftimes_year_df, _ = get_year_dates(ftimes_df, group_dates[0].year)
+    placeholder = np.broadcast_to(np.float32(np.nan), (len(group_dates),) + shape)
+    ds = make_restacked_ds(
+        placeholder, varname, ftimes_year_df, group_dates, luts, geogrid_fp, profile
+    )
+    make_zarr_store(store_fp, ds)
+
+    return
+
+
+class ZarrWriter:
+    """Writer for the data of a single year in a Zarr store of a whole WRF group
+    created with make_zarr_store, with the same interface as RestackedWriter.
+    The year's time steps are a region of the store's time dimension, and
+    chunks that are shared with adjacent years are locked while they are
+    written, so that years can be written by separate processes at once.
+    The statistics of each time step are written to a sidecar file for the
+    year (see get_stats_fp), but not to the valid_min / valid_max attributes,
+    which are shared by all years of the store.
+    
+    Args:
+        store_fp (pathlib.Path): path to the Zarr store
+        varname (str): name of the data variable in the store
+        new_dates (pandas.DatetimeIndex): timestamps of the year's time steps
+    """
+
+    def __init__(self, store_fp, varname, new_dates):
+        with xr.open_zarr(store_fp) as ds:
+            store_dates = ds["time"].values
+        self.start = int(np.searchsorted(store_dates, new_dates.values[0]))
+        if not np.array_equal(
+            store_dates[self.start : self.start + len(new_dates)], new_dates.values
+        ):
+            raise ValueError(
+                f"Timestamps for {new_dates[0].year} are not a region of {store_fp}"
+            )
+
+        self.varname = varname
+        self.out_fp = store_fp
+        synchronizer = zarr.ProcessSynchronizer(f"{store_fp}.sync")
+        self.arr = zarr.open_array(
+            str(store_fp), mode="r+", path=varname, synchronizer=synchronizer
+        )
+        self.shape = (len(new_dates),) + self.arr.shape[1:]
+        self.chunk_steps = self.arr.chunks[0]
+        self.stats = StepStats(new_dates, self.arr.dtype)
+        self.closed = False
+
+    def write(self, start, arr):
+        """Write a block of time steps of the year, see RestackedWriter.write"""
+        self.arr[self.start + start : self.start + start + arr.shape[0]] = arr
+        self.stats.update(start, arr)
+
+        return
+
+    def close(self):
+        if not self.closed and self.stats.complete:
+            self.stats.write(get_stats_fp(self.out_fp, self.stats.dates[0].year))
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def restack_blocks(
+    fps, varnames, wind_varnames, geogrid_fp, pool, writers, block_steps
+):
+    """Restack variables for a single year in blocks of time steps, writing each
+    block to the output files while the workers read the next one, so that only
+    two blocks of each variable are ever held in memory.
+    
+    Args:
+        fps (list): list of filepaths to extract data from and stack
+        varnames (list): names of variables to extract from hourly WRF files,
+            not including accumulation variables
+        wind_varnames (list): names of all wind component variables
+        geogrid_fp (path_like): path to the ancillary WRF geogrid file
+        pool (multiprocessing.Pool): worker pool to read the files with
+        writers (dict): RestackedWriter for each variable, keyed by variable name
+        block_steps (int): number of time steps to restack in each block. Rounded
+            to a multiple of the writers' chunk length.
+        
+    Returns:
+        None, writes the restacked data with the writers
+    """
+    chunk_steps = max(writers[varname].chunk_steps for varname in varnames)
+    block_steps = max(1, block_steps // chunk_steps) * chunk_steps
+    # alternate between two sets of cubes, one for the block being read
+    #  and one for the block being written
+    buffers = [{}, {}]
+    winds = [varname for varname in varnames if varname in wind_varnames]
+
+    def read_block(start, cubes):
+        args = [
+            (
+                fp,
+                {varname: (cubes[varname].spec, idx) for varname in varnames},
+                winds,
+                geogrid_fp,
+            )
+            for idx, fp in enumerate(fps[start : start + block_steps])
+        ]
+        return pool.starmap_async(read_vars_to_cubes, args)
+
+    try:
+        for cubes in buffers:
+            for varname in varnames:
+                cubes[varname] = SharedCube((block_steps,) + writers[varname].shape[1:])
+        starts = range(0, len(fps), block_steps)
+        result = read_block(0, buffers[0])
+        for i, start in enumerate(starts):
+            result.get()
+            cubes = buffers[i % 2]
+            if start + block_steps < len(fps):
+                result = read_block(start + block_steps, buffers[(i + 1) % 2])
+            n = min(block_steps, len(fps) - start)
+            for varname in varnames:
+                writers[varname].write(start, cubes[varname].arr[:n])
+    finally:
+        for cubes in buffers:
+            for cube in cubes.values():
+                cube.release()
+
+    return
+
+
+def get_daily_outputs(varnames, luts, daily_dir, fn_str, year=None):
+    """Get the daily aggregates in luts.resample_varnames that are resampled from
+    the variables being restacked, and the paths to write them to
+
+    Args:
+        varnames (list): names of the WRF variables being restacked
+        luts (module): the luts.py module for the restack_20km pipeline
+        daily_dir (pathlib.Path): directory to write the daily data to, in
+            subfolders named by the aggregate variable
+        fn_str (str): string name of model / scenario for use in output filenames
+        year (int): year of the output files. If not supplied, the paths are to
+            the Zarr stores of the daily data for the whole WRF group.
+
+    Returns:
+        daily_outputs (dict): lists of (aggregation, aggregate variable name, output path)
+            tuples keyed by the WRF variable name, for the variables that have any
+    """
+    daily_outputs = {}
+    for varname in varnames:
+        for out_varname, resample_info in luts.resample_varnames.items():
+            if resample_info["wrf_varname"] != varname.lower():
+                continue
+            out_varname = out_varname.lower()
+            if year is None:
+                out_fn = f"{out_varname}_daily_wrf_{fn_str}.zarr"
+            else:
+                out_fn = f"{out_varname}_daily_wrf_{fn_str}_{year}.nc"
+            daily_outputs.setdefault(varname, []).append(
+                (
+                    resample_info["aggr"],
+                    out_varname,
+                    daily_dir.joinpath(out_varname, out_fn),
+                )
+            )
+
+    return daily_outputs
+
+
+def write_daily_aggregates(
+    arr, varname, daily_outputs, ftimes_year_df, new_dates, luts, geogrid_fp, profile
+):
+    """Resample a restacked year held in memory to the daily aggregates and write them,
+    instead of reading the restacked file back in with resample.py
+
+    Args:
+        arr (numpy.ndarray): restacked data for the year
+        varname (str): name of the WRF variable
+        daily_outputs (list): (aggregation, aggregate variable name, output path) tuples,
+            see get_daily_outputs
+        ftimes_year_df (pandas.DataFrame): forecast times table for the year
+            being worked on
+        new_dates (pandas.DatetimeIndex): timestamps for the time dimension
+        luts (module): the luts.py module for the restack_20km pipeline
+        geogrid_fp (path_like): path to the ancillary WRF geogrid file
+        profile (str): name of the encoding profile in luts.encoding_profiles
+
+    Returns:
+        None, writes the daily data to the output paths in daily_outputs
+    """
+    # imported here since resample imports from this module
+    from resample import make_daily_ds, write_daily_ds
+
+    ds = make_restacked_ds(
+        arr, varname, ftimes_year_df, new_dates, luts, geogrid_fp, profile
+    )
+    for aggr, out_varname, out_fp in daily_outputs:
+        ds_day = make_daily_ds(ds, aggr, varname.lower(), out_varname)
+        out_fp.parent.mkdir(exist_ok=True, parents=True)
+        write_daily_ds(ds_day, out_varname, out_fp, profile)
+        print(
+            f"Daily {aggr} of {varname}, {new_dates[0].year} written to {out_fp} at {time.ctime()}"
+        )
+
+    return
+
+
+def restack_year(
+    ftimes_df,
+    year,
+    varnames,
+    out_fps,
+    luts,
+    geogrid_fp,
+    pool,
+    stacked_cache=None,
+    block_steps=None,
+    profile="default",
+    groups_df=None,
+    daily_outputs=None,
+):
+    """Restack variables for a single year and write them to disk
+    
+    Args:
+        ftimes_df (pandas.DataFrame): table containing parsed filename
+            and forecast times
+        year (int): year being worked on
+        varnames (list): names of variables to extract from hourly WRF files
+        out_fps (dict): output file paths keyed by variable name. Paths with the
+            ".zarr" suffix are Zarr stores of the whole WRF group to write
+            the year to, see make_restacked_writer
+        luts (module): the luts.py module for the restack_20km pipeline
+        geogrid_fp (path_like): path to the ancillary WRF geogrid file
+        pool (multiprocessing.Pool): worker pool to read the files with
+        stacked_cache (StackedCache): cache of restacked slices of accumulation
+            variables, see restack_accum
+        block_steps (int): if supplied, variables other than accumulation variables
+            are restacked and written in blocks of this many time steps instead
+            of holding the whole year in memory, see restack_blocks
+        profile (str): name of the encoding profile in luts.encoding_profiles
+        groups_df (pandas.DataFrame): forecast_time group index, see get_accum_groups
+        daily_outputs (dict): daily aggregates to resample the restacked data to before
+            it is released from memory, see get_daily_outputs. Variables with daily
+            aggregates are restacked a whole year at a time.
+
+    Returns:
+        None, writes the restacked data to the paths in out_fps
+    """
+    fps = ftimes_df[ftimes_df["year"] == year]["filepath"]
+    shapes = get_var_shapes(fps.iloc[0], varnames)
+    # subset the data frame to the desired year -- for naming stuff
+    ftimes_year_df, new_dates = get_year_dates(ftimes_df, year)
+
+    # create the output files up front so the data can be written as
+    #  soon as it has been restacked
+    writers = {
+        varname: make_restacked_writer(
+            varname,
+            shapes[varname],
+            ftimes_year_df,
+            new_dates,
+            luts,
+            geogrid_fp,
+            out_fps[varname],
+            profile,
+        )
+        for varname in varnames
+    }
+    wind_varnames = luts.wind_varnames + luts.wind_derived_varnames
+    if daily_outputs is None:
+        daily_outputs = {}
+    if block_steps is None:
+        year_varnames = list(varnames)
+    else:
+        # accumulation variables are diffed and interpolated across the
+        #  forecast_time groups, so they need the whole year at once, and
+        #  so do the daily aggregates
+        year_varnames = [
+            varname
+            for varname in varnames
+            if varname in luts.accum_varnames or varname in daily_outputs
+        ]
+    block_varnames = [varname for varname in varnames if varname not in year_varnames]
+
+    try:
+        if len(block_varnames) > 0:
+            tic = time.perf_counter()
+            restack_blocks(
+                list(fps),
+                block_varnames,
+                wind_varnames,
+                geogrid_fp,
+                pool,
+                writers,
+                block_steps,
+            )
+            for varname in block_varnames:
+                writers.pop(varname).close()
+                print(
+                    (
+                        f"Restacked data for {varname}, {year} written to {out_fps[varname]} "
+                        f"at {time.ctime()}, time elapsed: "
+                        f"{round((time.perf_counter() - tic) / 60, 1)}m"
+                    )
+                )
+
+        if len(year_varnames) > 0:
+            restack_year_cubes(
+                ftimes_df,
+                year,
+                year_varnames,
+                fps,
+                shapes,
+                luts,
+                geogrid_fp,
+                pool,
+                writers,
+                stacked_cache,
+                groups_df,
+                daily_outputs,
+                profile,
+            )
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return
+
+
+def restack_year_cubes(
+    ftimes_df,
+    year,
+    varnames,
+    fps,
+    shapes,
+    luts,
+    geogrid_fp,
+    pool,
+    writers,
+    stacked_cache=None,
+    groups_df=None,
+    daily_outputs=None,
+    profile="default",
+):
+    """Restack variables for a whole year at once in shared memory cubes,
+    and write them with the supplied writers
+    
+    Args:
+        ftimes_df (pandas.DataFrame): table containing parsed filename
+            and forecast times
+        year (int): year being worked on
+        varnames (list): names of variables to extract from hourly WRF files
+        fps (pandas.Series): filepaths of the year's hourly files
+        shapes (dict): shape of a single time step of each variable
+        luts (module): the luts.py module for the restack_20km pipeline
+        geogrid_fp (path_like): path to the ancillary WRF geogrid file
+        pool (multiprocessing.Pool): worker pool to read the files with
+        writers (dict): RestackedWriter for each variable, keyed by variable name.
+            Writers are closed once their variable has been written.
+        stacked_cache (StackedCache): cache of restacked slices of accumulation
+            variables, see restack_accum
+        groups_df (pandas.DataFrame): forecast_time group index, see get_accum_groups
+        daily_outputs (dict): daily aggregates to resample the restacked data to,
+            see get_daily_outputs
+        profile (str): name of the encoding profile in luts.encoding_profiles,
+            for writing the daily aggregates
+        
+    Returns:
+        None, writes the restacked data with the writers
+    """
+    # preallocate shared memory cubes for the year's data that the
+    #  workers will write the restacked time slices to directly
+    cubes = {}
+    try:
+        for varname in varnames:
+            cubes[varname] = SharedCube((len(fps),) + shapes[varname])
+
+        # run the re-stacking of data through time, and handle winds or accumulation
+        #  variables as needed
+        tic = time.perf_counter()
+        if len(varnames) > 1:
+            arrs = restack_vars(
+                ftimes_df,
+                year,
+                varnames,
+                luts.accum_varnames,
+                luts.wind_varnames + luts.wind_derived_varnames,
+                geogrid_fp,
+                pool,
+                cubes,
+                stacked_cache,
+                groups_df,
+            )
+        else:
+            varname = varnames[0]
+            # interpolate accumulation vars at `ind`
+            if varname in luts.accum_varnames:
+                arr = restack_accum(
+                    ftimes_df,
+                    year,
+                    varname,
+                    pool,
+                    cubes[varname],
+                    stacked_cache,
+                    groups_df,
+                )
+            elif varname in luts.wind_varnames + luts.wind_derived_varnames:
+                arr = restack_winds(fps, varname, geogrid_fp, pool, cubes[varname])
+            else:
+                arr = restack(fps, varname, pool, cubes[varname])
+            arrs = {varname: arr}
+            del arr
+        print(
+            f"{year} data restacked, time elapsed: {round((time.perf_counter() - tic) / 60, 1)}m"
+        )
+
+        for varname in varnames:
+            # write to disk
+            tic = time.perf_counter()
+            arr = arrs.pop(varname)
+            with writers.pop(varname) as writer:
+                writer.write(0, arr)
+            print(
+                (
+                    f"Restacked data for {varname}, {year} written to {writer.out_fp} "
+                    f"at {time.ctime()}, "
+                    f"time elapsed: {round((time.perf_counter() - tic) / 60, 1)}m"
+                )
+            )
+            if daily_outputs is not None and varname in daily_outputs:
+                # resample while the year is still in memory
+                ftimes_year_df, new_dates = get_year_dates(ftimes_df, year)
+                write_daily_aggregates(
+                    arr,
+                    varname,
+                    daily_outputs[varname],
+                    ftimes_year_df,
+                    new_dates,
+                    luts,
+                    geogrid_fp,
+                    profile,
+                )
+            del arr
+            cubes[varname].release()
+    finally:
+        for cube in cubes.values():
+            cube.release()
+
+    return
+
+
+def parse_year_str(year_str):
+    """Get the list of years to work on from a string in '<start year>-<end year>'
+    format, a '_'-separated list of individual years, or a single year
+    
+    Args:
+        year_str (str): string of years
+        
+    Returns:
+        years (list): list of years (ints)
+    """
+    if "_" in year_str:
+        years = [int(year) for year in year_str.split("_")]
+    elif "-" in year_str:
+        start_year, end_year = year_str.split("-")
+        years = list(range(int(start_year), int(end_year) + 1))
+    else:
+        years = [int(year_str)]
+
+    return years
+
+
+def path_import(module_fp):
+    """Import a module given its path. Intended for loading luts.py.
+    
+    Args:
+        module_fp (path_like): path to the module to import
+        
+    Returns:
+        a module object created from the module at path in module_fp
+    """
+    module_name = module_fp.name.split(".")[0]
+    spec = importlib.util.spec_from_file_location(module_name, module_fp)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+
+    return module
+
+
+if __name__ == "__main__":
+    # parse some args
+    parser = argparse.ArgumentParser(
+        description="stack the hourly raw WRF outputs to hourly NetCDF files by year."
+    )
+    parser.add_argument(
+        "-y",
+        "--year",
+        action="store",
+        dest="year_str",
+        help=(
+            "year to process, or years in '<start year>-<end year>' format or as a "
+            "'_'-separated list. Multiple years are processed in a single process."
+        ),
+    )
+    parser.add_argument(
+        "-v",
+        "--varname",
+        action="store",
+        dest="varnames",
+        nargs="+",
+        help=(
+            "WRF variable name (exact, in file). Supply multiple names to "
+            "restack them all from a single read of each hourly file. Wind "
+            "speed and direction can be derived from the wind components with the "
+            "names in luts.wind_derived_varnames, e.g. WSPD10 and WDIR10."
+        ),
+    )
+    parser.add_argument(
+        "-f",
+        "--ftimes_fp",
+        action="store",
+        dest="ftimes_fp",
+        help=(
+            "path to the forecast times catalog (.parquet) written by forecast_times.py, "
+            "or an older .csv table, containing parsed filename and forecast times"
+        ),
+    )
+    parser.add_argument(
+        "-o",
+        "--out_fp",
+        action="store",
+        dest="out_fp",
+        default=None,
+        help=(
+            "output file path for the new NetCDF hourly data for the input year. "
+            "Only valid for a single variable, use -d and -fs otherwise."
+        ),
+    )
+    parser.add_argument(
+        "-d",
+        "--restack_dir",
+        action="store",
+        dest="restack_dir",
+        default=None,
+        help="directory to write restacked data to, in subfolders named by variable",
+    )
+    parser.add_argument(
+        "-fs",
+        "--fn_str",
+        action="store",
+        dest="fn_str",
+        default=None,
+        help="string name of model / scenario for use in output filenames",
+    )
+    parser.add_argument(
+        "-l",
+        "--luts_fp",
+        action="store",
+        dest="luts_fp",
+        help="Path to luts.py file for the restack_20km pipeline",
+    )
+    parser.add_argument(
+        "-n",
+        "--ncpus",
+        action="store",
+        dest="ncpus",
+        type=int,
+        help="Number of CPUs to use for multiprocessing",
+    )
+    parser.add_argument(
+        "-g",
+        "--geogrid_fp",
+        action="store",
+        dest="geogrid_fp",
+        default=None,
+        help="Path to ancillary WRF geogrid file.",
+    )
+    parser.add_argument(
+        "-c",
+        "--cache_dir",
+        action="store",
+        dest="cache_dir",
+        default=None,
+        help=(
+            "Directory for caching the restacked boundary forecast_time groups of "
+            "accumulation variables, for reuse by jobs restacking adjacent years. "
+            "Jobs only remove the slices they saved, so remove the directory once "
+            "the WRF group has been restacked"
+        ),
+    )
+    parser.add_argument(
+        "-b",
+        "--block_steps",
+        action="store",
+        dest="block_steps",
+        type=int,
+        default=None,
+        help=(
+            "Number of time steps to restack and write at a time, to limit memory use "
+            "to two blocks of each variable instead of a whole year. Accumulation "
+            "variables are always restacked a whole year at a time."
+        ),
+    )
+    parser.add_argument(
+        "-p",
+        "--profile",
+        action="store",
+        dest="profile",
+        default="default",
+        help="Name of the encoding profile in luts.encoding_profiles to write with",
+    )
+    parser.add_argument(
+        "-z",
+        "--zarr",
+        action="store_true",
+        dest="zarr",
+        default=False,
+        help=(
+            "Write each variable to a single Zarr store for the whole WRF group "
+            "instead of yearly NetCDF files. Stores that do not exist yet are created "
+            "for every year in the forecast times table."
+        ),
+    )
+    parser.add_argument(
+        "--init_zarr",
+        action="store_true",
+        dest="init_zarr",
+        default=False,
+        help=(
+            "Only create the Zarr stores, (re)creating any that exist. Run once before "
+            "submitting jobs that write years of the same variables at once with -z."
+        ),
+    )
+    parser.add_argument(
+        "-dd",
+        "--daily_dir",
+        action="store",
+        dest="daily_dir",
+        default=None,
+        help=(
+            "Directory to write the daily aggregates in luts.resample_varnames of the "
+            "variables being restacked to, in subfolders named by aggregate variable. "
+            "They are resampled from the restacked data in memory, so resample.py "
+            "does not need to be run for them."
+        ),
+    )
+    # parse the args and unpack
+    args = parser.parse_args()
+    years = parse_year_str(args.year_str)
+    varnames = args.varnames
+    ftimes_fp = args.ftimes_fp
+    luts_fp = Path(args.luts_fp)
+    ncpus = args.ncpus
+    geogrid_fp = args.geogrid_fp
+
+    if args.daily_dir is not None and args.fn_str is None:
+        parser.error("-dd/--daily_dir requires -fs/--fn_str for naming the daily files")
+    if args.out_fp is not None:
+        if len(varnames) > 1 or len(years) > 1:
+            parser.error(
+                "-o/--out_fp can only be used with a single variable and year"
+            )
+        out_fps = {years[0]: {varnames[0]: Path(args.out_fp)}}
+    elif args.zarr or args.init_zarr:
+        restack_dir = Path(args.restack_dir)
+        store_fps = {
+            varname: restack_dir.joinpath(
+                varname.lower(), f"{varname.lower()}_hourly_wrf_{args.fn_str}.zarr"
+            )
+            for varname in varnames
+        }
+        out_fps = {year: store_fps for year in years}
+    else:
+        restack_dir = Path(args.restack_dir)
+        out_fps = {
+            year: {
+                varname: restack_dir.joinpath(
+                    varname.lower(),
+                    f"{varname.lower()}_hourly_wrf_{args.fn_str}_{year}.nc",
+                )
+                for varname in varnames
+            }
+            for year in years
+        }
+
+    # import the luts table supplied as a path
+    luts = path_import(luts_fp)
+    if args.profile not in luts.encoding_profiles:
+        parser.error(
+            f"-p/--profile must be one of {', '.join(luts.encoding_profiles)}"
         )
+
+    # read in pre-built dataframe with forecast_time as a field, only for the
+    #  years being worked on unless Zarr stores for all years may be created
+    if args.zarr or args.init_zarr:
+        ftimes_df = read_ftimes(ftimes_fp)
+    else:
+        ftimes_df = read_ftimes(ftimes_fp, years)
+    # check the forecast_time groups of accumulation variables up front
+    if any(varname in luts.accum_varnames for varname in varnames):
+        groups_df = read_group_index(ftimes_fp, ftimes_df)
+        check_group_index(groups_df, years)
+    else:
+        groups_df = None
+
+    if args.zarr or args.init_zarr:
+        shapes = get_var_shapes(ftimes_df["filepath"].iloc[0], varnames)
+        for varname, store_fp in store_fps.items():
+            if args.init_zarr or not store_fp.exists():
+                make_restacked_zarr_store(
+                    ftimes_df,
+                    varname,
+                    shapes[varname],
+                    luts,
+                    geogrid_fp,
+                    store_fp,
+                    args.profile,
+                )
+                print(f"Zarr store for {varname} created at {store_fp}")
+    if args.daily_dir is not None:
+        daily_dir = Path(args.daily_dir)
+        if args.zarr or args.init_zarr:
+            daily_outputs = get_daily_outputs(varnames, luts, daily_dir, args.fn_str)
+            daily_outputs = {year: daily_outputs for year in years}
+            # imported here since resample imports from this module
+            from resample import make_daily_zarr_store
+
+            for varname in daily_outputs[years[0]]:
+                for aggr, out_varname, out_fp in daily_outputs[years[0]][varname]:
+                    if args.init_zarr or not out_fp.exists():
+                        make_daily_zarr_store(
+                            store_fps[varname],
+                            aggr,
+                            varname.lower(),
+                            out_varname,
+                            out_fp,
+                            args.profile,
+                        )
+                        print(f"Zarr store for {out_varname} created at {out_fp}")
+        else:
+            daily_outputs = {
+                year: get_daily_outputs(varnames, luts, daily_dir, args.fn_str, year)
+                for year in years
+            }
+    else:
+        daily_outputs = {year: None for year in years}
+    if args.init_zarr:
+        sys.exit(0)
+
+    # use a single pool and keep the restacked boundary forecast_time groups of
+    #  accumulation variables between years, for the whole job
+    stacked_cache = StackedCache(args.cache_dir)
+    tic = time.perf_counter()
+    with make_pool(ncpus, geogrid_fp) as pool:
+        for year in years:
+            restack_year(
+                ftimes_df,
+                year,
+                varnames,
+                out_fps[year],
+                luts,
+                geogrid_fp,
+                pool,
+                stacked_cache,
+                args.block_steps,
+                args.profile,
+                groups_df,
+                daily_outputs[year],
+            )
+    print(
+        f"Restacking for {args.year_str} done, time elapsed: "
+        f"{round((time.perf_counter() - tic) / 60, 1)}m"
     )
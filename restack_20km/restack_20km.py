@@ -16,7 +16,9 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 import luts
+import raw_reader
 from config import *
+from inventory import query_inventory
 
 
 def make_variable_lookup(raw_fp):
@@ -66,16 +68,21 @@ def validate_group(wrf_dir, group):
         return True
 
 
-def get_wrf_fps(wrf_dir, years):
+def get_wrf_fps(wrf_dir, years, inventory_fp=None):
     """Get all of the hourly WRF output filepaths for given wrf directory and years
     
     Args:
         wrf_dir (pathlib.PosixPath): path to the directory containing hourly WRF files
         years (list): list of years to get filepaths for
+        inventory_fp (path_like): path to the inventory of raw files (see inventory.py)
+            to get the filepaths from, instead of listing the directories
     
     Returns:
         wrf_fps (list): list of WRF filepaths
     """
+    if inventory_fp is not None:
+        return list(query_inventory(inventory_fp, wrf_dir, years)["path"])
+
     wrf_fps = []
     for year in years:
         wrf_fps.extend(wrf_dir.joinpath(str(year)).glob("*.nc"))
@@ -192,18 +199,43 @@ def check_raw_scratch_file(wrf_fp, group, raw_scratch_dir):
             return None
 
 
-def check_raw_scratch(wrf_dir, group, years, raw_scratch_dir, ncpus=24):
-    """Check to see the number of requested and missing WRF files in the raw scratch directory
+def get_inventory_scratch_fps(wrf_dir, group, years, raw_scratch_dir, inventory_fp):
+    """Get the source WRF filepaths and the filepaths of their copies in the raw scratch
+    directory from the inventory, the same as check_raw_scratch_file does for each file.
+    Both wrf_dir and the group's raw scratch directory must have been inventoried.
+    
+    Returns:
+        tuple of (all_wrf_fps, existing_scratch_fps), lists of the source filepaths and the
+            scratch filepaths of the same size
     """
-    # see if we can pool this?
-    existing_scratch_fps = []
-    all_wrf_fps = []
-    for year in years:
-        wrf_fps = get_wrf_fps(wrf_dir, [year])
-        all_wrf_fps.extend(wrf_fps)
-        args = [(fp, group, raw_scratch_dir) for fp in wrf_fps]
-        with Pool(ncpus) as pool:
-            existing_scratch_fps.extend(pool.starmap(check_raw_scratch_file, args))
+    src_df = query_inventory(inventory_fp, wrf_dir, years)
+    scratch_df = query_inventory(inventory_fp, raw_scratch_dir.joinpath(group), years)
+    merged_df = src_df.merge(
+        scratch_df, on=["folder_year", "name", "size"], suffixes=("", "_scratch")
+    )
+
+    return list(src_df["path"]), list(merged_df["path_scratch"])
+
+
+def check_raw_scratch(wrf_dir, group, years, raw_scratch_dir, ncpus=24, inventory_fp=None):
+    """Check to see the number of requested and missing WRF files in the raw scratch directory.
+    If inventory_fp is supplied, the files are looked up in the inventory of raw files
+    (see inventory.py) instead of being listed and compared on the filesystem.
+    """
+    if inventory_fp is not None:
+        all_wrf_fps, existing_scratch_fps = get_inventory_scratch_fps(
+            wrf_dir, group, years, raw_scratch_dir, inventory_fp
+        )
+    else:
+        # see if we can pool this?
+        existing_scratch_fps = []
+        all_wrf_fps = []
+        for year in years:
+            wrf_fps = get_wrf_fps(wrf_dir, [year])
+            all_wrf_fps.extend(wrf_fps)
+            args = [(fp, group, raw_scratch_dir) for fp in wrf_fps]
+            with Pool(ncpus) as pool:
+                existing_scratch_fps.extend(pool.starmap(check_raw_scratch_file, args))
     # discard Nones
     existing_scratch_fps = [fp for fp in existing_scratch_fps if fp is not None]
 
@@ -316,22 +348,30 @@ def get_file_size(fp):
     return fp.stat().st_size
 
 
-def check_scratch_file_sizes(year_scratch_dir, ncpus=8):
+def check_scratch_file_sizes(year_scratch_dir, ncpus=8, inventory_fp=None):
     """Helper function that can be used to check the sizes of hourly WRF files in scratch_dir after batch copying is done. Helpful for finding what files (if any) did not copy successfully.
     
     Args:
         year_scratch_dir (pathlib.PosixPath): path to the annual directory of hourly WRF files within scratch_dir
         ncpus (int): number of CPUs to use for Pooling the filesize checking
+        inventory_fp (path_like): path to the inventory of raw files (see inventory.py) to get the file sizes from, instead of checking each file
         
     Returns:
         flag_fps (list): list of filepaths that were flagged as not being one of the
             common sizes of these hourly WRF files.
     """
-    fps = np.array(list(year_scratch_dir.glob("*.nc")))
     # unique file sizes determined from the CCSM historical data:
     valid_sizes = [35722464, 35722484, 36272728, 36272732, 36272748, 36272752]
-    with Pool(ncpus) as pool:
-        sizes = np.array(pool.map(get_file_size, fps))
+    if inventory_fp is not None:
+        files_df = query_inventory(
+            inventory_fp, year_scratch_dir.parent, [year_scratch_dir.name]
+        )
+        fps = np.array(files_df["path"])
+        sizes = files_df["size"].values
+    else:
+        fps = np.array(list(year_scratch_dir.glob("*.nc")))
+        with Pool(ncpus) as pool:
+            sizes = np.array(pool.map(get_file_size, fps))
     flag_fps = fps[[size not in valid_sizes for size in sizes]]
     return flag_fps
 
@@ -393,12 +433,14 @@ def validate_restacked_file(args):
         args (tuple): argument tuple consisting of the following:
             restack_fp (pathlib.PosixPath): path to file containing restacked data to check
             raw_scratch_dir (pathlib.PosixPath): path to the scratch directory containing raw output data
+            inventory_fp (path_like): optional, path to the inventory of raw files (see inventory.py) to look up the raw file in, instead of listing the year's directory
     
     Returns:
         dict with keys model, scenario, variable, timestamp, and match
     """
     # unpack (for pooling)
-    restack_fp, raw_scratch_dir = args
+    restack_fp, raw_scratch_dir = args[:2]
+    inventory_fp = args[2] if len(args) > 2 else None
     varname = restack_fp.parent.name
     # only check the actual data if the variable is not a wind or accum variable, 
     #  because we will expect those to be different
@@ -428,16 +470,25 @@ def validate_restacked_file(args):
         wrf_time_str = str(check_time.astype("datetime64[h]")).replace("T", "_")
         group = luts.group_fn_lu[f"{model}_{scenario}"]
         try:
-            raw_fp = list(raw_scratch_dir.joinpath(f"{year}").glob(f"*{wrf_time_str}*"))[0]
-        except IndexError:
+            if inventory_fp is not None:
+                raw_fp = query_inventory(
+                    inventory_fp,
+                    raw_scratch_dir,
+                    where="time = ? AND folder_year = ?",
+                    params=(str(check_time.astype("datetime64[s]")), int(str(year))),
+                )["path"][0]
+            else:
+                raw_fp = list(raw_scratch_dir.joinpath(f"{year}").glob(f"*{wrf_time_str}*"))[0]
+        except (IndexError, KeyError):
             print(raw_scratch_dir.joinpath(f"{year}/*{wrf_time_str}*"))
             exit()
-        with xr.open_dataset(raw_fp) as ds:
-            if len(sel_di.keys()) > 1:
-                raw_d3_name = luts.rev_levelnames[d3_name]
-                raw_arr = ds[varname.upper()].sel({raw_d3_name: d3_value}).values
-            else:
-                raw_arr = ds[varname.upper()].values
+        if len(sel_di.keys()) > 1:
+            raw_d3_name = luts.rev_levelnames[d3_name]
+            levels = raw_reader.read_var(raw_fp, raw_d3_name)
+            level_idx = np.flatnonzero(levels == d3_value)[0]
+            raw_arr = raw_reader.read_var(raw_fp, varname.upper(), (level_idx,))
+        else:
+            raw_arr = raw_reader.read_var(raw_fp, varname.upper())
 
         check_result = np.all(np.flipud(raw_arr) == check_arr)
     else:
@@ -68,6 +68,7 @@ def write_sbatch_forecast_times(
     sbatch_out_fp,
     wrf_scratch_dir,
     anc_dir,
+    group,
     forecast_times_script,
     ncpus,
     sbatch_head,
@@ -79,6 +80,7 @@ def write_sbatch_forecast_times(
         sbatch_out_fp (str): path to where sbatch stdout should be written
         wrf_scratch_dir (str): path to the directory in scratch_dir containing the hourly WRF output files to get forecast_time attribute from
         anc_dir (pathlib.PosixPath): path to ancillary dir for writing forecast times table
+        group (str): WRF group being worked on, e.g. ccsm_rcp85, for naming the forecast times catalog
         forecast_times_script (str): path to the script to be called to get the date info and forecast times from files
         ncpus (int): number of CPUS to use for multiprocessing
         sbatch_head (str): output from make_sbatch_head that generates a suitable set of SBATCH commands with .format brackets for the sbatch output filename
@@ -87,7 +89,7 @@ def write_sbatch_forecast_times(
         None, writes the commands to sbatch_fp
     """
     pycommand = (
-        f"python {forecast_times_script} -s {wrf_scratch_dir} -a {anc_dir} -n {ncpus}\n"
+        f"python {forecast_times_script} -s {wrf_scratch_dir} -a {anc_dir} -g {group} -n {ncpus}\n"
     )
     commands = sbatch_head.format(ncpus, sbatch_out_fp) + pycommand
 
@@ -112,6 +114,11 @@ def write_sbatch_restack(
     ncpus,
     sbatch_head,
     geogrid_fp,
+    cache_dir=None,
+    block_steps=None,
+    profile=None,
+    zarr=False,
+    daily_dir=None,
 ):
     """Write an sbatch script for executing the restacking script for a given group and variable, executes for a given list of years 
     
@@ -125,32 +132,60 @@ def write_sbatch_restack(
         group (str): WRF group to work on
         fn_str (str): string name of model / scenario for use in output filename, e.g. "NCAR-CCSM4_historical"
         years (list): list of years to work on
-        varname (str): name of the variable to restack
+        varname (str or list): name of the variable to restack, or a list of variable names to restack from a single read of each hourly file
         ncpus (int): number of CPUS to use for multiprocessing
         sbatch_head (str): output from make_sbatch_head that generates a suitable set of SBATCH commands with .format brackets for the sbatch output filename
         geogrid_fp (path_like): path to WRF geogrid file
+        cache_dir (path_like): directory for caching the boundary forecast_time groups of accumulation variables, for jobs restacking adjacent years. If not supplied, they are only cached in memory. Jobs sharing the directory only remove the slices they saved themselves, so remove it once the WRF group has been restacked.
+        block_steps (int): number of time steps to restack and write at a time, to limit the memory used by variables other than accumulation variables. If not supplied, a whole year is restacked at once.
+        profile (str): name of the encoding profile in luts.encoding_profiles to write with. The "default" profile is used if not supplied.
+        zarr (bool): write the years to a Zarr store for each variable for the whole WRF group instead of yearly NetCDF files. Jobs writing the same variables at once should only be submitted after the stores are created with restack.py --init_zarr.
+        daily_dir (path_like): directory to write the daily aggregates in luts.resample_varnames of the restacked variables to, resampled from the restacked data in memory. If not supplied, the daily data are made from the restacked files with write_sbatch_resample.
         
     Returns:
         None, writes the commands to sbatch_fp
         
     Notes:
-        since these jobs seem to take on the order of 5 minutes or less, seems better to just run through all years once a node is secured for a job, instead of making a single job for every year / variable combination
+        since these jobs seem to take on the order of 5 minutes or less, seems better to just run through all years once a node is secured for a job, instead of making a single job for every year / variable combination. The years are run in a single process to avoid repeating the setup for every year.
+        
+        a year of every variable in a list of variable names is held in memory at once unless block_steps is supplied, so the list should be sized to fit on a compute node
     """
-    ftimes_fp = anc_dir.joinpath(f"WRFDS_forecast_time_attr_{group}.csv")
+    ftimes_fp = anc_dir.joinpath(f"WRFDS_forecast_time_attr_{group}.parquet")
+    if isinstance(varname, str):
+        varnames = [varname]
+    else:
+        varnames = list(varname)
+    for varname in varnames:
+        restack_dir.joinpath(varname.lower()).mkdir(exist_ok=True)
+    # all years are run by a single process, as a range if possible
+    years = sorted(int(year) for year in years)
+    if years == list(range(years[0], years[-1] + 1)):
+        year_str = f"{years[0]}-{years[-1]}"
+    else:
+        year_str = "_".join([str(year) for year in years])
     pycommands = "\n"
-    for year in years:
-        out_fp = restack_dir.joinpath(varname.lower(), f"{varname.lower()}_hourly_wrf_{fn_str}_{year}.nc")
-        out_fp.parent.mkdir(exist_ok=True)
-        pycommands += (
-            f"python {restack_script} "
-            f"-y {year} "
-            f"-v {varname} "
-            f"-f {ftimes_fp} "
-            f"-o {out_fp} "
-            f"-l {luts_fp} "
-            f"-n {ncpus} "
-            f"-g {geogrid_fp}\n\n"
-        )
+    pycommands += (
+        f"python {restack_script} "
+        f"-y {year_str} "
+        f"-v {' '.join(varnames)} "
+        f"-f {ftimes_fp} "
+        f"-d {restack_dir} "
+        f"-fs {fn_str} "
+        f"-l {luts_fp} "
+        f"-n {ncpus} "
+        f"-g {geogrid_fp}"
+    )
+    if cache_dir is not None:
+        pycommands += f" -c {cache_dir}"
+    if block_steps is not None:
+        pycommands += f" -b {block_steps}"
+    if profile is not None:
+        pycommands += f" -p {profile}"
+    if zarr:
+        pycommands += " -z"
+    if daily_dir is not None:
+        pycommands += f" -dd {daily_dir}"
+    pycommands += "\n\n"
     commands = sbatch_head.format(ncpus, sbatch_out_fp) + pycommands
 
     with open(sbatch_fp, "w") as f:
@@ -173,6 +208,8 @@ def write_sbatch_resample(
     aggr,
     ncpus,
     sbatch_head,
+    profile=None,
+    zarr=False,
 ):
     """Write an sbatch script for executing the resampling script for a given group and variable, executes for a given range of years 
     
@@ -185,10 +222,14 @@ def write_sbatch_resample(
         fn_str (str): string name of model / scenario for use in output filename, e.g. "NCAR-CCSM4_historical"
         year_str (str): String for years to process, in '<start year>-<end year>' format
         wrf_varname (str): name of the WRF variable being resampled
-        out_varname (str): name of the variable to resample to (i.e., aggregate name)
-        aggr (str): name of aggregation being done (e.g. "min", "mean", "max", "sum"
+        out_varname (str or list): name of the variable to resample to (i.e., aggregate name),
+            or list of names matching aggr
+        aggr (str or list): name of aggregation being done (e.g. "min", "mean", "max", "sum"),
+            or list of aggregations to compute from a single read of each hourly file
         ncpus (int): number of CPUS to use for multiprocessing
         sbatch_head (str): output from make_sbatch_head that generates a suitable set of SBATCH commands with .format brackets for the sbatch output filename
+        profile (str): name of the encoding profile in luts.encoding_profiles to write with. The "default" profile is used if not supplied.
+        zarr (bool): resample from the Zarr store of the restacked data for the WRF group to a Zarr store of the daily data, see write_sbatch_restack
         
     Returns:
         None, writes the commands to sbatch_fp
@@ -196,6 +237,9 @@ def write_sbatch_resample(
     Notes:
         since these jobs seem to take on the order of 5 minutes or less, seems better to just run through all years once a node is secured for a job, instead of making a single job for every year / variable combination
     """
+    if not isinstance(aggr, str):
+        aggr = " ".join(aggr)
+        out_varname = " ".join(out_varname)
     pycommands = "\n"
     pycommands += (
         f"python {resample_script} "
@@ -206,8 +250,62 @@ def write_sbatch_resample(
         f"-wv {wrf_varname} "
         f"-ov {out_varname} "
         f"-n {ncpus} "
-        f"-fs {fn_str}\n\n"
+        f"-fs {fn_str}"
+    )
+    if profile is not None:
+        pycommands += f" -p {profile}"
+    if zarr:
+        pycommands += " -z"
+    pycommands += "\n\n"
+    commands = sbatch_head.format(ncpus, sbatch_out_fp) + pycommands
+
+    with open(sbatch_fp, "w") as f:
+        f.write(commands)
+
+    return
+
+
+def write_sbatch_aggregate(
+    sbatch_fp,
+    sbatch_out_fp,
+    aggregate_script,
+    restack_dir,
+    fn_str,
+    year_str,
+    varnames,
+    ncpus,
+    sbatch_head,
+    profile=None,
+):
+    """Write an sbatch script for executing the aggregation script, to make the monthly, seasonal and annual files from the daily files of a given group for a given range of years
+    
+    Args:
+        sbatch_fp (path_like): path to .slurm script to write sbatch commands to
+        sbatch_out_fp (path_like): path to where sbatch stdout should be written
+        aggregate_script (path_like): path to the script to be called to run the aggregation
+        restack_dir (path_like): directory containing the "daily" directory of resampled data, where the "monthly", "seasonal" and "annual" directories are written
+        fn_str (str): string name of model / scenario for use in output filename, e.g. "NCAR-CCSM4_historical"
+        year_str (str): String for years to process, in '<start year>-<end year>' format
+        varnames (list): names of the daily variables to aggregate
+        ncpus (int): number of CPUS to use for multiprocessing
+        sbatch_head (str): output from make_sbatch_head that generates a suitable set of SBATCH commands with .format brackets for the sbatch output filename
+        profile (str): name of the encoding profile in luts.encoding_profiles to write with. The "default" profile is used if not supplied.
+        
+    Returns:
+        None, writes the commands to sbatch_fp
+    """
+    pycommands = "\n"
+    pycommands += (
+        f"python {aggregate_script} "
+        f"-r {restack_dir} "
+        f"-y {year_str} "
+        f"-v {' '.join(varnames)} "
+        f"-n {ncpus} "
+        f"-fs {fn_str}"
     )
+    if profile is not None:
+        pycommands += f" -p {profile}"
+    pycommands += "\n\n"
     commands = sbatch_head.format(ncpus, sbatch_out_fp) + pycommands
 
     with open(sbatch_fp, "w") as f:
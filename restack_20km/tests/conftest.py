@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# the pipeline modules are imported as top-level modules, same as when the
+#  scripts are run from the restack_20km directory
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from aggregate import aggregate_monthly, aggregate_seasonal_annual, get_aggregate_fp
+
+
+fn_str = "GFDL-CM3_rcp85"
+
+
+def make_daily_da(year, seed):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(f"{year}-01-01", f"{year}-12-31", freq="D")
+    arr = rng.normal(280, 10, size=(len(dates), 3, 4)).astype(np.float32)
+    # missing days of single pixels, and a pixel with no valid days in March
+    arr[rng.uniform(size=arr.shape) < 0.05] = np.nan
+    arr[(dates.month == 3), 2, 3] = np.nan
+
+    return xr.DataArray(
+        arr, dims=("time", "yc", "xc"), coords={"time": dates}, attrs={"units": "K"}
+    )
+
+
+@pytest.fixture
+def restack_dir(tmp_path):
+    """Daily files of t2 for 2000 and 2001"""
+    for year in [2000, 2001]:
+        daily_fp = tmp_path.joinpath("daily", "t2", f"t2_daily_wrf_{fn_str}_{year}.nc")
+        daily_fp.parent.mkdir(parents=True, exist_ok=True)
+        ds = make_daily_da(year, year).to_dataset(name="t2")
+        ds.attrs["history"] = "resampled"
+        ds.to_netcdf(daily_fp)
+
+    return tmp_path
+
+
+def expected_stats(da):
+    """Statistics of the valid days of a period, with xarray"""
+    return {
+        "mean": da.mean("time").values,
+        "sum": da.sum("time").values,
+        "count": da.count("time").values,
+        "min": da.min("time").values,
+        "max": da.max("time").values,
+    }
+
+
+def assert_stats(ds, i, expected):
+    for stat, arr in expected.items():
+        np.testing.assert_allclose(ds[f"t2_{stat}"][i].values, arr, rtol=1e-6)
+
+
+def test_aggregate_monthly(restack_dir):
+    aggregate_monthly(restack_dir, "t2", fn_str, 2000)
+    monthly_fp = get_aggregate_fp(restack_dir, "monthly", "t2", fn_str, 2000)
+    da = make_daily_da(2000, 2000)
+    with xr.open_dataset(monthly_fp) as ds:
+        assert list(ds.indexes["time"]) == list(pd.date_range("2000-01-01", periods=12, freq="MS"))
+        assert ds["t2_count"].dtype == np.int16
+        assert ds["t2_mean"].attrs["units"] == "K"
+        assert "units" not in ds["t2_count"].attrs
+        for i, month_da in enumerate(da.resample(time="MS")):
+            assert_stats(ds, i, expected_stats(month_da[1]))
+        # a pixel with no valid days in the month
+        assert ds["t2_count"][2, 2, 3] == 0
+        assert np.isnan(ds["t2_mean"][2, 2, 3]) and np.isnan(ds["t2_max"][2, 2, 3])
+        assert ds["t2_sum"][2, 2, 3] == 0
+
+
+def test_aggregate_seasonal_annual(restack_dir, capsys):
+    for year in [2000, 2001]:
+        aggregate_monthly(restack_dir, "t2", fn_str, year)
+    for year in [2000, 2001]:
+        aggregate_seasonal_annual(restack_dir, "t2", fn_str, year)
+    da = xr.concat([make_daily_da(2000, 2000), make_daily_da(2001, 2001)], dim="time")
+
+    seasonal_fp = get_aggregate_fp(restack_dir, "seasonal", "t2", fn_str, 2001)
+    with xr.open_dataset(seasonal_fp) as ds:
+        assert list(ds["season"].values) == ["DJF", "MAM", "JJA", "SON"]
+        # DJF starts with the December of the previous year
+        assert ds.indexes["time"][0] == pd.Timestamp("2000-12-01")
+        assert_stats(ds, 0, expected_stats(da.sel(time=slice("2000-12-01", "2001-02-28"))))
+        assert_stats(ds, 2, expected_stats(da.sel(time=slice("2001-06-01", "2001-08-31"))))
+
+    # there is no December before the first year
+    seasonal_fp = get_aggregate_fp(restack_dir, "seasonal", "t2", fn_str, 2000)
+    with xr.open_dataset(seasonal_fp) as ds:
+        assert list(ds["season"].values) == ["DJF", "MAM", "JJA", "SON"]
+        assert ds.indexes["time"][0] == pd.Timestamp("1999-12-01")
+        assert_stats(ds, 0, expected_stats(da.sel(time=slice("2000-01-01", "2000-02-29"))))
+        assert_stats(ds, 1, expected_stats(da.sel(time=slice("2000-03-01", "2000-05-31"))))
+    assert "WARNING: DJF 2000 of t2 is missing months ['1999-12']" in capsys.readouterr().out
+
+    for year in [2000, 2001]:
+        annual_fp = get_aggregate_fp(restack_dir, "annual", "t2", fn_str, year)
+        with xr.open_dataset(annual_fp) as ds:
+            assert list(ds.indexes["time"]) == [pd.Timestamp(year, 1, 1)]
+            assert_stats(ds, 0, expected_stats(da.sel(time=str(year))))
+
+
+@pytest.mark.parametrize("skip_incomplete", [False, True])
+def test_aggregate_incomplete_year(restack_dir, capsys, skip_incomplete):
+    # a year that ends in the middle of August
+    da = make_daily_da(2002, 2002).sel(time=slice("2002-01-01", "2002-08-15"))
+    daily_fp = restack_dir.joinpath("daily", "t2", f"t2_daily_wrf_{fn_str}_2002.nc")
+    ds = da.to_dataset(name="t2")
+    ds.attrs["history"] = "resampled"
+    ds.to_netcdf(daily_fp)
+    aggregate_monthly(restack_dir, "t2", fn_str, 2002)
+    aggregate_seasonal_annual(
+        restack_dir, "t2", fn_str, 2002, skip_incomplete=skip_incomplete
+    )
+
+    out = capsys.readouterr().out
+    assert "WARNING: 2002 of t2 is missing months ['2002-09', '2002-10', '2002-11', '2002-12']" in out
+    assert "WARNING: SON 2002 of t2 is missing months" not in out
+    seasonal_fp = get_aggregate_fp(restack_dir, "seasonal", "t2", fn_str, 2002)
+    with xr.open_dataset(seasonal_fp) as ds:
+        seasons = list(ds["season"].values)
+    annual_fp = get_aggregate_fp(restack_dir, "annual", "t2", fn_str, 2002)
+    if skip_incomplete:
+        # DJF is missing the December of 2001
+        assert seasons == ["MAM", "JJA"]
+        assert not annual_fp.exists()
+    else:
+        assert seasons == ["DJF", "MAM", "JJA"]
+        with xr.open_dataset(annual_fp) as ds:
+            assert_stats(ds, 0, expected_stats(da))
@@ -0,0 +1,58 @@
+import netCDF4
+import numpy as np
+import pandas as pd
+import xarray as xr
+import luts
+from benchmark_encoding import benchmark_file, write_with_profile
+
+
+def make_ds():
+    rng = np.random.default_rng(0)
+    arr = rng.normal(280, 5, size=(48, 20, 30)).astype(np.float32)
+    return xr.Dataset(
+        {"t2": (("time", "yc", "xc"), arr, {"units": "K"})},
+        coords={
+            "time": pd.date_range("2000-01-01", periods=48, freq="h"),
+            "yc": np.arange(20) * 20000.0,
+            "xc": np.arange(30) * 20000.0,
+        },
+    )
+
+
+def test_write_with_profile(tmp_path):
+    ds = make_ds()
+    for profile in luts.encoding_profiles:
+        out_fp = tmp_path.joinpath(f"{profile}.nc")
+        assert write_with_profile(ds, "t2", profile, out_fp) > 0
+        expected = luts.encoding_profiles[profile]
+        with netCDF4.Dataset(out_fp) as nc:
+            var = nc.variables["t2"]
+            filters = var.filters()
+            assert filters["zlib"] == (expected["codec"] == "zlib")
+            assert filters["complevel"] == expected["complevel"]
+            assert filters["shuffle"] == expected["shuffle"]
+            if expected["chunks"] is not None:
+                chunks = expected["chunks"]
+                assert var.chunking() == [
+                    min(chunks.get(dim) or n, n) for dim, n in zip(var.dimensions, var.shape)
+                ]
+        with xr.open_dataset(out_fp) as out_ds:
+            np.testing.assert_array_equal(out_ds["t2"].values, ds["t2"].values)
+            assert out_ds["t2"].attrs["units"] == "K"
+
+
+def test_benchmark_file(tmp_path):
+    fp = tmp_path.joinpath("t2_hourly_wrf_GFDL-CM3_rcp85_2000.nc")
+    make_ds().to_netcdf(fp)
+    out_dir = tmp_path.joinpath("out")
+    out_dir.mkdir()
+    profiles = ["map-optimized", "timeseries-optimized"]
+    rows = benchmark_file(fp, profiles, out_dir, nreads=3)
+
+    assert [row["profile"] for row in rows] == profiles
+    assert all(row["filename"] == fp.name for row in rows)
+    for row in rows:
+        assert row["size_mb"] >= 0 and row["write_s"] >= 0
+        assert row["map_read_ms"] > 0 and row["timeseries_read_ms"] > 0
+    # the rewritten files are removed
+    assert list(out_dir.iterdir()) == []
@@ -0,0 +1,53 @@
+import numpy as np
+import xarray as xr
+from benchmark_rotation import benchmark_file, time_rotations
+from restack import get_rotation_coefs
+
+
+def make_files(tmp_path):
+    rng = np.random.default_rng(0)
+    dims = ("south_north", "west_east")
+    fp = tmp_path.joinpath("WRFDS_d01.2000-01-01_00.nc")
+    xr.Dataset(
+        {
+            "U10": (dims, rng.normal(size=(4, 5)).astype(np.float32)),
+            "V10": (dims, rng.normal(size=(4, 5)).astype(np.float32)),
+        }
+    ).to_netcdf(fp)
+    alpha = rng.uniform(-0.5, 0.5, (4, 5))
+    geogrid_fp = tmp_path.joinpath("geo_em.d01.nc")
+    xr.Dataset(
+        {"COSALPHA": (dims, np.cos(alpha)), "SINALPHA": (dims, np.sin(alpha))}
+    ).to_netcdf(geogrid_fp)
+
+    return fp, geogrid_fp
+
+
+def test_time_rotations(tmp_path, monkeypatch):
+    fp, geogrid_fp = make_files(tmp_path)
+    # count the reads of the geogrid file
+    loads = []
+    open_dataset = xr.open_dataset
+
+    def counted_open_dataset(path, *args, **kwargs):
+        if path == geogrid_fp:
+            loads.append(path)
+        return open_dataset(path, *args, **kwargs)
+
+    monkeypatch.setattr(xr, "open_dataset", counted_open_dataset)
+    for reload, nloads in [(True, 3), (False, 1)]:
+        loads.clear()
+        times = time_rotations(fp, "U10", geogrid_fp, 3, reload)
+        assert len(times) == 3 and all(t > 0 for t in times)
+        assert len(loads) == nloads
+    # the cache is left empty
+    assert get_rotation_coefs.cache_info().currsize == 0
+
+
+def test_benchmark_file(tmp_path):
+    fp, geogrid_fp = make_files(tmp_path)
+    rows = benchmark_file(fp, ["U10", "V10"], geogrid_fp, 2)
+    assert [row["varname"] for row in rows] == ["U10", "V10"]
+    for row in rows:
+        assert row["filename"] == fp.name
+        assert row["per_file_ms"] > 0 and row["per_worker_ms"] > 0
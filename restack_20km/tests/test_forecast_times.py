@@ -0,0 +1,142 @@
+import os
+from multiprocessing.pool import ThreadPool
+from pathlib import Path
+import netCDF4
+import numpy as np
+import pandas as pd
+from forecast_groups import make_group_index
+import forecast_times
+from forecast_times import make_catalog, read_cache, scan_files, write_catalog
+import raw_reader
+from restack import get_accum_groups, read_ftimes, read_group_index
+
+
+def make_file_attrs(years):
+    """Table of file info like get_file_attrs gives, unsorted, for a forecast_time
+    group in June and one across the new year at the end of each year"""
+    rows = []
+    for start in [f"{year}-{date}" for year in years for date in ["06-01 00:00", "12-31 22:00"]]:
+        times = pd.date_range(start, periods=4, freq="h")
+        for forecast_time, time in enumerate(times, 6):
+            rows.append(
+                {
+                    "filepath": Path(f"/wrf/{time.year}/WRFDS_d01.{time:%Y-%m-%d_%H}.nc"),
+                    "year": str(time.year),
+                    "folder_year": str(time.year),
+                    "month": f"{time.month:02d}",
+                    "day": f"{time.day:02d}",
+                    "hour": f"{time.hour:02d}",
+                    "forecast_time": forecast_time,
+                }
+            )
+
+    return pd.DataFrame(rows[::-1])
+
+
+def test_make_catalog():
+    catalog_df = make_catalog(make_file_attrs([1999, 2000]))
+    assert list(catalog_df.index) == list(range(16))
+    assert catalog_df["time"].is_monotonic_increasing
+    assert list(catalog_df["forecast_group"]) == [1] * 4 + [2] * 4 + [3] * 4 + [4] * 4
+    assert catalog_df["year"].dtype == int
+    assert catalog_df["filepath"][0] == "/wrf/1999/WRFDS_d01.1999-06-01_00.nc"
+
+
+def test_write_catalog(tmp_path):
+    catalog_df = make_catalog(make_file_attrs(range(1997, 2003)))
+    catalog_fp = tmp_path.joinpath("forecast_times.parquet")
+    write_catalog(catalog_df, catalog_fp)
+    # rewriting replaces the catalog rather than adding to the partitions
+    write_catalog(catalog_df, catalog_fp)
+
+    partitions = sorted(fp.name for fp in catalog_fp.glob("year=*"))
+    assert partitions == [f"year={year}" for year in range(1997, 2004)]
+    read_df = pd.read_parquet(catalog_fp).sort_values("time")
+    # the row labels of the whole catalog are kept
+    assert list(read_df.index) == list(catalog_df.index)
+    assert list(read_df["filepath"]) == list(catalog_df["filepath"])
+
+    groups_df = pd.read_parquet(catalog_fp.joinpath("_forecast_groups.parquet"))
+    pd.testing.assert_frame_equal(groups_df, make_group_index(catalog_df))
+
+
+def test_read_ftimes_catalog(tmp_path):
+    catalog_df = make_catalog(make_file_attrs(range(1997, 2003)))
+    catalog_fp = tmp_path.joinpath("forecast_times.parquet")
+    write_catalog(catalog_df, catalog_fp)
+
+    ftimes_df = read_ftimes(catalog_fp, [2000])
+    # only the partitions of the year and the years on either side of it
+    expected_df = catalog_df[catalog_df["year"].isin([1999, 2000, 2001])]
+    assert list(ftimes_df.index) == list(expected_df.index)
+    assert list(ftimes_df["time"]) == list(expected_df["time"])
+    assert list(ftimes_df["forecast_group"]) == list(expected_df["forecast_group"])
+    assert ftimes_df["year"].dtype == int
+
+    # the group index is that of the whole catalog
+    groups_df = read_group_index(catalog_fp, ftimes_df)
+    pd.testing.assert_frame_equal(groups_df, make_group_index(catalog_df))
+    groups, current_year_ind = get_accum_groups(ftimes_df, 2000, groups_df)
+    # the groups of 2000, and the June groups of the years on either side
+    assert [list(df.index) for df in groups] == [
+        list(range(start, start + 4)) for start in [16, 20, 24, 28, 32]
+    ]
+    assert list(current_year_ind) == list(range(6, 14))
+
+
+def write_raw_file(fp, forecast_time, nx=3):
+    """Write a small raw hourly file with the forecast_time attribute on PCPT"""
+    fp.parent.mkdir(parents=True, exist_ok=True)
+    with netCDF4.Dataset(fp, "w", format="NETCDF3_64BIT_OFFSET") as nc:
+        nc.createDimension("west_east", nx)
+        var = nc.createVariable("PCPT", "f4", ("west_east",))
+        var.setncatts({"forecast_time": np.int32(forecast_time)})
+        var[:] = np.zeros(nx)
+
+
+def test_scan_files_cache(tmp_path, monkeypatch):
+    fps = [tmp_path.joinpath(f"2000/WRFDS_d01.2000-01-01_{hour:02d}.nc") for hour in range(3)]
+    for forecast_time, fp in enumerate(fps, 6):
+        write_raw_file(fp, forecast_time)
+    opened = []
+
+    def get_forecast_time(fp):
+        opened.append(fp)
+        return raw_reader.read_attrs(fp, "PCPT")["forecast_time"]
+
+    monkeypatch.setattr(forecast_times, "get_forecast_time", get_forecast_time)
+    cache_fp = tmp_path.joinpath("cache.parquet")
+
+    def scan(fps):
+        opened.clear()
+        with ThreadPool(2) as pool:
+            df, cache_df = scan_files(fps, read_cache(cache_fp), pool)
+        cache_df.to_parquet(cache_fp, index=False)
+        return df, cache_df
+
+    assert len(read_cache(cache_fp)) == 0
+    df, cache_df = scan(fps)
+    assert opened == fps
+    assert list(df["forecast_time"]) == [6, 7, 8]
+    assert list(cache_df["path"]) == [str(fp) for fp in fps]
+
+    # unchanged files are not opened again
+    df, cache_df = scan(fps)
+    assert opened == []
+    assert list(df["forecast_time"]) == [6, 7, 8]
+    assert df["filepath"][0] == fps[0]
+
+    # a changed size or mtime has the file opened again
+    write_raw_file(fps[0], 9, nx=4)
+    mtime = os.stat(fps[1]).st_mtime
+    os.utime(fps[1], (mtime + 10, mtime + 10))
+    df, cache_df = scan(fps)
+    assert opened == fps[:2]
+    assert list(df["forecast_time"]) == [9, 7, 8]
+    assert cache_df["mtime"][1] == mtime + 10
+
+    # files no longer listed are dropped from the cache
+    fps[2].unlink()
+    df, cache_df = scan(fps[:2])
+    assert opened == []
+    assert list(read_cache(cache_fp)["path"]) == [str(fp) for fp in fps[:2]]
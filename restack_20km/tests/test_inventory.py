@@ -0,0 +1,57 @@
+import os
+from pathlib import Path
+from multiprocessing.pool import ThreadPool
+import pytest
+from inventory import query_inventory, update_inventory
+
+
+@pytest.fixture
+def wrf_dir(tmp_path):
+    """Annual subdirs of (unreadable) raw files, which are still inventoried"""
+    wrf_dir = tmp_path.joinpath("wrf")
+    for year in [2000, 2001]:
+        year_dir = wrf_dir.joinpath(str(year))
+        year_dir.mkdir(parents=True)
+        for hour in [0, 1]:
+            year_dir.joinpath(f"WRFDS_d01.{year}-01-01_{hour:02d}.nc").write_bytes(b"")
+
+    return wrf_dir
+
+
+def test_update_inventory_changed_files(tmp_path, wrf_dir):
+    inventory_fp = tmp_path.joinpath("inventory.db")
+    with ThreadPool(2) as pool:
+        assert update_inventory(inventory_fp, wrf_dir, pool) == (4, 4)
+        assert update_inventory(inventory_fp, wrf_dir, pool) == (4, 0)
+        wrf_dir.joinpath("2000/WRFDS_d01.2000-01-01_00.nc").write_bytes(b"changed")
+        wrf_dir.joinpath("2001/WRFDS_d01.2001-01-01_01.nc").unlink()
+        assert update_inventory(inventory_fp, wrf_dir, pool) == (3, 1)
+
+    files_df = query_inventory(inventory_fp, wrf_dir, years=[2001])
+    assert list(files_df["name"]) == ["WRFDS_d01.2001-01-01_00.nc"]
+    assert files_df["time"][0] == "2001-01-01T00:00:00"
+
+
+def test_inventory_resolves_wrf_dir(tmp_path, wrf_dir, monkeypatch):
+    inventory_fp = tmp_path.joinpath("inventory.db")
+    link_dir = tmp_path.joinpath("link")
+    link_dir.symlink_to(wrf_dir)
+    monkeypatch.chdir(tmp_path)
+    with ThreadPool(2) as pool:
+        update_inventory(inventory_fp, link_dir, pool)
+        # same directory, so nothing is new
+        assert update_inventory(inventory_fp, "wrf", pool) == (4, 0)
+
+    for path in [wrf_dir, link_dir, "wrf", os.path.join("link", "..", "wrf")]:
+        files_df = query_inventory(inventory_fp, path)
+        # the paths match listing the directory as given, e.g. through the symlink
+        listed_fps = sorted(Path(path).glob("*/*.nc"))
+        assert list(files_df["path"]) == listed_fps
+        assert all(fp.exists() for fp in files_df["path"])
+        assert list(query_inventory(inventory_fp, path, years=[2001])["path"]) == [
+            fp for fp in listed_fps if fp.parent.name == "2001"
+        ]
+
+    # with no directory given, the paths are as stored
+    files_df = query_inventory(inventory_fp)
+    assert all(fp.parent.parent == wrf_dir.resolve() for fp in files_df["path"])
@@ -0,0 +1,192 @@
+import netCDF4
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from prod_comparison import (
+    DiffCounter,
+    compare_hashes,
+    diff_files,
+    get_runs,
+    read_step_hashes,
+    read_steps,
+)
+from restack import StepStats, get_stats_fp, hash_steps
+
+
+fn = "t2_hourly_wrf_GFDL-CM3_rcp85_2000.nc"
+yc = np.array([3, 2, 1, 0]) * 20000.0
+xc = np.arange(5) * 20000.0
+
+
+def write_restacked(fp, times, arr, stats=True):
+    """Write a small restacked file in 4-step chunks, with a statistics sidecar"""
+    fp.parent.mkdir(parents=True, exist_ok=True)
+    ds = xr.Dataset(
+        {"t2": (("time", "yc", "xc"), arr)},
+        coords={"time": times, "yc": yc, "xc": xc},
+    )
+    ds.to_netcdf(fp, encoding={"t2": {"zlib": True, "chunksizes": (4, 4, 5)}})
+    if stats:
+        step_stats = StepStats(times)
+        step_stats.update(0, arr)
+        step_stats.write(get_stats_fp(fp))
+
+
+@pytest.fixture
+def file_pair(tmp_path):
+    """New and production files overlapping for 7 time steps, production data
+    starting 3 steps later, with differences at steps 4 and 7 of the new file.
+    Step 8 differs only in the sign of a zero, so its hashes differ but not its values.
+    """
+    rng = np.random.default_rng(0)
+    times = pd.date_range("2000-01-01", periods=13, freq="h")
+    arr = rng.normal(280, 5, size=(13, 4, 5)).astype(np.float32)
+    arr[5, 3, 3] = np.nan
+    arr[8, 0, 0] = 0.0
+    new_arr, prod_arr = arr[:10].copy(), arr[3:].copy()
+    # a difference before the production data starts is not compared
+    new_arr[0] += 1
+    new_arr[4, 1, 2] += 1.0
+    new_arr[4, 2, 3] += 1e-4
+    prod_arr[4, 0, 1] = np.nan
+    prod_arr[5, 0, 0] = -0.0
+
+    new_fp = tmp_path.joinpath("new", "t2", fn)
+    prod_fp = tmp_path.joinpath("prod", "t2", fn)
+    write_restacked(new_fp, times[:10], new_arr)
+    # production files were written without sidecars
+    write_restacked(prod_fp, times[3:], prod_arr, stats=False)
+
+    return new_fp, prod_fp
+
+
+def test_get_runs():
+    runs = get_runs(np.array([0, 1, 2, 5, 6, 9]), max_steps=2)
+    assert [list(run) for run in runs] == [[0, 1], [2], [5, 6], [9]]
+
+
+def test_read_steps(tmp_path):
+    fp = tmp_path.joinpath(fn)
+    arr = np.arange(6 * 4 * 5, dtype=np.float32).reshape(6, 4, 5)
+    write_restacked(fp, pd.date_range("2000-01-01", periods=6, freq="h"), arr)
+    with netCDF4.Dataset(fp) as nc:
+        var = nc.variables["t2"]
+        np.testing.assert_array_equal(read_steps(var, np.array([1, 2, 3])), arr[1:4])
+        np.testing.assert_array_equal(read_steps(var, np.array([0, 3, 5])), arr[[0, 3, 5]])
+
+
+def test_read_step_hashes(tmp_path):
+    fp = tmp_path.joinpath("t2", fn)
+    times = pd.date_range("2000-01-01", periods=6, freq="h")
+    arr = np.random.default_rng(0).normal(size=(6, 4, 5)).astype(np.float32)
+    arr[2, 1, 1] = np.nan
+    write_restacked(fp, times, arr)
+    stats_fp = get_stats_fp(fp)
+    stats_df = pd.read_parquet(stats_fp)
+
+    read_times, hashes = read_step_hashes(fp, "t2")
+    np.testing.assert_array_equal(read_times, times.values)
+    assert list(hashes) == hash_steps(arr)
+
+    # the hashes are taken from the sidecar when its times match the file
+    stats_df.assign(hash="from sidecar").to_parquet(stats_fp)
+    assert set(read_step_hashes(fp, "t2")[1]) == {"from sidecar"}
+
+    # otherwise the file is read, e.g. for a sidecar of fewer time steps
+    stats_df.iloc[:4].assign(hash="from sidecar").to_parquet(stats_fp)
+    assert list(read_step_hashes(fp, "t2")[1]) == hash_steps(arr)
+    # or of the same number of time steps at other times
+    stats_df.assign(
+        time=stats_df["time"] + pd.Timedelta(hours=1), hash="from sidecar"
+    ).to_parquet(stats_fp)
+    assert list(read_step_hashes(fp, "t2")[1]) == hash_steps(arr)
+    # or one written before the hashes were added
+    stats_df.drop(columns="hash").to_parquet(stats_fp)
+    assert list(read_step_hashes(fp, "t2")[1]) == hash_steps(arr)
+
+
+def test_compare_hashes(file_pair):
+    result = compare_hashes(file_pair)
+    assert result["error"] is None
+    assert result["n_steps"] == 10
+    assert result["n_common_steps"] == 7
+    # steps 4, 7 and 8 of the new file, at 1, 4 and 5 of the production file
+    assert result["n_hash_mismatch"] == 3
+    assert result["n_steps_mismatch"] == 2
+    assert result["n_mismatch"] == 3
+    assert result["arr_result"] is False
+    assert result["time_result"] is False
+
+
+def test_compare_hashes_missing_prod(file_pair, tmp_path):
+    result = compare_hashes((file_pair[0], tmp_path.joinpath("missing", "t2", fn)))
+    assert result["error"] == "FileNotFoundError"
+    assert result["arr_result"] is False
+
+
+def test_diff_counter():
+    counter = DiffCounter(rtol=0.1)
+    prod_arr = np.ones((4, 3, 4), dtype=np.float32)
+    prod_arr[2, 2, 3] = 0.0
+    new_arr = prod_arr.copy()
+    # within the tolerance
+    new_arr[0, 1, 2] = 1.05
+    new_arr[1, 0, 0] = 1.5
+    # the relative difference is not defined for a zero
+    new_arr[2, 2, 3] = 0.2
+    new_arr[3, 1, 1] = np.nan
+    # NaNs in the same places are equal
+    new_arr[0, 0, 0] = prod_arr[0, 0, 0] = np.nan
+    counter.update(0, new_arr[:2], prod_arr[:2])
+    counter.update(2, new_arr[2:], prod_arr[2:])
+    result = counter.result(
+        pd.date_range("2000-01-01", periods=4, freq="h").values, yc[:3], xc[:4]
+    )
+
+    assert result["n_values"] == 48
+    assert result["n_diff"] == 3
+    assert result["n_nan_mismatch"] == 1
+    assert result["max_abs_diff"] == pytest.approx(0.5)
+    assert result["mean_abs_diff"] == pytest.approx(0.35)
+    assert result["max_rel_diff"] == pytest.approx(0.5)
+    assert result["mean_rel_diff"] == pytest.approx(0.5)
+    assert result["n_steps_diff"] == 3
+    assert result["first_diff_time"] == np.datetime64("2000-01-01T01:00")
+    assert result["last_diff_time"] == np.datetime64("2000-01-01T03:00")
+    # the bounding box of both blocks
+    assert (result["yc_min"], result["yc_max"]) == (20000, 60000)
+    assert (result["xc_min"], result["xc_max"]) == (0, 60000)
+
+
+def test_diff_counter_no_diff():
+    counter = DiffCounter()
+    arr = np.ones((2, 3, 4))
+    counter.update(0, arr, arr.copy())
+    result = counter.result(np.arange(2), yc[:3], xc[:4])
+    assert result["n_values"] == 24
+    assert result["n_diff"] == 0 and result["n_steps_diff"] == 0
+    assert result["first_diff_time"] is None and result["yc_min"] is None
+
+
+@pytest.mark.parametrize("atol,n_diff", [(0.0, 3), (1e-3, 2)])
+def test_diff_files(file_pair, atol, n_diff):
+    result = diff_files(file_pair, atol=atol, block_steps=2)
+    assert result["error"] is None
+    assert result["year"] == 2000
+    assert result["n_steps"] == 10
+    assert result["n_common_steps"] == 7
+    assert result["time_result"] is False
+    assert result["arr_result"] is False
+    # the differences in the common time steps only
+    assert result["n_values"] == 7 * 4 * 5
+    assert result["n_diff"] == n_diff
+    assert result["n_nan_mismatch"] == 1
+    assert result["max_abs_diff"] == pytest.approx(1.0, rel=1e-4)
+    assert result["n_steps_diff"] == 2
+    assert result["first_diff_time"] == np.datetime64("2000-01-01T04:00")
+    assert result["last_diff_time"] == np.datetime64("2000-01-01T07:00")
+    y_max = 2 if atol == 0 else 1
+    x_max = 3 if atol == 0 else 2
+    assert (result["yc_min"], result["yc_max"]) == (yc[y_max], yc[0])
+    assert (result["xc_min"], result["xc_max"]) == (xc[1], xc[x_max])
@@ -0,0 +1,159 @@
+import json
+import shutil
+from multiprocessing.pool import ThreadPool
+import netCDF4
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+import raw_reader
+from raw_index import build_index, open_raw_index
+
+
+def write_raw_file(fp, forecast_time, seed=0, file_format="NETCDF3_64BIT_OFFSET"):
+    """Write a small file shaped like a raw hourly WRF file"""
+    rng = np.random.default_rng(seed)
+    with netCDF4.Dataset(fp, "w", format=file_format) as nc:
+        nc.createDimension("lv_ISBL2", 3)
+        nc.createDimension("south_north", 4)
+        nc.createDimension("west_east", 5)
+        lat = nc.createVariable("g5_lat_0", "f4", ("south_north", "west_east"))
+        lat[:] = np.arange(20).reshape(4, 5)
+        plev = nc.createVariable("lv_ISBL2", "f4", ("lv_ISBL2",))
+        plev[:] = [1000, 850, 500]
+        pcpt = nc.createVariable("PCPT", "f4", ("south_north", "west_east"))
+        pcpt.setncatts({"units": "mm", "forecast_time": np.int32(forecast_time)})
+        pcpt[:] = rng.uniform(0, 5, size=(4, 5))
+        t2 = nc.createVariable("T2", "f4", ("south_north", "west_east"), fill_value=1e20)
+        t2[:] = rng.normal(280, 5, size=(4, 5))
+        t2[0, 0] = np.ma.masked
+        t = nc.createVariable("T", "f8", ("lv_ISBL2", "south_north", "west_east"))
+        t[:] = rng.normal(250, 5, size=(3, 4, 5))
+        # a packed variable, read with xarray
+        q = nc.createVariable("Q2", "i2", ("south_north", "west_east"))
+        q.setncatts({"scale_factor": np.float32(0.01), "add_offset": np.float32(1.0)})
+        q[:] = rng.uniform(0, 2, size=(4, 5))
+
+
+@pytest.fixture
+def wrf_dir(tmp_path):
+    """Annual subdirs of raw files, with one netCDF-4 file read with xarray"""
+    wrf_dir = tmp_path.joinpath("wrf")
+    times = pd.date_range("1999-12-31 22:00", periods=6, freq="h")
+    for i, time in enumerate(times):
+        # the last file of a year is in the next year's directory
+        year_dir = wrf_dir.joinpath(str((time + pd.Timedelta(hours=1)).year))
+        year_dir.mkdir(parents=True, exist_ok=True)
+        file_format = "NETCDF4" if i == 4 else "NETCDF3_64BIT_OFFSET"
+        write_raw_file(
+            year_dir.joinpath(f"WRFDS_d01.{time:%Y-%m-%d_%H}.nc"),
+            6 + i,
+            seed=i,
+            file_format=file_format,
+        )
+
+    return wrf_dir
+
+
+@pytest.fixture(autouse=True)
+def clear_layouts():
+    raw_reader.layouts.clear()
+
+
+def write_index(wrf_dir, index_fp, years):
+    # one thread, the netCDF library is not thread safe
+    with ThreadPool(1) as pool:
+        index = build_index(wrf_dir, years, pool)
+    with open(index_fp, "w") as f:
+        json.dump(index, f)
+
+    return index
+
+
+def open_expected(wrf_dir, year):
+    fps = sorted(
+        fp
+        for fp in wrf_dir.glob("*/WRFDS*.nc")
+        if fp.name.split(".")[1].startswith(str(year))
+    )
+    datasets = [xr.open_dataset(fp) for fp in fps]
+
+    return xr.concat(datasets, dim="time")
+
+
+def test_build_open_round_trip(tmp_path, wrf_dir):
+    index_fp = tmp_path.joinpath("index.json")
+    index = write_index(wrf_dir, index_fp, [2000])
+
+    # the file of 1999 in the 2000 directory is not indexed
+    assert [file_info["time"] for file_info in index["files"]] == [
+        f"2000-01-01T{hour:02d}:00:00" for hour in range(4)
+    ]
+    # the netCDF-3 files share a layout, the netCDF-4 file has its own
+    assert [file_info["layout"] for file_info in index["files"]] == ["0", "0", "1", "0"]
+    assert [file_info["forecast_time"] for file_info in index["files"]] == [8, 9, 10, 11]
+    variables = index["layouts"]["0"]["variables"]
+    assert variables["T2"]["virtual"] and not variables["Q2"]["virtual"]
+    assert not any(var["virtual"] for var in index["layouts"]["1"]["variables"].values())
+    # forecast_time is listed for each file rather than with the layout of the first
+    for layout in index["layouts"].values():
+        assert "forecast_time" not in layout["variables"]["PCPT"]["attrs"]
+
+    with open_raw_index(index_fp) as ds, open_expected(wrf_dir, 2000) as expected_ds:
+        assert list(ds.indexes["time"]) == list(
+            pd.date_range("2000-01-01", periods=4, freq="h")
+        )
+        assert list(ds["forecast_time"].values) == [8, 9, 10, 11]
+        assert set(ds.data_vars) == {"PCPT", "T2", "T", "Q2", "forecast_time"}
+        assert ds["T"].dims == ("time", "lv_ISBL2", "south_north", "west_east")
+        np.testing.assert_array_equal(ds["lv_ISBL2"], [1000, 850, 500])
+        np.testing.assert_array_equal(ds["g5_lat_0"], expected_ds["g5_lat_0"][0])
+        assert ds["PCPT"].attrs["units"] == "mm"
+        assert "forecast_time" not in ds["PCPT"].attrs
+        for varname in ["PCPT", "T2", "T", "Q2"]:
+            assert ds[varname].dtype == expected_ds[varname].dtype
+            np.testing.assert_array_equal(ds[varname].values, expected_ds[varname].values)
+
+    # copies of the indexed files in another directory
+    copy_dir = tmp_path.joinpath("copy")
+    shutil.copytree(wrf_dir, copy_dir)
+    copy_dir.joinpath("2000/WRFDS_d01.2000-01-01_01.nc").unlink()
+    with open_raw_index(index_fp, root=copy_dir) as ds:
+        with pytest.raises(FileNotFoundError):
+            ds["T2"][1].values
+
+
+@pytest.mark.parametrize(
+    "indexers",
+    [
+        {"time": 1},
+        {"time": [0, 2, 3], "south_north": [3, 0], "west_east": 2},
+        {"time": slice(1, 4), "lv_ISBL2": 1, "west_east": slice(1, None, 2)},
+        {"time": slice(2, 2)},
+        {"time": [3, 1], "lv_ISBL2": [2, 0], "south_north": slice(None, None, -1)},
+    ],
+)
+def test_raw_variable_array_indexing(tmp_path, wrf_dir, indexers):
+    index_fp = tmp_path.joinpath("index.json")
+    write_index(wrf_dir, index_fp, [2000])
+    with open_raw_index(index_fp) as ds, open_expected(wrf_dir, 2000) as expected_ds:
+        for varname in ["T2", "T", "Q2"]:
+            var_indexers = {
+                dim: key for dim, key in indexers.items() if dim in ds[varname].dims
+            }
+            result = ds[varname].isel(var_indexers)
+            expected = expected_ds[varname].isel(var_indexers)
+            assert result.shape == expected.shape
+            np.testing.assert_array_equal(result.values, expected.values)
+
+
+def test_changed_file(tmp_path, wrf_dir):
+    index_fp = tmp_path.joinpath("index.json")
+    write_index(wrf_dir, index_fp, [2000])
+    fp = wrf_dir.joinpath("2000/WRFDS_d01.2000-01-01_03.nc")
+    with open(fp, "ab") as f:
+        f.write(b"\0" * 8)
+    with open_raw_index(index_fp) as ds:
+        assert ds["T2"][0].values.shape == (4, 5)
+        with pytest.raises(ValueError, match="has changed since it was indexed"):
+            ds["T2"][3].values
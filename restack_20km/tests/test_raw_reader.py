@@ -0,0 +1,94 @@
+import netCDF4
+import numpy as np
+import pytest
+import xarray as xr
+import raw_reader
+
+
+def write_raw_file(fp, forecast_time, seed=0, file_format="NETCDF3_64BIT_OFFSET"):
+    """Write a small file shaped like a raw hourly WRF file"""
+    rng = np.random.default_rng(seed)
+    with netCDF4.Dataset(fp, "w", format=file_format) as nc:
+        nc.createDimension("time", None)
+        nc.createDimension("lv_ISBL2", 3)
+        nc.createDimension("south_north", 4)
+        nc.createDimension("west_east", 5)
+        nc.setncattr("title", "test")
+        t2 = nc.createVariable("T2", "f4", ("south_north", "west_east"), fill_value=1e20)
+        t2.setncatts({"units": "K", "forecast_time": np.int32(forecast_time)})
+        t2[:] = rng.normal(size=(4, 5))
+        t2[0, 0] = np.ma.masked
+        t = nc.createVariable("T", "f4", ("lv_ISBL2", "south_north", "west_east"))
+        t[:] = rng.normal(size=(3, 4, 5))
+        # two record variables, which are interleaved one record at a time
+        u = nc.createVariable("U", "f4", ("time", "south_north", "west_east"))
+        v = nc.createVariable("V", "f8", ("time", "south_north", "west_east"))
+        u[:] = rng.normal(size=(2, 4, 5))
+        v[:] = rng.normal(size=(2, 4, 5))
+        # a packed variable, read with xarray
+        q = nc.createVariable("Q2", "i2", ("south_north", "west_east"))
+        q.setncatts({"scale_factor": np.float32(0.01), "add_offset": np.float32(1.0)})
+        q[:] = rng.uniform(0, 2, size=(4, 5))
+
+
+@pytest.fixture(autouse=True)
+def clear_layouts():
+    raw_reader.layouts.clear()
+
+
+@pytest.mark.parametrize("file_format", ["NETCDF3_CLASSIC", "NETCDF3_64BIT_OFFSET"])
+def test_parse_header(tmp_path, file_format):
+    fp = tmp_path.joinpath("WRFDS_d01.2000-01-01_00.nc")
+    write_raw_file(fp, 6, file_format=file_format)
+    layout = raw_reader.parse_header(fp.read_bytes())
+    assert layout["numrecs"] == 2
+    variables = layout["variables"]
+    assert set(variables) == {"T2", "T", "U", "V", "Q2"}
+    assert variables["T"]["shape"] == (3, 4, 5)
+    assert variables["T"]["dims"] == ("lv_ISBL2", "south_north", "west_east")
+    assert variables["U"]["record"] and not variables["T2"]["record"]
+    assert variables["V"]["dtype"] == np.dtype(">f8")
+    # interleaved records of U (float32) and V (float64)
+    assert layout["recsize"] == 4 * 5 * 4 + 4 * 5 * 8
+    header = np.frombuffer(fp.read_bytes()[: len(layout["header"])], dtype=np.uint8)
+    attrs = raw_reader.decode_attrs(variables["T2"]["attrs"], header)
+    assert attrs["units"] == "K" and attrs["forecast_time"] == 6
+
+
+def test_parse_header_not_netcdf3(tmp_path):
+    fp = tmp_path.joinpath("test.nc")
+    write_raw_file(fp, 6, file_format="NETCDF4")
+    with pytest.raises(ValueError):
+        raw_reader.parse_header(fp.read_bytes())
+
+
+@pytest.mark.parametrize("file_format", ["NETCDF3_64BIT_OFFSET", "NETCDF4"])
+def test_read_vars_matches_xarray(tmp_path, file_format):
+    varnames = ["T2", "T", "U", "V", "Q2"]
+    # files of the same size share a layout, with different attribute values
+    for i, forecast_time in enumerate([6, 12]):
+        fp = tmp_path.joinpath(f"WRFDS_d01.2000-01-01_{i:02d}.nc")
+        write_raw_file(fp, forecast_time, seed=i, file_format=file_format)
+        arrs = raw_reader.read_vars(fp, varnames)
+        with xr.open_dataset(fp) as ds:
+            for varname in varnames:
+                expected = ds[varname].values
+                assert arrs[varname].dtype == expected.dtype
+                assert np.array_equal(arrs[varname], expected, equal_nan=True)
+            assert np.array_equal(
+                raw_reader.read_var(fp, "T", (0,)), ds["T"][0].values
+            )
+        assert raw_reader.read_attrs(fp, "T2")["forecast_time"] == forecast_time
+
+
+def test_get_layout_key(tmp_path):
+    keys = []
+    for i, forecast_time in enumerate([6, 12]):
+        fp = tmp_path.joinpath(f"WRFDS_d01.2000-01-01_{i:02d}.nc")
+        write_raw_file(fp, forecast_time, seed=i)
+        keys.append(raw_reader.get_layout_key(raw_reader.parse_header(fp.read_bytes())))
+    # attribute values are not part of the layout
+    assert keys[0] == keys[1]
+    fp = tmp_path.joinpath("WRFDS_d01.2000-01-01_02.nc")
+    write_raw_file(fp, 6, file_format="NETCDF3_CLASSIC")
+    assert raw_reader.get_layout_key(raw_reader.parse_header(fp.read_bytes())) != keys[0]
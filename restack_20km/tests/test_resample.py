@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from resample import aggregate_daily, daily_reducers, make_daily_zarr_store, resample
+
+
+def make_hourly(seed=0, n_days=4, step_hours=1):
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(
+        "2000-01-01", periods=n_days * 24 // step_hours, freq=pd.Timedelta(hours=step_hours)
+    )
+    arr = rng.normal(280, 10, size=(len(times), 3, 4)).astype(np.float32)
+
+    return times, arr
+
+
+def xarray_daily(arr, times, aggr):
+    da = xr.DataArray(arr, dims=("time", "y", "x"), coords={"time": times})
+
+    return getattr(da.resample(time="D"), aggr)().values
+
+
+@pytest.mark.parametrize("aggr", list(daily_reducers))
+@pytest.mark.parametrize("step_hours", [1, 6])
+def test_aggregate_daily(aggr, step_hours):
+    times, arr = make_hourly(step_hours=step_hours)
+    daily_dates, daily_arr, missing = aggregate_daily(arr, times, aggr)
+
+    assert daily_arr.dtype == arr.dtype
+    assert list(daily_dates) == list(pd.date_range("2000-01-01", periods=4))
+    assert len(missing) == 0
+    # identical values, not just close
+    np.testing.assert_array_equal(daily_arr, xarray_daily(arr, times, aggr))
+
+
+@pytest.mark.parametrize("aggr", list(daily_reducers))
+def test_aggregate_daily_missing(aggr):
+    times, arr = make_hourly(n_days=5)
+    arr[5, 1, 1] = np.nan
+    arr[30:32, 2] = np.nan
+    # drop an hour of the second day and all of the fourth day
+    keep = np.ones(len(times), dtype=bool)
+    keep[40] = False
+    keep[72:96] = False
+    times, arr = times[keep], arr[keep]
+    daily_dates, daily_arr, missing = aggregate_daily(arr, times, aggr)
+
+    assert len(daily_dates) == 5
+    assert np.isnan(daily_arr[3]).all()
+    assert list(missing.index) == list(daily_dates[[1, 3]])
+    assert list(missing["n_steps"]) == [23, 0]
+    assert (missing["expected_steps"] == 24).all()
+    expected = xarray_daily(arr, times, aggr)
+    if aggr == "sum":
+        # xarray gives 0 for the sum of a day with no time steps
+        expected[3] = np.nan
+    np.testing.assert_array_equal(daily_arr, expected)
+
+
+def test_daily_zarr_store_missing_day(tmp_path):
+    times, arr = make_hourly(n_days=5)
+    # drop all of the third day
+    keep = (times < "2000-01-03") | (times >= "2000-01-04")
+    times, arr = times[keep], arr[keep]
+    hourly_fp = tmp_path.joinpath("t2_hourly.zarr")
+    ds = xr.Dataset(
+        {"t2": (("time", "yc", "xc"), arr, {"units": "K"})},
+        coords={"time": times},
+        attrs={"history": "restacked"},
+    )
+    ds.to_zarr(hourly_fp)
+    out_fp = tmp_path.joinpath("t2_mean_daily.zarr")
+    make_daily_zarr_store(hourly_fp, "mean", "t2", "t2_mean", out_fp)
+    resample(hourly_fp, "mean", "t2", "t2_mean", out_fp, year=2000)
+
+    with xr.open_zarr(out_fp) as daily_ds:
+        assert list(daily_ds.indexes["time"]) == list(pd.date_range("2000-01-01", periods=5))
+        daily_arr = daily_ds["t2_mean"].values
+    assert np.isnan(daily_arr[2]).all()
+    np.testing.assert_array_equal(daily_arr, aggregate_daily(arr, times, "mean")[1])
+
+
+def test_resample_aggregates_one_read(tmp_path, monkeypatch):
+    times, arr = make_hourly(n_days=3)
+    hourly_fp = tmp_path.joinpath("t2_hourly.nc")
+    xr.Dataset(
+        {"t2": (("time", "yc", "xc"), arr, {"units": "K"})},
+        coords={"time": times},
+        attrs={"history": "restacked"},
+    ).to_netcdf(hourly_fp)
+    aggrs, out_varnames = ["max", "min", "mean"], ["t2max", "t2min", "t2"]
+    out_fps = [tmp_path.joinpath("multi", f"{name}_daily.nc") for name in out_varnames]
+    out_fps[0].parent.mkdir()
+
+    opened = []
+    open_dataset = xr.open_dataset
+
+    def counted_open_dataset(*args, **kwargs):
+        opened.append(args[0])
+        return open_dataset(*args, **kwargs)
+
+    monkeypatch.setattr(xr, "open_dataset", counted_open_dataset)
+    resample(hourly_fp, aggrs, "t2", out_varnames, out_fps)
+    # the hourly file is read once for all of the aggregates
+    assert opened == [hourly_fp]
+    monkeypatch.undo()
+
+    for aggr, out_varname, out_fp in zip(aggrs, out_varnames, out_fps):
+        # the same as resampling to each aggregate on its own
+        single_fp = tmp_path.joinpath(f"{out_varname}_daily.nc")
+        resample(hourly_fp, aggr, "t2", out_varname, single_fp)
+        with xr.open_dataset(out_fp) as ds, xr.open_dataset(single_fp) as single_ds:
+            assert list(ds.data_vars) == [out_varname]
+            expected = xarray_daily(arr, times, aggr)
+            np.testing.assert_array_equal(ds[out_varname].values, expected)
+            np.testing.assert_array_equal(
+                ds[out_varname].values, single_ds[out_varname].values
+            )
+            assert aggr in ds[out_varname].attrs["temporal_resampling"]
@@ -0,0 +1,880 @@
+import os
+import tracemalloc
+from multiprocessing import Pool, shared_memory
+from multiprocessing.pool import ThreadPool
+from types import SimpleNamespace
+import netCDF4
+import numcodecs
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from forecast_groups import check_group_index, make_group_index
+from resample import resample
+import luts
+import raw_reader
+import restack as restack_module
+from restack import (
+    get_accum_groups,
+    get_daily_outputs,
+    get_profile_encoding,
+    get_rotation_coefs,
+    get_zarr_codecs,
+    hash_steps,
+    interp_1d_along_axis,
+    interp_nan_slices,
+    make_pool,
+    open_ds_vars,
+    parse_year_str,
+    read_ftimes,
+    read_group_index,
+    restack,
+    restack_accum,
+    restack_blocks,
+    restack_vars,
+    restack_winds,
+    restack_year,
+    run_rotate_winds,
+    select_wind,
+    SharedCube,
+    StackedCache,
+    StepStats,
+    write_to_cube,
+)
+
+
+def baseline_interp(arr):
+    """Per-pixel interpolation used before interp_nan_slices"""
+    return np.apply_along_axis(interp_1d_along_axis, 0, arr.copy())
+
+
+def make_arr(shape, nan_slices, seed=0):
+    rng = np.random.default_rng(seed)
+    arr = rng.normal(size=shape).astype(np.float32)
+    arr[nan_slices] = np.nan
+
+    return arr
+
+
+@pytest.mark.parametrize("shape", [(12, 4, 5), (12, 3, 4, 5)])
+@pytest.mark.parametrize(
+    "nan_slices",
+    [
+        [3],
+        # leading and trailing NaN slices
+        [0, 1, 11],
+        # runs of consecutive NaN slices
+        [2, 3, 4, 7, 8],
+        [0, 5, 6, 10, 11],
+    ],
+)
+def test_interp_nan_slices_matches_baseline(shape, nan_slices):
+    arr = make_arr(shape, nan_slices)
+    expected = baseline_interp(arr)
+    result = interp_nan_slices(arr.copy())
+    assert result.dtype == expected.dtype
+    assert np.array_equal(result, expected)
+
+
+def test_interp_nan_slices_partial_nans_fall_back():
+    arr = make_arr((10, 4, 5), [2, 6])
+    # NaNs outside of whole NaN slices
+    arr[4, 1, 2] = np.nan
+    arr[5, 0, 0] = np.nan
+    expected = baseline_interp(arr)
+    result = interp_nan_slices(arr.copy())
+    assert np.array_equal(result, expected)
+    assert not np.isnan(result).any()
+
+
+def test_interp_nan_slices_no_nans():
+    arr = make_arr((6, 3, 3), [])
+    assert np.array_equal(interp_nan_slices(arr.copy()), arr)
+
+
+def test_get_profile_encoding():
+    dims, shape = ("time", "level", "yc", "xc"), (8760, 9, 262, 262)
+    encoding = get_profile_encoding(
+        luts.encoding_profiles["timeseries-optimized"], dims, shape
+    )
+    # the whole time dimension, one level and 16 x 16 pixels per chunk
+    assert encoding["chunksizes"] == (8760, 1, 16, 16)
+    assert encoding["zlib"] and encoding["complevel"] == 4 and encoding["shuffle"]
+    # chunks are no larger than the variable
+    encoding = get_profile_encoding(
+        luts.encoding_profiles["archive-max"], ("time", "yc", "xc"), (48, 262, 262)
+    )
+    assert encoding["chunksizes"] == (48, 262, 262)
+    assert get_profile_encoding(luts.encoding_profiles["default"], dims, shape)[
+        "chunksizes"
+    ] is None
+
+    profile = dict(luts.encoding_profiles["default"], codec=None)
+    encoding = get_profile_encoding(profile, dims, shape)
+    assert not encoding["zlib"] and "complevel" not in encoding
+    # only the codecs of the netCDF4 version in the environment
+    with pytest.raises(ValueError, match="Unsupported codec 'zstd'"):
+        get_profile_encoding(dict(profile, codec="zstd"), dims, shape)
+
+
+def test_get_zarr_codecs():
+    dims, shape = ("time", "yc", "xc"), (48, 262, 262)
+    encoding = get_profile_encoding(luts.encoding_profiles["archive-max"], dims, shape)
+    compressor, filters = get_zarr_codecs(encoding)
+    # the same zlib level and shuffle as the netCDF files
+    assert compressor == numcodecs.Zlib(level=9)
+    assert filters == [numcodecs.Shuffle(elementsize=4)]
+    profile = dict(luts.encoding_profiles["archive-max"], codec=None, shuffle=False)
+    assert get_zarr_codecs(get_profile_encoding(profile, dims, shape)) == (None, None)
+
+
+def test_hash_steps():
+    rng = np.random.default_rng(0)
+    arr = rng.normal(size=(4, 3, 5)).astype(np.float32)
+    arr[1, 0, 0] = np.nan
+    hashes = hash_steps(arr)
+
+    assert len(hashes) == 4
+    assert len(set(hashes)) == 4
+    # same values in another byte order, memory layout or float type
+    assert hash_steps(arr.astype(">f4")) == hashes
+    assert hash_steps(np.asfortranarray(arr)) == hashes
+    assert hash_steps(arr.astype(np.float64)) == hashes
+    # NaNs with other bits
+    other_nan = arr.copy()
+    other_nan.view(np.uint32)[1, 0, 0] = 0xFFC00001
+    assert hash_steps(other_nan) == hashes
+    # only the hash of the changed step changes
+    changed = arr.copy()
+    changed[2, 1, 1] = np.nextafter(changed[2, 1, 1], np.float32(np.inf))
+    changed_hashes = hash_steps(changed)
+    assert [a == b for a, b in zip(changed_hashes, hashes)] == [True, True, False, True]
+    # the dtype the data are stored as
+    assert hash_steps(arr, "float64") != hashes
+
+
+def test_step_stats_blocks():
+    dates = pd.date_range("2000-01-01", periods=200, freq="h")
+    arr = make_arr((200, 30, 40), [3, 4])
+    arr[10, 2, 3] = np.nan
+    stats = StepStats(dates, block_steps=7)
+    tracemalloc.start()
+    try:
+        stats.update(0, arr)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # the temporary arrays are the size of a block, not of the data
+    assert peak < arr.nbytes / 4
+
+    stats_df = stats.to_frame()
+    assert stats.complete
+    assert list(stats_df["hash"]) == hash_steps(arr)
+    assert list(stats_df["n_nan"][[3, 4, 10]]) == [1200, 1200, 1]
+    assert (stats_df["n_valid"] + stats_df["n_nan"] == 1200).all()
+    assert stats_df[["min", "max", "mean"]].iloc[[3, 4]].isna().all(axis=None)
+    valid = np.ones(200, dtype=bool)
+    valid[[3, 4]] = False
+    np.testing.assert_array_equal(
+        stats_df["max"][valid], np.nanmax(arr[valid], axis=(1, 2))
+    )
+    np.testing.assert_array_equal(
+        stats_df["mean"][valid],
+        np.nanmean(arr[valid].reshape(198, -1), axis=1, dtype=np.float64),
+    )
+
+
+def make_ftimes(forecast_times, times, first_label=100):
+    """Forecast times table like read_ftimes, with row labels of a larger table"""
+    times = pd.DatetimeIndex(times)
+    forecast_times = np.array(forecast_times)
+    ftimes_df = pd.DataFrame(
+        {
+            "time": times,
+            "year": times.year,
+            "forecast_time": forecast_times,
+            "forecast_group": np.cumsum(forecast_times == 6),
+        },
+        index=np.arange(first_label, first_label + len(times)),
+    )
+
+    return ftimes_df
+
+
+def test_make_group_index():
+    hours = pd.Timedelta(hours=1)
+    start = pd.Timestamp("1999-12-31 22:00")
+    # four groups, one across the new year, one missing a time step, and one
+    #  with forecast_time not advancing with the timestamps
+    steps = [0, 1, 2, 3, 4, 5, 6, 8, 9, 10, 11, 12, 13]
+    forecast_times = [6, 7, 8, 9, 6, 7, 8, 10, 6, 7, 6, 7, 9]
+    ftimes_df = make_ftimes(forecast_times, [start + step * hours for step in steps])
+    groups_df = make_group_index(ftimes_df)
+
+    assert list(groups_df["forecast_group"]) == [1, 2, 3, 4]
+    assert list(groups_df["start"]) == [100, 104, 108, 110]
+    assert list(groups_df["end"]) == [104, 108, 110, 113]
+    assert list(groups_df["n_steps"]) == [4, 4, 2, 3]
+    assert list(groups_df["first_year"]) == [1999, 2000, 2000, 2000]
+    assert list(groups_df["last_year"]) == [2000, 2000, 2000, 2000]
+    assert list(groups_df["start_time"]) == list(ftimes_df["time"].iloc[[0, 4, 8, 10]])
+    assert list(groups_df["end_time"]) == list(ftimes_df["time"].iloc[[3, 7, 9, 12]])
+    assert list(groups_df["has_gap"]) == [False, True, False, False]
+    assert list(groups_df["ftime_mismatch"]) == [False, False, False, True]
+
+    # the groups of a year are slices of the table, with the groups on either side
+    groups, current_year_ind = get_accum_groups(ftimes_df, 1999, groups_df)
+    assert [list(df.index) for df in groups] == [
+        [100, 101, 102, 103],
+        [104, 105, 106, 107],
+    ]
+    assert list(current_year_ind) == [0, 1]
+
+
+def test_group_index_checks_rows():
+    hours = pd.Timedelta(hours=1)
+    start = pd.Timestamp("1999-12-31 22:00")
+    ftimes_df = make_ftimes([6, 7, 8, 9, 6, 7], [start + step * hours for step in range(6)])
+    groups_df = make_group_index(ftimes_df)
+    # the rows of 1999 only, as if the next year was not read
+    with pytest.raises(ValueError, match="Only 2 of the 4 rows"):
+        get_accum_groups(ftimes_df[ftimes_df["year"] == 1999], 1999, groups_df)
+    # rows left out of the table split the groups at them, without flagging a gap
+    groups_df = make_group_index(ftimes_df.iloc[[0, 1, 3, 4, 5]])
+    assert list(groups_df["forecast_group"]) == [1, 1, 2]
+    assert list(groups_df["start"]) == [100, 103, 104]
+    assert list(groups_df["end"]) == [102, 104, 106]
+    assert not groups_df["has_gap"].any()
+
+
+def test_read_group_index_csv_non_contiguous_years(tmp_path):
+    # hourly, with forecast_time groups starting in June and just before the new year
+    times = pd.date_range("1998-06-01 00:00", "2007-12-31 23:00", freq="h")
+    is_start = ((times.month == 6) & (times.day == 1) & (times.hour == 0)) | (
+        (times.month == 12) & (times.day == 31) & (times.hour == 22)
+    )
+    group_start = pd.Series(times.where(is_start)).ffill()
+    forecast_times = 6 + (times - group_start) // pd.Timedelta(hours=1)
+    ftimes_df = make_ftimes(forecast_times, times)
+    ftimes_fp = tmp_path.joinpath("forecast_times.csv")
+    ftimes_df.assign(
+        month=ftimes_df["time"].dt.month,
+        day=ftimes_df["time"].dt.day,
+        hour=ftimes_df["time"].dt.hour,
+    ).drop(columns=["time", "forecast_group"]).to_csv(ftimes_fp, index=False)
+
+    years = parse_year_str("2000_2005")
+    read_df = read_ftimes(ftimes_fp, years)
+    assert sorted(read_df["year"].unique()) == [1999, 2000, 2001, 2004, 2005, 2006]
+    groups_df = read_group_index(ftimes_fp, read_df)
+    assert not check_group_index(groups_df, years).size
+
+    for year in years:
+        groups, current_year_ind = get_accum_groups(read_df, year, groups_df)
+        # the groups of the year, and the June groups of the years on either side
+        assert [df["time"].iloc[0] for df in groups] == [
+            pd.Timestamp(time)
+            for time in [
+                f"{year - 1}-06-01 00:00",
+                f"{year - 1}-12-31 22:00",
+                f"{year}-06-01 00:00",
+                f"{year}-12-31 22:00",
+                f"{year + 1}-06-01 00:00",
+            ]
+        ]
+        year_times = pd.concat(groups)["time"].iloc[current_year_ind]
+        assert year_times.equals(year_times[year_times.dt.year == year])
+        assert len(year_times) == len(times[times.year == year])
+
+
+# first time step and number of time steps of each forecast_time group of the
+#  raw files of the wrf_group fixture, two of them spanning the new years
+group_steps = [
+    ("1999-12-31 10:00", 3),
+    ("1999-12-31 19:00", 9),
+    ("2000-01-01 04:00", 3),
+    ("2000-06-01 00:00", 6),
+    ("2000-12-31 20:00", 7),
+    ("2001-01-01 03:00", 3),
+    ("2001-06-01 00:00", 4),
+]
+wind_varnames = luts.wind_varnames + luts.wind_derived_varnames
+
+
+@pytest.fixture
+def wrf_group(tmp_path):
+    """Raw hourly files for a few days of 1999 to 2001 in annual subdirs, with
+    the geogrid file and forecast times table for them, and the data written to them"""
+    rng = np.random.default_rng(5)
+    ny, nx = 4, 5
+    times = pd.DatetimeIndex(
+        np.concatenate(
+            [pd.date_range(start, periods=n, freq="h") for start, n in group_steps]
+        )
+    )
+    forecast_times = np.concatenate([6 + np.arange(n) for _, n in group_steps])
+    data = {
+        "T2": rng.normal(270, 5, (len(times), ny, nx)),
+        # accumulations that reset at the start of each group
+        "PCPT": np.concatenate(
+            [np.cumsum(rng.uniform(0, 1, (n, ny, nx)), axis=0) for _, n in group_steps]
+        ),
+        "U10": rng.normal(0, 5, (len(times), ny, nx)),
+        "V10": rng.normal(0, 5, (len(times), ny, nx)),
+    }
+    data = {varname: arr.astype(np.float32) for varname, arr in data.items()}
+
+    dims = ("south_north", "west_east")
+    fps = []
+    for i, (time, forecast_time) in enumerate(zip(times, forecast_times)):
+        year_dir = tmp_path.joinpath("wrf", str(time.year))
+        year_dir.mkdir(parents=True, exist_ok=True)
+        fp = year_dir.joinpath(f"WRFDS_d01.{time:%Y-%m-%d_%H}.nc")
+        with netCDF4.Dataset(fp, "w", format="NETCDF3_64BIT_OFFSET") as nc:
+            nc.setncatts(
+                {
+                    "title": "test",
+                    "system": "test",
+                    "creation_date": "today",
+                    "NCL_Version": "6.6.2",
+                    "grib_source": "test",
+                    "proj_parameters": luts.global_attrs["proj_parameters"],
+                }
+            )
+            nc.createDimension("south_north", ny)
+            nc.createDimension("west_east", nx)
+            nc.createVariable(luts.lat_variable, "f4", dims)[:] = np.linspace(
+                60, 70, ny * nx
+            ).reshape(ny, nx)
+            nc.createVariable(luts.lon_variable, "f4", dims)[:] = np.linspace(
+                -160, -140, ny * nx
+            ).reshape(ny, nx)
+            for varname, arr in data.items():
+                var = nc.createVariable(varname, "f4", dims)
+                var.setncatts({"units": "test", "forecast_time": np.int32(forecast_time)})
+                var[:] = arr[i]
+        fps.append(fp)
+
+    ftimes_df = pd.DataFrame(
+        {
+            "filepath": fps,
+            "year": times.year,
+            "folder_year": times.year,
+            "month": times.month,
+            "day": times.day,
+            "hour": times.hour,
+            "forecast_time": forecast_times,
+            "time": times,
+        }
+    )
+    # forecast_time groups start at forecast_time 6
+    ftimes_df["forecast_group"] = (ftimes_df["forecast_time"] == 6).cumsum()
+
+    alpha = rng.uniform(-0.5, 0.5, (ny, nx))
+    geogrid_fp = tmp_path.joinpath("geo_em.d01.nc")
+    xr.Dataset(
+        {
+            "COSALPHA": (dims, np.cos(alpha).astype(np.float32)),
+            "SINALPHA": (dims, np.sin(alpha).astype(np.float32)),
+        },
+        attrs={"CEN_LON": -152.0, "CEN_LAT": 64.0, "DX": 20000.0, "DY": 20000.0},
+    ).to_netcdf(geogrid_fp)
+    raw_reader.layouts.clear()
+
+    return SimpleNamespace(
+        ftimes_df=ftimes_df,
+        geogrid_fp=geogrid_fp,
+        data=data,
+        alpha=alpha,
+        shape=(ny, nx),
+    )
+
+
+def expected_stacked(wrf_group, varname, year):
+    """Data of a variable for a year, as read from the raw files of the
+    wrf_group fixture, worked out from the data written to them a pixel at a time"""
+    data = wrf_group.data
+    is_year = (wrf_group.ftimes_df["year"] == year).values
+    if varname in luts.accum_varnames:
+        group_ids = wrf_group.ftimes_df["forecast_group"].values
+        arr = np.diff(data[varname], axis=0, prepend=np.nan)
+        arr[np.flatnonzero(np.diff(group_ids, prepend=0))] = np.nan
+        arr = np.apply_along_axis(interp_1d_along_axis, 0, arr)
+        arr[arr < 0] = 0
+    elif varname in wind_varnames:
+        cosalpha, sinalpha = np.cos(wrf_group.alpha), np.sin(wrf_group.alpha)
+        ue = data["U10"] * cosalpha - data["V10"] * sinalpha
+        ve = data["V10"] * cosalpha + data["U10"] * sinalpha
+        arr = {
+            "U10": ue,
+            "V10": ve,
+            "WSPD10": np.hypot(ue, ve),
+            # the direction the wind blows from, clockwise from north
+            "WDIR10": np.degrees(np.arctan2(-ue, -ve)) % 360,
+        }[varname]
+    else:
+        arr = data[varname]
+
+    return arr[is_year]
+
+
+def expected_restacked(wrf_group, varname, year):
+    """Data of a variable for a year as restacked, flipped along the y axis"""
+    return np.flip(expected_stacked(wrf_group, varname, year), axis=-2)
+
+
+def count_reads(monkeypatch):
+    """Record the files and variables read from with raw_reader.read_vars, for
+    reading with a thread pool"""
+    reads = []
+    read_vars = raw_reader.read_vars
+
+    def counted_read_vars(fp, varnames, key=None):
+        reads.append((fp, tuple(varnames)))
+        return read_vars(fp, varnames, key)
+
+    monkeypatch.setattr(raw_reader, "read_vars", counted_read_vars)
+
+    return reads
+
+
+def test_open_ds_vars_single_read(wrf_group, monkeypatch):
+    fp = wrf_group.ftimes_df["filepath"].iloc[0]
+    reads = count_reads(monkeypatch)
+    arrs = open_ds_vars(fp, ["T2", "PCPT", "U10", "V10"], ["U10", "V10"], wrf_group.geogrid_fp)
+
+    assert [fp for fp, _ in reads] == [fp]
+    np.testing.assert_array_equal(arrs["T2"], wrf_group.data["T2"][0])
+    np.testing.assert_array_equal(arrs["PCPT"], wrf_group.data["PCPT"][0])
+    for varname in ["U10", "V10"]:
+        np.testing.assert_allclose(
+            arrs[varname], expected_stacked(wrf_group, varname, 1999)[0], rtol=1e-5
+        )
+
+
+def test_restack_vars_single_read(wrf_group, monkeypatch):
+    reads = count_reads(monkeypatch)
+    ftimes_df = wrf_group.ftimes_df
+    varnames = ["T2", "PCPT", "U10", "WSPD10"]
+    n_year = int((ftimes_df["year"] == 2001).sum())
+    cubes = {varname: SharedCube((n_year,) + wrf_group.shape) for varname in varnames}
+    try:
+        # a thread pool, to record the files read. One thread, the netCDF
+        #  library is not thread safe
+        with ThreadPool(1) as pool:
+            arrs = restack_vars(
+                ftimes_df,
+                2001,
+                varnames,
+                luts.accum_varnames,
+                wind_varnames,
+                wrf_group.geogrid_fp,
+                pool,
+                cubes,
+            )
+        for varname in varnames:
+            np.testing.assert_allclose(
+                arrs[varname],
+                expected_restacked(wrf_group, varname, 2001),
+                rtol=1e-5,
+                atol=1e-4,
+            )
+        del arrs
+    finally:
+        for cube in cubes.values():
+            cube.release()
+
+    # every file of the year and of the forecast_time group before it, for the
+    #  accumulation variable, is read once, for all of the variables it is
+    #  needed for
+    read_df = ftimes_df[ftimes_df["time"] >= "2000-06-01"]
+    assert sorted(fp for fp, _ in reads) == sorted(read_df["filepath"])
+    for fp, src_varnames in reads:
+        if ftimes_df.set_index("filepath").loc[fp, "year"] == 2001:
+            assert sorted(src_varnames) == ["PCPT", "T2", "U10", "V10"]
+        else:
+            assert src_varnames == ("PCPT",)
+
+
+def test_restack_time_idx(wrf_group):
+    ftimes_df = wrf_group.ftimes_df
+    fps = list(ftimes_df["filepath"][:3])
+    with make_pool(2) as pool, SharedCube((3,) + wrf_group.shape) as cube:
+        arr = restack(fps, "T2", pool, cube, time_idx=[2, 0, 1])
+        assert arr is cube.arr
+        np.testing.assert_array_equal(
+            arr[[2, 0, 1]], np.flip(wrf_group.data["T2"][:3], axis=-2)
+        )
+        del arr
+
+
+class StarmapRecorder:
+    """Thread pool that records the number of starmap calls"""
+
+    def __init__(self):
+        self.pool = ThreadPool(1)
+        self.n_starmaps = 0
+
+    def starmap(self, *args, **kwargs):
+        self.n_starmaps += 1
+        return self.pool.starmap(*args, **kwargs)
+
+
+def test_restack_accum_one_pass(wrf_group, monkeypatch):
+    ftimes_df = wrf_group.ftimes_df
+    reads = count_reads(monkeypatch)
+    pool = StarmapRecorder()
+    n_year = int((ftimes_df["year"] == 2001).sum())
+    try:
+        with SharedCube((n_year,) + wrf_group.shape) as cube:
+            arr = restack_accum(ftimes_df, 2001, "PCPT", pool, cube)
+            np.testing.assert_allclose(
+                arr, expected_restacked(wrf_group, "PCPT", 2001), rtol=1e-6
+            )
+            del arr
+    finally:
+        pool.pool.terminate()
+
+    # the files of all of the groups are read with a single pass of the pool,
+    #  in chronological order
+    assert pool.n_starmaps == 1
+    read_df = ftimes_df[ftimes_df["time"] >= "2000-06-01"]
+    assert [fp for fp, _ in reads] == list(read_df["filepath"])
+
+
+def test_shared_cube_workers():
+    arr = np.arange(4 * 3 * 5, dtype=np.float64).reshape(4, 3, 5)
+    with Pool(2) as pool, SharedCube(arr.shape) as cube:
+        pool.starmap(write_to_cube, [(cube.spec, idx, arr[idx]) for idx in range(4)])
+        # written by the workers, as float32 and flipped along the y axis
+        assert cube.arr.dtype == np.float32
+        np.testing.assert_array_equal(cube.arr, np.flip(arr, axis=-2))
+        shm_name = cube.spec[0]
+    # the shared memory is gone once the cube is released
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=shm_name)
+
+
+@pytest.mark.parametrize("shared_dir", [False, True])
+def test_restack_accum_reuses_groups(wrf_group, monkeypatch, tmp_path, shared_dir):
+    ftimes_df = wrf_group.ftimes_df
+    reads = count_reads(monkeypatch)
+    cache_dir = tmp_path.joinpath("cache") if shared_dir else None
+    stacked_cache = StackedCache(cache_dir)
+    with ThreadPool(1) as pool:
+        for year in [2000, 2001]:
+            reads.clear()
+            if shared_dir:
+                # a separate job for each year
+                stacked_cache = StackedCache(cache_dir)
+            n_year = int((ftimes_df["year"] == year).sum())
+            with SharedCube((n_year,) + wrf_group.shape) as cube:
+                arr = restack_accum(ftimes_df, year, "PCPT", pool, cube, stacked_cache)
+                np.testing.assert_allclose(
+                    arr, expected_restacked(wrf_group, "PCPT", year), rtol=1e-6
+                )
+                del arr
+            if year == 2000:
+                # all of the groups of the year and the ones on either side
+                read_df = ftimes_df[ftimes_df["time"] < "2001-06-01"]
+            else:
+                # the groups shared with 2000 are not read again
+                read_df = ftimes_df[ftimes_df["time"] >= "2001-06-01"]
+            assert [fp for fp, _ in reads] == list(read_df["filepath"])
+
+
+def make_raw_files(tmp_path, n):
+    fps = []
+    for i in range(n):
+        fp = tmp_path.joinpath(f"WRFDS_d01.2000-01-01_{i:02d}.nc")
+        fp.write_bytes(b"raw")
+        fps.append(fp)
+
+    return fps
+
+
+def test_stacked_cache_shared_dir(tmp_path):
+    fps = make_raw_files(tmp_path, 4)
+    arr = np.arange(4 * 6, dtype=np.float32).reshape(4, 2, 3)
+    cache_dir = tmp_path.joinpath("cache")
+    cache_a, cache_b = StackedCache(cache_dir), StackedCache(cache_dir)
+    cache_a.keep("PCPT", fps[:2], arr[:2])
+    cache_b.keep("PCPT", fps[2:], arr[2:])
+    # a new cache finds the slices saved by both
+    cache_c = StackedCache(cache_dir)
+    for fp, arr_slice in zip(fps, arr):
+        assert np.array_equal(cache_c.get("PCPT", fp), arr_slice)
+
+    # replacing one cache's slices only removes the ones it saved
+    cache_a.keep("PCPT", fps[1:2], arr[1:2])
+    cache_d = StackedCache(cache_dir)
+    assert cache_d.get("PCPT", fps[0]) is None
+    for fp, arr_slice in zip(fps[1:], arr[1:]):
+        assert np.array_equal(cache_d.get("PCPT", fp), arr_slice)
+
+
+def test_stacked_cache_changed_file(tmp_path):
+    fps = make_raw_files(tmp_path, 2)
+    arr = np.ones((2, 2, 3), dtype=np.float32)
+    cache_dir = tmp_path.joinpath("cache")
+    StackedCache(cache_dir).keep("PCPT", fps, arr)
+    # a recopied file with a new modification time is not taken from the cache
+    stat = os.stat(fps[0])
+    os.utime(fps[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    cache = StackedCache(cache_dir)
+    assert cache.get("PCPT", fps[0]) is None
+    assert np.array_equal(cache.get("PCPT", fps[1]), arr[1])
+
+
+def test_parse_year_str():
+    assert parse_year_str("2000") == [2000]
+    assert parse_year_str("2000-2003") == [2000, 2001, 2002, 2003]
+    assert parse_year_str("2000_2002_2005") == [2000, 2002, 2005]
+
+
+def restack_years(wrf_group, years, varnames, out_dir, **kwargs):
+    """Restack years in one process with one pool, same as restack.py does, and get
+    the output paths for each year"""
+    out_fps = {
+        year: {
+            varname: out_dir.joinpath(varname.lower(), f"{varname.lower()}_{year}.nc")
+            for varname in varnames
+        }
+        for year in years
+    }
+    stacked_cache = StackedCache()
+    with make_pool(2) as pool:
+        for year in years:
+            restack_year(
+                wrf_group.ftimes_df,
+                year,
+                varnames,
+                out_fps[year],
+                luts,
+                wrf_group.geogrid_fp,
+                pool,
+                stacked_cache,
+                **kwargs,
+            )
+
+    return out_fps
+
+
+def test_restack_multiple_years(wrf_group, tmp_path):
+    varnames = ["T2", "PCPT", "U10"]
+    out_fps = restack_years(wrf_group, [2000, 2001], varnames, tmp_path.joinpath("multi"))
+    ftimes_df = wrf_group.ftimes_df
+    for year in [2000, 2001]:
+        for varname in varnames:
+            with xr.open_dataset(out_fps[year][varname]) as ds:
+                da = ds[varname.lower()]
+                assert list(ds.indexes["time"]) == list(
+                    ftimes_df["time"][ftimes_df["year"] == year]
+                )
+                assert da.dims == ("time", "yc", "xc")
+                np.testing.assert_allclose(
+                    da.values, expected_restacked(wrf_group, varname, year), rtol=1e-5
+                )
+
+    # the same as restacking the year on its own
+    (single_fps,) = restack_years(
+        wrf_group, [2001], varnames, tmp_path.joinpath("single")
+    ).values()
+    for varname in varnames:
+        with xr.open_dataset(out_fps[2001][varname]) as ds, xr.open_dataset(
+            single_fps[varname]
+        ) as single_ds:
+            np.testing.assert_array_equal(
+                ds[varname.lower()].values, single_ds[varname.lower()].values
+            )
+
+
+def test_open_ds_vars_rotates_once(wrf_group, monkeypatch):
+    fp = wrf_group.ftimes_df["filepath"].iloc[0]
+    varnames = ["T2", "U10", "V10", "WSPD10", "WDIR10"]
+    reads = count_reads(monkeypatch)
+    rotations = []
+    rotate_grid_winds = restack_module.rotate_grid_winds
+
+    def counted_rotate_grid_winds(Ugrid, Vgrid, geogrid_fp):
+        rotations.append(geogrid_fp)
+        return rotate_grid_winds(Ugrid, Vgrid, geogrid_fp)
+
+    monkeypatch.setattr(restack_module, "rotate_grid_winds", counted_rotate_grid_winds)
+    arrs = open_ds_vars(fp, varnames, wind_varnames, wrf_group.geogrid_fp)
+
+    # one read of the file and one rotation for all of the wind variables
+    assert reads == [(fp, ("T2", "U10", "V10"))]
+    assert len(rotations) == 1
+    np.testing.assert_array_equal(arrs["T2"], wrf_group.data["T2"][0])
+    for varname in varnames[1:]:
+        np.testing.assert_array_equal(
+            arrs[varname], run_rotate_winds(fp, varname, wrf_group.geogrid_fp)
+        )
+        np.testing.assert_allclose(
+            arrs[varname],
+            expected_stacked(wrf_group, varname, 1999)[0],
+            rtol=1e-5,
+            atol=1e-4,
+        )
+
+
+def test_select_wind():
+    # winds blowing from the north, east, south and west
+    ue = np.array([0.0, -3.0, 0.0, 4.0])
+    ve = np.array([-2.0, 0.0, 1.0, 0.0])
+    np.testing.assert_array_equal(select_wind("U10", ue, ve), ue)
+    np.testing.assert_array_equal(select_wind("VBOT", ue, ve), ve)
+    np.testing.assert_array_equal(select_wind("WSPD10", ue, ve), [2, 3, 1, 4])
+    np.testing.assert_array_equal(select_wind("WDIR10", ue, ve), [0, 90, 180, 270])
+
+
+def get_rotation_cache_size(_=None):
+    """Number of geogrid files whose rotation fields a pool worker has loaded"""
+    return get_rotation_coefs.cache_info().currsize
+
+
+def test_rotation_coefs_loaded_once_per_worker(wrf_group):
+    get_rotation_coefs.cache_clear()
+    cosalpha, sinalpha = get_rotation_coefs(wrf_group.geogrid_fp)
+    np.testing.assert_allclose(cosalpha, np.cos(wrf_group.alpha), rtol=1e-6)
+    # cached, and read-only since the same arrays are used for every file
+    assert get_rotation_coefs(wrf_group.geogrid_fp)[0] is cosalpha
+    assert not cosalpha.flags.writeable and not sinalpha.flags.writeable
+    get_rotation_coefs.cache_clear()
+
+    with make_pool(2) as pool:
+        assert pool.map(get_rotation_cache_size, range(2)) == [0, 0]
+    ftimes_df = wrf_group.ftimes_df
+    fps = list(ftimes_df["filepath"][ftimes_df["year"] == 2000])
+    with make_pool(2, wrf_group.geogrid_fp) as pool:
+        # loaded by each worker at startup, before rotating any winds
+        assert pool.map(get_rotation_cache_size, range(2)) == [1, 1]
+        with SharedCube((len(fps),) + wrf_group.shape) as cube:
+            arr = restack_winds(fps, "V10", wrf_group.geogrid_fp, pool, cube)
+            np.testing.assert_allclose(
+                arr, expected_restacked(wrf_group, "V10", 2000), rtol=1e-5, atol=1e-5
+            )
+            del arr
+        assert pool.map(get_rotation_cache_size, range(2)) == [1, 1]
+    # the parent process never loaded them
+    assert get_rotation_cache_size() == 0
+
+
+class BlockRecorder:
+    """Stands in for a RestackedWriter, keeping copies of the blocks written"""
+
+    def __init__(self, shape, chunk_steps):
+        self.shape = shape
+        self.chunk_steps = chunk_steps
+        self.blocks = []
+
+    def write(self, start, arr):
+        self.blocks.append((start, np.array(arr)))
+
+
+def test_restack_blocks(wrf_group, monkeypatch):
+    # record the shared memory allocated
+    cube_shapes = []
+    shared_cube = restack_module.SharedCube
+
+    def recorded_shared_cube(shape):
+        cube_shapes.append(tuple(shape))
+        return shared_cube(shape)
+
+    monkeypatch.setattr(restack_module, "SharedCube", recorded_shared_cube)
+    ftimes_df = wrf_group.ftimes_df
+    fps = list(ftimes_df["filepath"][ftimes_df["year"] == 2000])
+    writers = {
+        varname: BlockRecorder((len(fps),) + wrf_group.shape, chunk_steps)
+        for varname, chunk_steps in [("T2", 3), ("WSPD10", 2)]
+    }
+    with make_pool(2, wrf_group.geogrid_fp) as pool:
+        restack_blocks(
+            fps, list(writers), wind_varnames, wrf_group.geogrid_fp, pool, writers, 7
+        )
+
+    # only two blocks of each variable are held in memory, one being read
+    #  and one being written
+    assert cube_shapes == [(6,) + wrf_group.shape] * 4
+    for varname, writer in writers.items():
+        # rounded down to whole chunks of the longest chunk length
+        assert [(start, len(arr)) for start, arr in writer.blocks] == [
+            (0, 6),
+            (6, 6),
+            (12, 5),
+        ]
+        np.testing.assert_allclose(
+            np.concatenate([arr for _, arr in writer.blocks]),
+            expected_restacked(wrf_group, varname, 2000),
+            rtol=1e-5,
+        )
+
+
+def test_restack_year_blocks(wrf_group, tmp_path):
+    varnames = ["T2", "PCPT", "WDIR10"]
+    year_fps = restack_years(wrf_group, [2000], varnames, tmp_path.joinpath("year"))[2000]
+    block_fps = restack_years(
+        wrf_group,
+        [2000],
+        varnames,
+        tmp_path.joinpath("blocks"),
+        block_steps=4,
+        profile="map-optimized",
+    )[2000]
+    for varname in varnames:
+        with xr.open_dataset(year_fps[varname]) as year_ds, xr.open_dataset(
+            block_fps[varname]
+        ) as block_ds:
+            da = block_ds[varname.lower()]
+            np.testing.assert_array_equal(da.values, year_ds[varname.lower()].values)
+            assert da.encoding["chunksizes"][0] == 1
+
+
+def test_restack_year_daily_outputs(wrf_group, tmp_path, monkeypatch):
+    varnames = ["T2", "PCPT", "U10"]
+    daily_dir = tmp_path.joinpath("daily")
+    daily_outputs = get_daily_outputs(varnames, luts, daily_dir, "test", 2000)
+    # only the variables with daily aggregates in luts.resample_varnames
+    assert {
+        varname: [(aggr, out_varname) for aggr, out_varname, _ in outputs]
+        for varname, outputs in daily_outputs.items()
+    } == {
+        "T2": [("max", "t2max"), ("min", "t2min"), ("mean", "t2")],
+        "PCPT": [("sum", "pcpt")],
+    }
+    # record the files opened with xarray while restacking
+    opened = []
+    open_dataset = xr.open_dataset
+
+    def counted_open_dataset(fp, *args, **kwargs):
+        opened.append(fp)
+        return open_dataset(fp, *args, **kwargs)
+
+    monkeypatch.setattr(xr, "open_dataset", counted_open_dataset)
+    out_fps = restack_years(
+        wrf_group,
+        [2000],
+        varnames,
+        tmp_path.joinpath("hourly"),
+        block_steps=4,
+        daily_outputs=daily_outputs,
+    )[2000]
+    monkeypatch.undo()
+    # the daily data are resampled from memory, not from the restacked files
+    assert not set(opened) & set(out_fps.values())
+
+    # the same as resampling the restacked files with resample.py
+    for varname, outputs in daily_outputs.items():
+        for aggr, out_varname, out_fp in outputs:
+            resample_fp = tmp_path.joinpath("resampled", out_fp.name)
+            resample_fp.parent.mkdir(exist_ok=True)
+            resample(out_fps[varname], aggr, varname.lower(), out_varname, resample_fp)
+            with xr.open_dataset(out_fp) as ds, xr.open_dataset(resample_fp) as resample_ds:
+                assert list(ds.data_vars) == [out_varname]
+                assert ds.indexes["time"].equals(resample_ds.indexes["time"])
+                # a day with data, most days of the sparse year have none
+                assert not np.isnan(ds[out_varname].sel(time="2000-06-01")).any()
+                np.testing.assert_array_equal(
+                    ds[out_varname].values, resample_ds[out_varname].values
+                )
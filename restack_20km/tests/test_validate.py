@@ -0,0 +1,219 @@
+import tracemalloc
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+import luts
+import restack
+from resample import aggregate_daily, daily_reducers
+from validate import (
+    AccumExpected,
+    fill_nan_linear,
+    get_expected_winds,
+    get_group_blocks,
+    MismatchCounter,
+    validate_resampled_file_full,
+    validate_restacked_year,
+)
+
+
+def make_accum(n_steps, seed=0):
+    """Accumulations that reset at the start of each forecast_time group"""
+    rng = np.random.default_rng(seed)
+    group_ids = np.repeat(np.arange(3, 3 + len(n_steps)), n_steps)
+    stacked_arr = np.concatenate(
+        [np.cumsum(rng.uniform(0, 1, (n, 4, 5)), axis=0) for n in n_steps]
+    ).astype(np.float32)
+
+    return stacked_arr, group_ids
+
+
+@pytest.mark.parametrize("block_steps", [1, 7, 100])
+@pytest.mark.parametrize(
+    "n_steps",
+    [
+        [5, 8, 8, 6],
+        # groups with a single time step have no valid differences
+        [5, 1, 8, 1, 1, 6, 4],
+        [1, 6, 1],
+    ],
+)
+def test_accum_expected(n_steps, block_steps):
+    stacked_arr, group_ids = make_accum(n_steps)
+    accum_expected = AccumExpected()
+    arrs = []
+    for start, stop in get_group_blocks(group_ids, block_steps):
+        arrs.append(accum_expected.update(stacked_arr[start:stop], group_ids[start:stop]))
+    arrs.append(accum_expected.finish())
+    expected = np.concatenate(arrs)
+
+    groups = [stacked_arr[group_ids == group_id] for group_id in np.unique(group_ids)]
+    arr = restack.diff_interp_groups(groups, np.arange(len(group_ids)))
+    np.testing.assert_array_equal(expected, arr)
+    assert (expected >= 0).all()
+
+
+def test_get_group_blocks():
+    group_ids = np.repeat([3, 4, 5, 6, 7], [5, 8, 2, 6, 3])
+    blocks = get_group_blocks(group_ids, 7)
+    assert blocks == [(0, 13), (13, 21), (21, 24)]
+    # at least one group in each block
+    assert get_group_blocks(group_ids, 1)[:2] == [(0, 5), (5, 13)]
+
+
+def test_fill_nan_linear():
+    arr = make_accum([12])[0].astype(np.float64)
+    # whole NaN slices, NaNs of single pixels, and a pixel with no valid values
+    arr[[0, 4, 5, 11]] = np.nan
+    arr[7, 1, 2] = np.nan
+    arr[1:3, 0, 0] = np.nan
+    arr[:, 3, 4] = np.nan
+    expected = arr.copy()
+    for i, j in np.ndindex(arr.shape[1:]):
+        if not np.isnan(arr[:, i, j]).all():
+            expected[:, i, j] = restack.interp_1d_along_axis(arr[:, i, j].copy())
+    np.testing.assert_array_equal(fill_nan_linear(arr), expected)
+
+
+def test_validate_restacked_year_bounded_memory(tmp_path):
+    rng = np.random.default_rng(2)
+    ny, nx = 40, 50
+    # daily files in groups of four, from the end of 1999 to the start of 2001
+    times = pd.date_range("1999-12-25", "2001-01-05", freq="D")
+    forecast_times = 6 + 24 * (np.arange(len(times)) % 4)
+    stacked_arr = np.concatenate(
+        [np.cumsum(rng.uniform(0, 1, (4, ny, nx)), axis=0) for _ in range(0, len(times), 4)]
+    )[: len(times)].astype(np.float32)
+    fps = []
+    for time, forecast_time, arr in zip(times, forecast_times, stacked_arr):
+        fp = tmp_path.joinpath(f"WRFDS_d01.{time:%Y-%m-%d_%H}.nc")
+        xr.Dataset(
+            {"PCPT": (("south_north", "west_east"), arr, {"forecast_time": forecast_time})}
+        ).to_netcdf(fp)
+        fps.append(fp)
+    ftimes_df = pd.DataFrame(
+        {
+            "filepath": fps,
+            "time": times,
+            "year": times.year,
+            "folder_year": times.year,
+            "forecast_time": forecast_times,
+        }
+    )
+
+    # the original restack_accum, one pixel at a time
+    group_ids = (ftimes_df["forecast_time"] == 6).cumsum().values
+    arr = np.concatenate([np.full((1, ny, nx), np.nan), np.diff(stacked_arr, axis=0)])
+    arr[np.flatnonzero(np.diff(group_ids, prepend=0))] = np.nan
+    arr = np.apply_along_axis(restack.interp_1d_along_axis, 0, arr)[times.year == 2000]
+    arr[arr < 0] = 0
+    restack_fp = tmp_path.joinpath("pcpt_2000.nc")
+    year_times = times[times.year == 2000]
+    xr.Dataset(
+        {"pcpt": (("time", "yc", "xc"), np.flip(arr, axis=-2).astype(np.float32))},
+        coords={"time": year_times},
+    ).to_netcdf(restack_fp)
+    # size of the data that were read for the year, as float64
+    full_size = len(times) * ny * nx * 8
+
+    tracemalloc.start()
+    try:
+        # a thread so that the memory of reading the files is traced, one
+        #  since the netCDF library is not thread safe
+        with ThreadPool(1) as pool:
+            (result,) = validate_restacked_year(
+                ftimes_df, 2000, {"PCPT": restack_fp}, luts, None, pool, block_steps=12
+            )
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert result["match"]
+    assert result["n_values"] == len(year_times) * ny * nx
+    assert peak < full_size / 3
+
+
+@pytest.mark.parametrize("varname", ["U10", "V10", "WSPD10", "WDIR10"])
+def test_get_expected_winds(tmp_path, varname):
+    rng = np.random.default_rng(1)
+    alpha = rng.uniform(-0.5, 0.5, (4, 5))
+    geogrid_fp = tmp_path.joinpath("geo_em.d01.nc")
+    xr.Dataset(
+        {
+            "COSALPHA": (("south_north", "west_east"), np.cos(alpha).astype(np.float32)),
+            "SINALPHA": (("south_north", "west_east"), np.sin(alpha).astype(np.float32)),
+        }
+    ).to_netcdf(geogrid_fp)
+    Ugrid, Vgrid = rng.normal(0, 5, (2, 6, 4, 5)).astype(np.float32)
+    cosalpha, sinalpha = restack.get_rotation_coefs(geogrid_fp)
+
+    expected = get_expected_winds(varname, Ugrid, Vgrid, cosalpha, sinalpha)
+    ue, ve = restack.rotate_grid_winds(Ugrid, Vgrid, geogrid_fp)
+    np.testing.assert_array_equal(expected, restack.select_wind(varname, ue, ve))
+    # rotating keeps the wind speed
+    np.testing.assert_allclose(
+        np.hypot(*restack.rotate_grid_winds(Ugrid, Vgrid, geogrid_fp)),
+        np.hypot(Ugrid, Vgrid),
+        rtol=1e-5,
+    )
+
+
+@pytest.mark.parametrize(
+    "atol, rtol, n_mismatch, max_abs_error",
+    [(0.0, 0.0, 3, 0.05), (1e-5, 0.0, 2, 0.05), (0.0, 1e-3, 1, 0.0)],
+)
+def test_mismatch_counter(atol, rtol, n_mismatch, max_abs_error):
+    expected = np.full((3, 2, 2), 100, dtype=np.float32)
+    expected[0, 0, 0] = np.nan
+    actual = expected.copy()
+    # one ulp, a small relative difference, a NaN in the wrong place
+    actual[0, 1, 1] = np.nextafter(np.float32(100), np.float32(101))
+    actual[1, 0, 0] = 100.05
+    actual[2, 1, 0] = np.nan
+    counter = MismatchCounter(atol, rtol)
+    counter.update(expected, actual)
+    result = counter.result()
+
+    assert result["n_values"] == 12
+    assert result["n_mismatch"] == n_mismatch
+    assert result["n_nan_mismatch"] == 1
+    assert result["match"] == (n_mismatch == 0)
+    assert result["max_abs_error"] == pytest.approx(max_abs_error, rel=1e-3)
+
+
+@pytest.mark.parametrize("aggr", list(daily_reducers))
+def test_validate_resampled_file_full(tmp_path, aggr):
+    rng = np.random.default_rng(3)
+    times = pd.date_range("2000-01-01", periods=6 * 24, freq="h")
+    arr = rng.normal(280, 10, (len(times), 3, 4)).astype(np.float32)
+    arr[30, 1, 2] = np.nan
+    # drop an hour of the second day and all of the fifth day
+    keep = np.ones(len(times), dtype=bool)
+    keep[40] = False
+    keep[96:120] = False
+    times, arr = times[keep], arr[keep]
+    hourly_fp = tmp_path.joinpath("t2_hourly.nc")
+    xr.Dataset(
+        {"t2": (("time", "yc", "xc"), arr)}, coords={"time": times}
+    ).to_netcdf(hourly_fp)
+    daily_dates, daily_arr, _ = aggregate_daily(arr, times, aggr)
+    daily_fp = tmp_path.joinpath("t2_daily.nc")
+    daily_ds = xr.Dataset(
+        {"t2_daily": (("time", "yc", "xc"), daily_arr)}, coords={"time": daily_dates}
+    )
+    daily_ds.to_netcdf(daily_fp)
+
+    args = (daily_fp, hourly_fp, "t2_daily", "t2", aggr, 4, 0.0, 0.0)
+    result = validate_resampled_file_full(args)
+    assert result["match"]
+    assert result["n_values"] == daily_arr.size
+
+    # a wrong value, and a value for the day with no time steps
+    daily_arr[2, 0, 1] += 1
+    daily_arr[4, 2, 3] = 0
+    daily_ds.to_netcdf(daily_fp)
+    result = validate_resampled_file_full(args)
+    assert result["n_mismatch"] == 2
+    assert result["n_nan_mismatch"] == 1
+    assert result["n_steps_mismatch"] == 2
@@ -0,0 +1,514 @@
+"""Full-coverage validation of the restacked and resampled outputs. Every time step of every output file is
+compared with values recomputed from the source data: the restacked hourly files with the raw hourly files
+(including the rotated wind and the differenced accumulation variables, computed independently of the code
+in restack.py so that its bugs are not reproduced), and the daily files with the restacked hourly files
+(aggregated with xarray, independently of resample.py). The data are streamed in blocks of time steps, so memory
+use is bounded, and the raw files are read by a pool of workers.
+
+Usage:
+    Called by qc.py with the --full switch
+"""
+
+import time
+import netCDF4
+import numpy as np
+import xarray as xr
+# project
+from restack import get_wind_component_names, get_year_dates
+
+
+class MismatchCounter:
+    """Count the values that differ between expected and actual arrays, treating
+    NaNs in the same places as equal, and keep the maximum absolute error. Values
+    differ when |expected - actual| > atol + rtol * |expected|, same as numpy.isclose,
+    or when only one of them is NaN.
+
+    Args:
+        atol (float): absolute tolerance
+        rtol (float): relative tolerance
+    """
+
+    def __init__(self, atol=0.0, rtol=0.0):
+        self.atol = atol
+        self.rtol = rtol
+        self.n_values = 0
+        self.n_mismatch = 0
+        self.n_nan_mismatch = 0
+        self.n_steps_mismatch = 0
+        self.max_abs_error = 0.0
+
+    def update(self, expected, actual):
+        """Compare a block of time steps, time dimension first"""
+        expected = expected.astype(np.float64, copy=False)
+        actual = actual.astype(np.float64, copy=False)
+        nan_mismatch = np.isnan(expected) != np.isnan(actual)
+        with np.errstate(invalid="ignore"):
+            abs_error = np.abs(expected - actual)
+            # NaN errors are False here, they are counted as NaN mismatches
+            value_mismatch = abs_error > self.atol + self.rtol * np.abs(expected)
+        mismatch = value_mismatch | nan_mismatch
+        self.n_values += expected.size
+        self.n_mismatch += int(mismatch.sum())
+        self.n_nan_mismatch += int(nan_mismatch.sum())
+        self.n_steps_mismatch += int(mismatch.reshape(len(mismatch), -1).any(axis=1).sum())
+        if value_mismatch.any():
+            self.max_abs_error = max(
+                self.max_abs_error, float(abs_error[value_mismatch].max())
+            )
+
+        return
+
+    def result(self):
+        return {
+            "n_values": self.n_values,
+            "n_mismatch": self.n_mismatch,
+            "n_nan_mismatch": self.n_nan_mismatch,
+            "n_steps_mismatch": self.n_steps_mismatch,
+            "max_abs_error": self.max_abs_error,
+            "match": self.n_mismatch == 0,
+        }
+
+
+class RestackedComparer:
+    """Compare the expected data of a variable with an existing restacked file, handed
+    over in blocks of time steps with the write method of restack.RestackedWriter. The file is read in chunks of
+    time steps as the blocks are handed over, so only one chunk of it is held in memory.
+
+    Args:
+        restack_fp (pathlib.Path): path to the restacked file to check
+        varname (str): name of the WRF variable
+        new_dates (pandas.DatetimeIndex): timestamps that the file should have
+        atol (float): absolute tolerance, see MismatchCounter
+        rtol (float): relative tolerance, see MismatchCounter
+    """
+
+    def __init__(self, restack_fp, varname, new_dates, atol=0.0, rtol=0.0):
+        with xr.open_dataset(restack_fp) as ds:
+            file_dates = ds["time"].values
+        self.time_match = np.array_equal(file_dates, new_dates.values)
+        self.out_fp = restack_fp
+        self.nc = netCDF4.Dataset(restack_fp)
+        self.var = self.nc.variables[varname.lower()]
+        # NaNs are the fill value, no need for masked arrays
+        self.var.set_auto_mask(False)
+        self.shape = (len(new_dates),) + self.var.shape[1:]
+        chunking = self.var.chunking()
+        self.chunk_steps = 1 if chunking == "contiguous" else chunking[0]
+        self.n_file_steps = self.var.shape[0]
+        self.counter = MismatchCounter(atol, rtol)
+
+    def write(self, start, arr):
+        """Compare a block of time steps with the file, see RestackedWriter.write"""
+        for i in range(0, arr.shape[0], self.chunk_steps):
+            stop = min(start + i + self.chunk_steps, start + len(arr), self.n_file_steps)
+            if stop <= start + i:
+                break
+            actual = self.var[start + i : stop]
+            self.counter.update(arr[i : i + len(actual)], actual)
+
+        return
+
+    def close(self):
+        if self.nc.isopen():
+            self.nc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def result(self):
+        result = self.counter.result()
+        result["time_match"] = self.time_match
+        result["match"] = result["match"] and self.time_match
+
+        return result
+
+
+def read_raw_vars(fp, varnames):
+    """Read variables from a raw hourly WRF file with xarray, instead of the
+    reader in raw_reader.py that the files are restacked with
+
+    Args:
+        fp (path_like): path to the raw hourly WRF file
+        varnames (list): names of the variables to read
+
+    Returns:
+        dict of arrays keyed by variable name
+    """
+    with xr.open_dataset(fp) as ds:
+        arrs = {varname: ds[varname].values for varname in varnames}
+
+    return arrs
+
+
+def get_expected_winds(varname, Ugrid, Vgrid, cosalpha, sinalpha):
+    """Rotate grid-relative wind components to earth-relative and get the data for
+    a wind variable, see http://www2.mmm.ucar.edu/wrf/users/FAQ_files/Miscellaneous.html
+
+    Args:
+        varname (str): name of the wind variable, a wind component, or wind
+            speed ("WSPD*") or direction ("WDIR*")
+        Ugrid (numpy.ndarray): grid-relative U wind component, stacked along time
+        Vgrid (numpy.ndarray): grid-relative V wind component, stacked along time
+        cosalpha (numpy.ndarray): COSALPHA field of the geogrid file
+        sinalpha (numpy.ndarray): SINALPHA field of the geogrid file
+
+    Returns:
+        numpy.ndarray of the data for varname
+    """
+    Uearth = (Ugrid * cosalpha) - (Vgrid * sinalpha)
+    Vearth = (Vgrid * cosalpha) + (Ugrid * sinalpha)
+    if varname.startswith("WSPD"):
+        return np.sqrt(Uearth ** 2 + Vearth ** 2)
+    if varname.startswith("WDIR"):
+        # meteorological convention, the direction the wind is blowing from
+        return np.degrees(np.arctan2(-Uearth, -Vearth)) % 360
+    if varname.startswith("U"):
+        return Uearth
+
+    return Vearth
+
+
+def fill_nan_linear(arr):
+    """Fill the NaNs of an array by linear interpolation along the time dimension
+    between the nearest valid values of each pixel, holding the first and last valid
+    values constant before and after them (same as numpy.interp). The positions of
+    the valid values on either side are found for every pixel at once, instead of
+    interpolating one pixel at a time. Pixels with no valid values are left as NaN.
+
+    Args:
+        arr (numpy.ndarray): float array, time dimension first
+
+    Returns:
+        numpy.ndarray of the filled data, arr itself if it is contiguous
+    """
+    flat = arr.reshape(arr.shape[0], -1)
+    nans = np.isnan(flat)
+    if not nans.any():
+        return arr
+    steps = np.arange(len(flat), dtype=np.int32)[:, None]
+    # position of the last valid value at or before, and the first at or
+    #  after, each time step of each pixel
+    before = np.maximum.accumulate(np.where(nans, -1, steps), axis=0)
+    after = np.minimum.accumulate(np.where(nans, len(flat), steps)[::-1], axis=0)[::-1]
+    t, pixel = np.nonzero(nans)
+    t0, t1 = before[t, pixel], after[t, pixel]
+    del before, after
+    has_before, has_after = t0 >= 0, t1 < len(flat)
+    y0 = flat[np.where(has_before, t0, 0), pixel].astype(np.float64)
+    y1 = flat[np.where(has_after, t1, 0), pixel].astype(np.float64)
+    both = has_before & has_after
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = (y1 - y0) / (t1 - t0)
+        filled = np.where(both, slope * (t - t0) + y0, np.nan)
+    filled = np.where(has_before & ~has_after, y0, filled)
+    filled = np.where(has_after & ~has_before, y1, filled)
+    flat[t, pixel] = filled
+
+    return flat.reshape(arr.shape)
+
+
+class AccumExpected:
+    """Compute the expected data of an accumulation variable from its raw data handed
+    over in blocks of whole forecast_time groups: the data are differenced within each
+    group, the gaps this leaves at the start of each group are filled by linear
+    interpolation (see fill_nan_linear), and negative values are set to 0, the same as
+    the original restack_accum but computed independently of restack.py. The time
+    steps after the last one without NaNs in a block (usually just the start of the
+    next group) are held back until the next block, along with that last time step
+    to interpolate from.
+    """
+
+    def __init__(self):
+        self.held = None
+        self.anchor = None
+
+    def update(self, stacked_arr, group_ids):
+        """Add a block of whole forecast_time groups
+
+        Args:
+            stacked_arr (numpy.ndarray): raw data of the block stacked along time
+            group_ids (numpy.ndarray): forecast_time group of each time step of the block
+
+        Returns:
+            numpy.ndarray of the expected data for the time steps finished with
+                this block, which follow those returned before
+        """
+        # the first time step of each group has no difference, this also
+        #  makes the array float64, same as the original
+        arr = np.concatenate(
+            [
+                np.full((1,) + stacked_arr.shape[1:], np.nan),
+                np.diff(stacked_arr, axis=0),
+            ]
+        )
+        arr[np.flatnonzero(np.diff(group_ids, prepend=group_ids[0] - 1))] = np.nan
+        if self.held is not None:
+            arr = np.concatenate([self.held, arr])
+
+        # the values up to a time step without NaNs do not depend on anything after it
+        (complete,) = np.nonzero(~np.isnan(arr).reshape(len(arr), -1).any(axis=1))
+        split = complete[-1] + 1 if len(complete) > 0 else 0
+        self.held = arr[split:]
+
+        return self.fill(arr[:split])
+
+    def finish(self):
+        """Get the expected data for the time steps held back"""
+        arr, self.held = self.held, None
+        if arr is None:
+            return np.empty((0,))
+
+        return self.fill(arr)
+
+    def fill(self, arr):
+        if len(arr) == 0:
+            return arr
+        if self.anchor is not None:
+            arr = fill_nan_linear(np.concatenate([self.anchor, arr]))[1:]
+        else:
+            arr = fill_nan_linear(arr)
+        self.anchor = arr[-1:].copy()
+        arr[arr < 0] = 0
+
+        return arr
+
+
+def get_group_blocks(group_ids, block_steps):
+    """Split time steps into blocks of whole forecast_time groups of
+    about block_steps time steps, at least one group each
+
+    Args:
+        group_ids (numpy.ndarray): forecast_time group of each time step, in order
+        block_steps (int): number of time steps to aim for in each block
+
+    Returns:
+        list of (start, stop) positions of each block
+    """
+    starts = np.flatnonzero(np.diff(group_ids, prepend=group_ids[0] - 1))
+    bounds = [0]
+    for start in starts[1:]:
+        if start - bounds[-1] >= block_steps:
+            bounds.append(start)
+    bounds.append(len(group_ids))
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def validate_restacked_year(
+    ftimes_df,
+    year,
+    restack_fps,
+    luts,
+    geogrid_fp,
+    pool,
+    block_steps=240,
+    atol=0.0,
+    rtol=0.0,
+):
+    """Compare every time step of the restacked files of a year with values computed
+    from the raw files independently of restack.py: the raw files are read with xarray,
+    the wind components are rotated with the plain rotation formula, and the accumulation
+    variables are differenced and interpolated as in the original restack_accum (see
+    AccumExpected), using forecast_time groups made from the forecast times table.
+    All variables are checked from a single read of each raw file, in blocks of whole
+    forecast_time groups when there are accumulation variables, so only about one
+    block of each variable is held in memory.
+
+    Args:
+        ftimes_df (pandas.DataFrame): table containing parsed filename
+            and forecast times
+        year (int): year being checked
+        restack_fps (dict): paths to the restacked files of the year keyed by WRF variable name
+        luts (module): the luts.py module for the restack_20km pipeline
+        geogrid_fp (path_like): path to the ancillary WRF geogrid file
+        pool (multiprocessing.Pool): worker pool to read the raw files with
+        block_steps (int): number of raw files to read and compare at a time, rounded
+            to whole forecast_time groups when there are accumulation variables
+        atol (float): absolute tolerance, see MismatchCounter
+        rtol (float): relative tolerance, see MismatchCounter
+
+    Returns:
+        list of dicts with the variable, year, file path, counts of mismatched values
+            and the maximum absolute error, see MismatchCounter
+    """
+    _, new_dates = get_year_dates(ftimes_df, year)
+    comparers = {
+        varname: RestackedComparer(restack_fp, varname, new_dates, atol, rtol)
+        for varname, restack_fp in restack_fps.items()
+    }
+    wind_varnames = luts.wind_varnames + luts.wind_derived_varnames
+    accum = [varname for varname in restack_fps if varname in luts.accum_varnames]
+    other = [varname for varname in restack_fps if varname not in accum]
+    raw_varnames = {
+        varname: list(get_wind_component_names(varname))
+        if varname in wind_varnames
+        else [varname]
+        for varname in other
+    }
+    year_read_varnames = sorted(set(accum).union(*raw_varnames.values()))
+    if any(varname in wind_varnames for varname in other):
+        with xr.open_dataset(geogrid_fp) as geo_ds:
+            cosalpha = geo_ds["COSALPHA"].values
+            sinalpha = geo_ds["SINALPHA"].values
+
+    # forecast_time groups start at forecast_time 6
+    group_ids = (ftimes_df["forecast_time"] == 6).cumsum().values
+    is_year = (ftimes_df["year"] == year).values
+    if len(accum) > 0:
+        # the groups of the year and the groups on either side of it
+        year_ids = group_ids[is_year]
+        keep = (group_ids >= year_ids.min() - 1) & (group_ids <= year_ids.max() + 1)
+    else:
+        keep = is_year
+    read_df = ftimes_df[keep]
+    group_ids, is_year = group_ids[keep], is_year[keep]
+
+    if len(accum) > 0:
+        blocks = get_group_blocks(group_ids, block_steps)
+    else:
+        blocks = [
+            (i, min(i + block_steps, len(read_df)))
+            for i in range(0, len(read_df), block_steps)
+        ]
+    accum_expected = {varname: AccumExpected() for varname in accum}
+    # positions of the year's time steps among those read
+    year_pos = np.cumsum(is_year) - is_year
+
+    def compare_accum(varname, start, arr):
+        """Compare the expected accumulation data for read positions from start"""
+        in_year = is_year[start : start + len(arr)]
+        if in_year.any():
+            comparers[varname].write(
+                year_pos[start + np.argmax(in_year)],
+                np.flip(arr[in_year].astype(np.float32), axis=-2),
+            )
+        return start + len(arr)
+
+    tic = time.perf_counter()
+    try:
+        n_accum_steps = dict.fromkeys(accum, 0)
+        n_year_steps = 0
+        for start, stop in blocks:
+            block_is_year = is_year[start:stop]
+            args = [
+                (fp, year_read_varnames if in_year else accum)
+                for fp, in_year in zip(
+                    read_df["filepath"].iloc[start:stop], block_is_year
+                )
+            ]
+            arrs = pool.starmap(read_raw_vars, args)
+            for varname in accum:
+                arr = accum_expected[varname].update(
+                    np.array([raw.pop(varname) for raw in arrs]),
+                    group_ids[start:stop],
+                )
+                n_accum_steps[varname] = compare_accum(
+                    varname, n_accum_steps[varname], arr
+                )
+                del arr
+
+            year_arrs = [arr for arr, in_year in zip(arrs, block_is_year) if in_year]
+            if len(year_arrs) == 0:
+                continue
+            for varname in other:
+                if varname in wind_varnames:
+                    Ugrid, Vgrid = [
+                        np.array([np.squeeze(arr[name]) for arr in year_arrs])
+                        for name in raw_varnames[varname]
+                    ]
+                    arr = get_expected_winds(varname, Ugrid, Vgrid, cosalpha, sinalpha)
+                else:
+                    arr = np.array([arr[varname] for arr in year_arrs])
+                # restacked data are flipped along the y axis
+                comparers[varname].write(
+                    n_year_steps, np.flip(arr.astype(np.float32), axis=-2)
+                )
+            n_year_steps += len(year_arrs)
+
+        for varname in accum:
+            compare_accum(
+                varname, n_accum_steps[varname], accum_expected[varname].finish()
+            )
+    finally:
+        for comparer in comparers.values():
+            comparer.close()
+    print(
+        f"Restacked files for {year} checked, time elapsed: "
+        f"{round((time.perf_counter() - tic) / 60, 1)}m"
+    )
+
+    results = []
+    for varname, comparer in comparers.items():
+        result = {"variable": varname.lower(), "year": year, "fp": str(comparer.out_fp)}
+        result.update(comparer.result())
+        results.append(result)
+
+    return results
+
+
+def get_expected_daily(hourly_da, aggr):
+    """Aggregate hourly data to daily with xarray's resample, instead of
+    resample.aggregate_daily that the daily files are made with
+
+    Args:
+        hourly_da (xarray.DataArray): hourly data with a time dimension
+        aggr (str): aggregation used for the daily data, e.g. "max" or "sum"
+
+    Returns:
+        xarray.DataArray of the daily data, missing values for days with no time steps
+    """
+    daily_da = getattr(hourly_da.resample(time="1D"), aggr)()
+    # xarray gives 0 for the sum of a day with no time steps
+    n_steps = hourly_da["time"].resample(time="1D").count()
+
+    return daily_da.where(n_steps > 0)
+
+
+def validate_resampled_file_full(args):
+    """Compare every day of a daily file with the daily aggregate of the restacked
+    hourly file it was resampled from, computed with xarray independently of
+    resample.py (see get_expected_daily), reading both files a block of days at a time.
+
+    Args:
+        args (tuple): argument tuple consisting of the following:
+            daily_fp (pathlib.Path): path to the daily file to check
+            hourly_fp (pathlib.Path): path to the restacked hourly file
+            varname (str): name of the daily variable
+            wrf_varname (str): name of the variable in the hourly file
+            aggr (str): aggregation used for the daily data, see resample.daily_reducers
+            block_days (int): number of days to compare at a time
+            atol (float): absolute tolerance, see MismatchCounter
+            rtol (float): relative tolerance, see MismatchCounter
+
+    Returns:
+        dict with the variable, file path, counts of mismatched values
+            and the maximum absolute error, see MismatchCounter
+    """
+    daily_fp, hourly_fp, varname, wrf_varname, aggr, block_days, atol, rtol = args
+    counter = MismatchCounter(atol, rtol)
+    with xr.open_dataset(hourly_fp) as hourly_ds, xr.open_dataset(daily_fp) as daily_ds:
+        times = hourly_ds.indexes["time"]
+        daily_dates = daily_ds.indexes["time"]
+        # first hourly time step of each day, hours are sorted
+        day_starts = np.searchsorted(times.values, daily_dates.values)
+        day_starts = np.append(day_starts, len(times))
+        for i in range(0, len(daily_dates), block_days):
+            j = min(i + block_days, len(daily_dates))
+            actual = daily_ds[varname][i:j].values
+            expected = np.full(actual.shape, np.nan, dtype=actual.dtype)
+            start, stop = day_starts[i], day_starts[j]
+            if stop > start:
+                daily_da = get_expected_daily(
+                    hourly_ds[wrf_varname][start:stop].load(), aggr
+                )
+                idx = daily_dates[i:j].get_indexer(daily_da.indexes["time"])
+                expected[idx[idx >= 0]] = daily_da.values[idx >= 0]
+            counter.update(expected, actual)
+
+    result = {"variable": varname, "fp": str(daily_fp)}
+    result.update(counter.result())
+
+    return result